@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# coding: utf-8
+""" Latency and throughput of ikvm.Kvm and ikvm.AsyncKvm against the loopback MockKvmServer
+
+request latency is the round trip of list_captures() waited one by one,
+command throughput is the rate of send_key() acked by server when issued back to back,
+with at most ACK_RING_SIZE commands of Kvm waiting for acks so that none is dropped before read, e.g.
+    python3 benchmarks/bench_kvm.py -n 10000 --delay 0.001
+"""
+import sys
+
+if __name__ != '__main__':
+    sys.exit(1)
+
+import os, argparse, asyncio
+from time import perf_counter
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__)))) # import ikvm in repo
+from ikvm import Kvm, AsyncKvm, ACK_RING_SIZE
+from ikvm._protocol import *
+from ikvm.server import MockKvmServer
+
+parser = argparse.ArgumentParser(description='Latency and throughput of iKVM clients without hardware')
+parser.add_argument('-n', '--number', type=int, default=10000, help='commands sent per case, default 10000')
+parser.add_argument('-r', '--requests', type=int, default=1000, help='requests waited per case, default 1000')
+parser.add_argument('--delay', type=float, default=0, help='second(s) server delays every response, default 0')
+args = parser.parse_args()
+
+def percentiles(costs): # p50, p99 and max in microsecond(s)
+    costs = sorted(costs)
+    return [costs[min(int(len(costs)*p), len(costs)-1)]*1e6 for p in (0.5, 0.99, 1)]
+
+def bench_kvm(port):
+    kvm = Kvm('127.0.0.1', port, 8080, heartbeat=0, mouse_interval=0)
+    res = kvm.start()
+    assert res['result'] == 'success', res
+    ## Request latency
+    costs = []
+    for i in range(args.requests):
+        begin = perf_counter()
+        assert kvm.list_captures()['result'] == 'success'
+        costs.append(perf_counter()-begin)
+    latency = percentiles(costs)
+    ## Command throughput, until all acks read
+    #  at most ACK_RING_SIZE commands wait for acks, so that no ack overflows the ring before read
+    kvm.read_acks()
+    acks = []
+    begin = perf_counter()
+    for i in range(args.number):
+        while i-len(acks) >= ACK_RING_SIZE:
+            read = kvm.read_acks(TIMEOUT)
+            assert read, 'ack timeout'
+            acks.extend(read)
+        kvm.send_key(KEY_PRESS if i%2 == 0 else KEY_RELEASE, 0x04)
+    while len(acks) < args.number:
+        read = kvm.read_acks(TIMEOUT)
+        assert read, 'only %d of %d acks read' %(len(acks), args.number)
+        acks.extend(read)
+    rate = len(acks)/(perf_counter()-begin)
+    assert all(ack['result'] == 'success' for ack in acks)
+    assert kvm.acks_dropped == 0, '%d acks dropped' %kvm.acks_dropped
+    writes = kvm.writes
+    kvm.end()
+    return latency, rate, writes
+
+async def bench_async_kvm(port):
+    kvm = AsyncKvm('127.0.0.1', port, 8080, heartbeat=0)
+    res = await kvm.start()
+    assert res['result'] == 'success', res
+    costs = []
+    for i in range(args.requests):
+        begin = perf_counter()
+        assert (await kvm.list_captures())['result'] == 'success'
+        costs.append(perf_counter()-begin)
+    latency = percentiles(costs)
+    begin = perf_counter()
+    acks = await asyncio.gather(*[
+        kvm.send_key(KEY_PRESS if i%2 == 0 else KEY_RELEASE, 0x04) for i in range(args.number)])
+    assert all(ack['result'] == 'success' for ack in acks)
+    rate = len(acks)/(perf_counter()-begin)
+    await kvm.end()
+    return latency, rate, None
+
+TIMEOUT = 4+args.delay # second(s) waiting for an ack
+server = MockKvmServer(delay=args.delay, record=False)
+res = server.start()
+assert res['result'] == 'success', res
+
+print('%-10s %10s %10s %10s %14s %8s' %('client', 'p50 (us)', 'p99 (us)', 'max (us)', 'commands/s', 'writes'))
+for name, bench in (('Kvm', bench_kvm), ('AsyncKvm', lambda port: asyncio.run(bench_async_kvm(port)))):
+    latency, rate, writes = bench(server.port)
+    print('%-10s %10.1f %10.1f %10.1f %14.0f %8s' %(name, *latency, rate, writes if writes is not None else '-'))
+server.end()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# coding: utf-8
+""" End-to-end cost of the MJPG ingest and render path against the local FakeMjpgStreamer
+
+ingest is MjpgClient.next_frame() reading an unthrottled stream, with and without Content-Length,
+render is decoding at reduced resolution, resizing into a canvas and blitting it as __render_cap_area() does, e.g.
+    python3 benchmarks/bench_mjpg.py -n 300 --resolution 1920x1080 --display 1280x720
+"""
+import sys
+
+if __name__ != '__main__':
+    sys.exit(1)
+
+import os, argparse
+from time import perf_counter
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__)))) # import ikvm in repo
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy') # no window needed
+from ikvm import MjpgClient
+from ikvm.streamer import FakeMjpgStreamer, PatternSource, DirectorySource
+
+resolution = lambda reso: tuple((int(x) for x in reso.split('x')))
+parser = argparse.ArgumentParser(description='Cost of MJPG ingest and render path without hardware')
+parser.add_argument('-n', '--number', type=int, default=300, help='frames per case, default 300')
+parser.add_argument('--resolution', type=resolution, default=(1920, 1080), help='generated frame resolution, default 1920x1080')
+parser.add_argument('--quality', type=int, default=80, help='generated jpeg quality, default 80')
+parser.add_argument('--source', help='directory of jpeg files replayed instead of generated frames')
+parser.add_argument('--display', type=resolution, default=(1280, 720), help='capture area rendered into, default 1280x720')
+parser.add_argument('--rate', type=int, default=0, help='bytes per second of the link, default unlimited')
+args = parser.parse_args()
+
+source = DirectorySource(args.source) if args.source else PatternSource(args.resolution, args.quality)
+frames = [source(n) for n in range(args.number)] # generated ahead, not counted in ingest
+replay = lambda n: frames[n%len(frames)]
+
+print('%-28s %10s %10s %12s' %('case', 'frames/s', 'MB/s', 'ms/frame'))
+def report(name, count, size, elapsed):
+    print('%-28s %10.1f %10.1f %12.3f' %(name, count/elapsed, size/elapsed/1e6, elapsed/count*1e3))
+
+## Ingest
+for content_length in (True, False):
+    streamer = FakeMjpgStreamer(replay, fps=0, content_length=content_length, rate=args.rate)
+    res = streamer.start()
+    assert res['result'] == 'success', res
+    client = MjpgClient()
+    res = client.open(streamer.url())
+    assert res['result'] == 'success', res
+    size, begin = 0, perf_counter()
+    for n in range(args.number):
+        res = client.next_frame()
+        assert res['result'] == 'success', res
+        size += len(res['detail'])
+    report('ingest, Content-Length %s' %('yes' if content_length else 'no'), args.number, size, perf_counter()-begin)
+    client.close()
+    streamer.end()
+
+## Render
+import numpy as np, pygame
+from ikvm_ui.frames import decode_frame, resize_frame
+pygame.init()
+screen = pygame.Surface(args.display)
+canvas = np.empty((args.display[1], args.display[0], 3), np.uint8)
+surface = pygame.image.frombuffer(canvas, args.display, 'BGR')
+size, begin = 0, perf_counter()
+for jpeg in frames:
+    frame = decode_frame(jpeg, args.display)
+    resize_frame(frame, canvas)
+    screen.blit(surface, (0, 0))
+    size += len(jpeg)
+report('render %dx%d' %args.display, len(frames), size, perf_counter()-begin)
+pygame.quit()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# coding: utf-8
+""" Microbenchmarks of ikvm._protocol message encoders
+
+per-message cost of the encoders before (format strings built per call, kept below as baseline)
+and after (precompiled struct.Struct, key packet table, bytes-based text message), e.g.
+    python3 benchmarks/bench_protocol.py -n 100000
+"""
+import sys
+
+if __name__ != '__main__':
+    sys.exit(1)
+
+import os, struct, argparse, timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__)))) # import ikvm in repo
+from ikvm._protocol import *
+
+## Encoders before precompiled
+BASELINE = {
+    'RUN_MJPG_REQ': lambda cap, res, fps, port:(
+        struct.pack(
+            '!3sBB%dsHHBH' %len(cap), MAGIC, TYPE_RUN_MJPG_REQ,
+            len(cap), cap.encode('utf-8'),
+            res[0], res[1], fps, port)),
+    'OPEN_UART_REQ': lambda port:(
+        struct.pack('!3sBB%ds' %len(port), MAGIC, TYPE_OPEN_UART_REQ, len(port), port.encode('utf-8'))),
+    'SEND_KEY_REQ_K': lambda act, key: struct.pack('!3sBBB', MAGIC, TYPE_SEND_KEY_REQ, act, key),
+    'SEND_KEY_REQ_C': lambda txt:(
+        struct.pack('!3sBBH'+'B'*len(txt), MAGIC, TYPE_SEND_KEY_REQ, KEY_TEXT_SEND, len(txt), *[ord(char) for char in txt])),
+    'SEND_MOUSE_REQ_K': lambda act, btn: struct.pack('!3sBBB', MAGIC, TYPE_SEND_MOUSE_REQ, act, btn),
+    'SEND_MOUSE_REQ_M': lambda x, y: struct.pack('!3sBBbb', MAGIC, TYPE_SEND_MOUSE_REQ, MOUSE_MOVE, x, y),
+    'SEND_ATX_REQ': lambda sig: struct.pack('!3sBB', MAGIC, TYPE_SEND_ATX_REQ, sig),
+    'STATUS_CODE_RES': lambda TYPE, code, detail:(
+        struct.pack(
+            '!3sBBB%ds' %len(detail), MAGIC, TYPE,
+            code, len(detail), detail.encode('utf-8'))),
+}
+CURRENT = {
+    'RUN_MJPG_REQ': RUN_MJPG_REQ,
+    'OPEN_UART_REQ': OPEN_UART_REQ,
+    'SEND_KEY_REQ_K': SEND_KEY_REQ_K,
+    'SEND_KEY_REQ_C': SEND_KEY_REQ_C,
+    'SEND_MOUSE_REQ_K': SEND_MOUSE_REQ_K,
+    'SEND_MOUSE_REQ_M': SEND_MOUSE_REQ_M,
+    'SEND_ATX_REQ': SEND_ATX_REQ,
+    'STATUS_CODE_RES': STATUS_CODE_RES,
+}
+
+parser = argparse.ArgumentParser(description='Per-message cost of iKVM protocol encoders')
+parser.add_argument('-n', '--number', type=int, default=100000, help='messages encoded per case, default 100000')
+parser.add_argument('-r', '--repeat', type=int, default=5, help='repeat times of each case, the best one taken, default 5')
+args = parser.parse_args()
+
+text = ''.join(chr(0x20+i%0x5F) for i in range(0x10000-1)) # a 64 KiB paste
+# (case name, encoder name, arguments, messages encoded relative to --number)
+cases = [
+    ('key press/release', 'SEND_KEY_REQ_K', (KEY_PRESS, 0x04), 1),
+    ('mouse move', 'SEND_MOUSE_REQ_M', (-127, 64), 1),
+    ('mouse button', 'SEND_MOUSE_REQ_K', (MOUSE_PRESS, 1), 1),
+    ('atx', 'SEND_ATX_REQ', (ATX_SIGNAL['reset'],), 1),
+    ('open uart', 'OPEN_UART_REQ', ('/dev/ttyUSB0',), 1),
+    ('run mjpg', 'RUN_MJPG_REQ', ('/dev/video0', (1920, 1080), 30, 8080), 1),
+    ('status response', 'STATUS_CODE_RES', (TYPE_SEND_KEY_RES, STATUS_SUCCESS, 'key pressed'), 1),
+    ('text 16 chars', 'SEND_KEY_REQ_C', (text[:16],), 1),
+    ('text 1 KiB', 'SEND_KEY_REQ_C', (text[:1024],), 1/100),
+    ('text 64 KiB', 'SEND_KEY_REQ_C', (text,), 1/10000),
+]
+
+print('%-18s %14s %14s %8s' %('message', 'before (us)', 'after (us)', 'speedup'))
+for name, encoder, arg, ratio in cases:
+    before, after = BASELINE[encoder], CURRENT[encoder]
+    assert before(*arg) == after(*arg), 'Encoders of %s mismatch' %name
+    number = max(int(args.number*ratio), 1)
+    costs = [
+        min(timeit.repeat(lambda: fn(*arg), number=number, repeat=args.repeat))/number*1e6
+        for fn in (before, after)]
+    print('%-18s %14.3f %14.3f %7.1fx' %(name, *costs, costs[0]/costs[1]))
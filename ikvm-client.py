@@ -52,12 +52,55 @@ def _usbid(usbid):
     vid, pid = tuple((int(x, base=16) for x in usbid.split(':')))
     return usbid
 
+def _mouse_interval(interval):
+    if interval in (None, 'None'):
+        return None
+    if int(interval) not in range(0, 101):
+        raise argparse.ArgumentTypeError('Mouse interval should be between 0 and 100 milliseconds')
+    return int(interval)
+
+def _heartbeat(heartbeat):
+    if heartbeat in (None, 'None'):
+        return None
+    if float(heartbeat) < 0:
+        raise argparse.ArgumentTypeError('Heartbeat interval should not be negative')
+    return float(heartbeat)
+
+def _heartbeat_misses(misses):
+    if misses in (None, 'None'):
+        return None
+    if int(misses) < 1:
+        raise argparse.ArgumentTypeError('Heartbeat misses should be at least 1')
+    return int(misses)
+
+def _reconnect(tries):
+    if tries in (None, 'None'):
+        return None
+    if int(tries) < 0:
+        raise argparse.ArgumentTypeError('Reconnect tries should not be negative')
+    return int(tries)
+
+def _input_policy(policy):
+    if policy in (None, 'None'):
+        return None
+    policy = policy.lower()
+    if policy not in ('drop', 'buffer'):
+        raise argparse.ArgumentTypeError('Input policy should be drop or buffer')
+    return policy
+
 def _resolution(reso):
     if reso in (None, 'None'):
         return None
     w, h = tuple((int(x) for x in reso.split('x')))
     return (w, h)
 
+def _workers(workers):
+    if workers in (None, 'None'):
+        return None
+    if int(workers) not in range(1, 33):
+        raise argparse.ArgumentTypeError('Number of decode workers should be between 1 and 32')
+    return int(workers)
+
 def _logfile(logfile):
     if logfile in (None, 'None'):
         return None
@@ -97,16 +140,22 @@ parser.add_argument('-6', '--ipv6', action='store_true', help='resolve domain as
 parser.add_argument('-4', '--ipv4', action='store_true', help='resolve domain as IPv4 first')
 parser.add_argument('port', type=_port, nargs='?', help='iKVM server port, default 7130')
 parser.add_argument('-i', '--config', type=_config, help='a YAML file as config file, if other arguments are specific, ignored the specific arguments')
+parser.add_argument('--heartbeat', type=_heartbeat, help='seconds between asking iKVM server alive, 0 disables heartbeat, default 1')
+parser.add_argument('--heartbeat-misses', type=_heartbeat_misses, help='disconnect if the number of asking not replied reaches it, default 3')
+parser.add_argument('--reconnect', type=_reconnect, help='tries of reconnecting iKVM server after connection lost, 0 disables reconnecting, default 10')
+parser.add_argument('--input-policy', type=_input_policy, help='keyboard/mouse input while reconnecting is dropped or buffered and sent after reconnected, default drop')
 parser.add_argument('-m', '--mjpg-port', type=_port, help='client will open mjpg-streamer service with this port, default 8080')
 parser.add_argument('-v', '--capture-device', type=_str, help='MJPG-Streamer will start specific video capture device initially')
 parser.add_argument('--capture-scale', type=_scale, help='MJPG-Streamer will start video capture device using specific resolution scale first, e.g. 16:9')
 parser.add_argument('--capture-quality', type=_quality, help='MJPG-Streamer will start video capture device as best or worst quality, default best')
 parser.add_argument('-u', '--serial-port', type=_str, help='server will start serial device with specific port initially')
 parser.add_argument('--serial-usbid', type=_usbid, help='server will start serial device with specific vid:pid, ignored as --serial-port option is specific; value should be taken as 4 bytes hex separated by colon, e.g. 0483:df11')
+parser.add_argument('--mouse-interval', type=_mouse_interval, help='milliseconds that mouse motions are accumulated before sending, 0 sends every motion at once, default 4')
 
 # ikvm client ui settings
 parser.add_argument('-F', '--fullscreen', action='store_true', help='start client as fullscreen initially')
 parser.add_argument('--resolution', type=_resolution, help='client window resolution, e.g. 1920x1080, default adaptive the screen')
+parser.add_argument('--decode-workers', type=_workers, help='number of threads decoding video frames, default 2')
 parser.add_argument('--logfile', type=_logfile, help='iKVM client saved log file path, default SYSOUT and SYSERR')
 parser.add_argument('--log-level', type=_log_level, help='log level used, default 3')
 
@@ -126,14 +175,20 @@ is_ipv6 = args.ipv6
 is_ipv4 = args.ipv4
 port = args.port
 config = args.config
+heartbeat = args.heartbeat
+heartbeat_misses = args.heartbeat_misses
+reconnect = args.reconnect
+input_policy = args.input_policy
 mjpg_port = args.mjpg_port
 cap = args.capture_device
 scale = args.capture_scale
 quality = args.capture_quality
 uart = args.serial_port
 usbid = args.serial_usbid
+mouse_interval = args.mouse_interval
 fullscreen = args.fullscreen
 resolution = args.resolution
+decode_workers = args.decode_workers
 logfile = args.logfile
 log_level = args.log_level
 
@@ -150,6 +205,10 @@ if config: # config file specific, use it
     args.append(str(ikvm_server.get('port'))) if not port else None
     args.append('-6') if ikvm_server.get('ipv6') == True else None # ipv6 defined as true/false
     args.append('-4') if ikvm_server.get('ipv4') == True else None # ipv4 defined as true/false
+    args.extend(['--heartbeat', str(ikvm_server.get('heartbeat'))]) if heartbeat is None else None
+    args.extend(['--heartbeat-misses', str(ikvm_server.get('heartbeat-misses'))]) if not heartbeat_misses else None
+    args.extend(['--reconnect', str(ikvm_server.get('reconnect'))]) if reconnect is None else None
+    args.extend(['--input-policy', str(ikvm_server.get('input-policy'))]) if not input_policy else None
     if mjpg_streamer:
         args.extend(['-m', str(mjpg_streamer.get('port'))]) if not mjpg_port else None
         args.extend(['-v', str(mjpg_streamer.get('capture-device'))]) if not cap else None
@@ -158,9 +217,11 @@ if config: # config file specific, use it
     if serial_device:
         args.extend(['-u', str(serial_device.get('port'))]) if not uart else None
         args.extend(['--serial-usbid', str(serial_device.get('usbid'))]) if not usbid else None
+        args.extend(['--mouse-interval', str(serial_device.get('mouse-interval'))]) if mouse_interval is None else None
     if window_option:
         args.append('-F') if window_option.get('fullscreen') == True else None # fullscreen defined as true/false
         args.extend(['--resolution', str(window_option.get('resolution'))]) if not resolution else None
+        args.extend(['--decode-workers', str(window_option.get('decode-workers'))]) if not decode_workers else None
     if log_option:
         args.extend(['--logfile', str(log_option.get('path'))]) if not logfile else None
         args.extend(['--log-level', str(log_option.get('level'))]) if not log_level else None
@@ -173,13 +234,20 @@ is_ipv4 = True if is_ipv4 else args.ipv4
 # first use explict specific argument, second use configure file value, finnaly use default
 port = port if port else (args.port if args.port else 7130)
 mjpg_port = mjpg_port if mjpg_port else (args.mjpg_port if args.mjpg_port else 8080)
+heartbeat = heartbeat if heartbeat is not None else (args.heartbeat if args.heartbeat is not None else 1)
+heartbeat_misses = heartbeat_misses if heartbeat_misses else (args.heartbeat_misses if args.heartbeat_misses else 3)
+reconnect = reconnect if reconnect is not None else (args.reconnect if args.reconnect is not None else 10)
+input_policy = input_policy if input_policy else (args.input_policy if args.input_policy else 'drop')
 cap = cap if cap else args.capture_device
 scale = scale if scale else args.capture_scale
 quality = quality if quality else (args.capture_quality if args.capture_quality else 'best')
 uart = uart if uart else args.serial_port
 usbid = usbid if usbid else args.serial_usbid
+# 0 is a valid interval
+mouse_interval = mouse_interval if mouse_interval is not None else (args.mouse_interval if args.mouse_interval is not None else 4)
 fullscreen = True if fullscreen else args.fullscreen
 resolution = resolution if resolution else (args.resolution if args.resolution else (0, 0))
+decode_workers = decode_workers if decode_workers else (args.decode_workers if args.decode_workers else 2)
 logfile = logfile if logfile else args.logfile
 log_level = log_level if log_level else (args.log_level if args.log_level else 3)
 
@@ -206,8 +274,11 @@ if is_domain(ip):
     ip = quints[0][4][0]
 
 from ikvm_ui import *
-kvm = ikvm.Kvm(ip, port, mjpg_port, cap_name=cap, cap_scale=scale, cap_quality=quality, uart_port=uart, usbid=usbid)
+kvm = ikvm.Kvm(ip, port, mjpg_port, cap_name=cap, cap_scale=scale, cap_quality=quality, uart_port=uart, usbid=usbid,
+        mouse_interval=mouse_interval/1000, heartbeat=heartbeat, heartbeat_misses=heartbeat_misses,
+        reconnect=reconnect, input_policy=input_policy)
 mjpg = ikvm.MjpgClient()
-window = iKvmClient(kvm, mjpg, fullscreen=fullscreen, cap_res_in_win=resolution, logfile=logfile, log_level=log_level)
+window = iKvmClient(kvm, mjpg, fullscreen=fullscreen, cap_res_in_win=resolution, logfile=logfile, log_level=log_level,
+        decode_workers=decode_workers)
 window.start()
 sys.exit(0)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import sys
+
+# decoding processes of the wall may import this script as "__mp_main__", nothing is run for them
+if __name__ not in ('__main__', '__mp_main__'):
+    sys.exit(1)
+
+import ikvm, argparse, os, re, socket
+
+domain_re = r'^(((?!\-))(xn\-\-)?[a-z0-9\-_]{0,61}[a-z0-9]{1,1}\.)*(xn\-\-)?([a-z0-9\-]{1,61}|[a-z0-9\-]{1,30})\.[a-z]{2,}$'
+
+def is_domain(host):
+    return (re.match(domain_re, host) is not None)
+
+def _host(host):
+    if is_domain(host):
+        return host
+    ip = host
+    ikvm.address_family(ip)
+    return ip
+
+def _port(port):
+    if int(port) not in range(1, 0x10000):
+        raise argparse.ArgumentTypeError('Port value out of range')
+    return int(port)
+
+def _resolution(reso):
+    w, h = tuple((int(x) for x in reso.split('x')))
+    return (w, h)
+
+def _processes(processes):
+    if int(processes) not in range(1, 33):
+        raise argparse.ArgumentTypeError('Number of decode processes should be between 1 and 32')
+    return int(processes)
+
+def _logfile(logfile):
+    folder = os.path.dirname(logfile) if os.path.dirname(logfile) else './'
+    if not os.path.isdir(folder):
+        raise argparse.ArgumentTypeError('Path "{}" does not exist'.format(folder))
+    if os.path.isdir(logfile):
+        raise argparse.ArgumentTypeError('Log file "{}" should not be a folder'.format(logfile))
+    return logfile
+
+def _log_level(log_level):
+    if int(log_level) not in range(6):
+        raise argparse.ArgumentTypeError('Log level should be between 0 and 5')
+    return int(log_level)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the consoles of many iKVM servers, click one to control it')
+    parser.add_argument('hosts', type=_host, nargs='+', help='iKVM server ip/domain addresses')
+    parser.add_argument('-p', '--port', type=_port, default=7130, help='iKVM server port, default 7130')
+    parser.add_argument('-m', '--mjpg-port', type=_port, default=8080, help='client will open mjpg-streamer service with this port, default 8080')
+    parser.add_argument('-F', '--fullscreen', action='store_true', help='start wall and sessions as fullscreen')
+    parser.add_argument('--resolution', type=_resolution, default=(0, 0), help='wall window resolution, e.g. 1920x1080, default adaptive the screen')
+    parser.add_argument('--decode-processes', type=_processes, default=4, help='number of processes decoding video frames, default 4')
+    parser.add_argument('--logfile', type=_logfile, help='iKVM client saved log file path of sessions, default SYSOUT and SYSERR')
+    parser.add_argument('--log-level', type=_log_level, default=3, help='log level used, default 3')
+    args = parser.parse_args()
+
+    ## Resolve domains, (name, ip) of each host
+    hosts = []
+    for host in args.hosts:
+        ip = host
+        if is_domain(host):
+            try:
+                ip = socket.getaddrinfo(host, None)[0][4][0]
+            except socket.error:
+                parser.print_usage()
+                print(f'ikvm-wall.py: error: argument hosts: Domain "{host}" cannot be resolved')
+                sys.exit(1)
+        hosts.append((host, ip))
+
+    from ikvm_ui import *
+    ## Keep a session with every host, so that its mjpg-streamer is started and kept running
+    fleet = ikvm.KvmFleet()
+    for name, ip in hosts:
+        fleet.add(name, ip, args.port, args.mjpg_port)
+    for name, res in fleet.start()['detail'].items():
+        if res['result'] != 'success':
+            print('Connect iKVM "{}" failed, detail => {} <='.format(name, res['detail']), file=sys.stderr)
+
+    def open_session(no):
+        name, ip = hosts[no]
+        fleet.end(name) # iKVM server accepts one client at the same time
+        kvm = ikvm.Kvm(ip, args.port, args.mjpg_port)
+        window = iKvmClient(kvm, ikvm.MjpgClient(), fullscreen=args.fullscreen, logfile=args.logfile,
+                log_level=args.log_level)
+        window.start()
+        fleet.start(name)
+
+    streams = []
+    for name, ip in hosts:
+        mjpg_ip = f'[{ip}]' if ikvm.address_family(ip) == 'ipv6' else ip
+        streams.append((name, f'http://{mjpg_ip}:{args.mjpg_port}/?action=stream'))
+    wall = KvmWall(streams, on_select=open_session, fullscreen=args.fullscreen, resolution=args.resolution,
+            processes=args.decode_processes)
+    wall.start()
+    fleet.close()
+    sys.exit(0)
@@ -4,5 +4,7 @@ from ._globals import *
 from ._protocol import *
 from .kvm import Kvm
 from .mjpg import MjpgClient
+from .aio import AsyncKvm, AsyncMjpgClient
+from .fleet import KvmFleet
 
-__all__ = ['Kvm', 'MjpgClient', 'address_family',]
+__all__ = ['Kvm', 'MjpgClient', 'AsyncKvm', 'AsyncMjpgClient', 'KvmFleet', 'address_family',]
@@ -18,8 +18,23 @@ ARDUINO_MAX_KEY = 0xFB
 ARDUINO_MOUSE_BUTTONS = (1, 2, 4)
 
 BUF = 1024
-TIMEOUT_RT = 10  # used in socket send (real-time)
+TIMEOUT_RT = 1 # second(s) used in socket send (real-time), deadline of writing a message
 TIMEOUT_LAG = 4 # second(s) used in start/end function for waiting response
+ACK_RING_SIZE = 1024 # acks of key/mouse/atx commands kept until read
+ACK_PENDING_MAX = 65536 # commands waiting for ack, the oldest forgotten only if server never acks
+MOUSE_INTERVAL = 0.004 # second(s) that mouse motions are accumulated before sending
+MOUSE_STEP = 127 # maximal distance of a mouse move message in each axis
+MOUSE_MAX_STEPS = 16 # maximal mouse move messages sent in an interval, the remaining distance sent later
+HEARTBEAT_INTERVAL = 1 # second(s) between asking server alive
+HEARTBEAT_MISSES = 3 # session is dead if the number of asking not replied reaches it
+RTT_WINDOW = 128 # the latest round-trip times kept for statistics
+RTT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000) # millisecond(s), upper bounds of RTT histogram bins
+RECONNECT_TRIES = 10 # tries of reconnecting after connection lost
+RECONNECT_BASE = 0.5 # second(s), the first reconnecting delay, doubled for each try and randomized
+RECONNECT_CAP = 8 # second(s), maximal reconnecting delay
+RECONNECT_BUFFER = 1024 # maximal messages buffered while reconnecting
+INPUT_POLICIES = ('drop', 'buffer') # keyboard/mouse/atx commands while reconnecting, dropped or sent after reconnected
+FLEET_CONCURRENCY = 16 # default number of hosts a KvmFleet bulk operation works on at the same time
 
 class UserDefinedQuit:
     pass
@@ -32,5 +47,20 @@ __all__ = [
         'BUF',
         'TIMEOUT_RT',
         'TIMEOUT_LAG',
+        'ACK_RING_SIZE',
+        'ACK_PENDING_MAX',
+        'MOUSE_INTERVAL',
+        'MOUSE_STEP',
+        'MOUSE_MAX_STEPS',
+        'HEARTBEAT_INTERVAL',
+        'HEARTBEAT_MISSES',
+        'RTT_WINDOW',
+        'RTT_BUCKETS',
+        'RECONNECT_TRIES',
+        'RECONNECT_BASE',
+        'RECONNECT_CAP',
+        'RECONNECT_BUFFER',
+        'INPUT_POLICIES',
+        'FLEET_CONCURRENCY',
         'Quit',
 ]
@@ -88,49 +88,307 @@ STATUS_FAILURE = 0x01
 ATX_SIGNAL  = {'short power': 0xFD, 'reset': 0xFE, 'long power': 0xFF}
 STATUS_CODE = {STATUS_SUCCESS: 'success', STATUS_FAILURE: 'failure'}
 
-HANDSHAKE_MSG    = struct.pack('!3sB', MAGIC, TYPE_HANDSHAKE)
-GOODBYE_MSG      = struct.pack('!3sB', MAGIC, TYPE_GOODBYE)
-ASK_ALIVE_MSG    = struct.pack('!3sB', MAGIC, TYPE_ASK_ALIVE)
-REPLY_ALIVE_MSG  = struct.pack('!3sB', MAGIC, TYPE_REPLY_ALIVE)
-LIST_UART_REQ    = struct.pack('!3sB', MAGIC, TYPE_LIST_UART_REQ)
-LIST_CAP_REQ     = struct.pack('!3sB', MAGIC, TYPE_LIST_CAP_REQ)
-RUN_MJPG_REQ     = lambda cap, res, fps, port:(
-    struct.pack(
-        '!3sBB%dsHHBH' %len(cap), MAGIC, TYPE_RUN_MJPG_REQ,
-        len(cap), cap.encode('utf-8'),
-        res[0], res[1], fps, port))
-OPEN_UART_REQ    = lambda port:(
-            struct.pack('!3sBB%ds' %len(port), MAGIC, TYPE_OPEN_UART_REQ, len(port), port.encode('utf-8'))
-        )
-SEND_KEY_REQ_K   = lambda act, key: struct.pack('!3sBBB', MAGIC, TYPE_SEND_KEY_REQ, act, key)
-SEND_KEY_REQ_C   = lambda txt:(
-        struct.pack('!3sBBH'+'B'*len(txt), MAGIC, TYPE_SEND_KEY_REQ, KEY_TEXT_SEND, len(txt), *[ord(char) for char in txt]))
-SEND_KEY_REQ_R   = struct.pack('!3sBB', MAGIC, TYPE_SEND_KEY_REQ, KEY_CLEAR)
-SEND_MOUSE_REQ_K = lambda act, btn: struct.pack('!3sBBB', MAGIC, TYPE_SEND_MOUSE_REQ, act, btn)
-SEND_MOUSE_REQ_M = lambda x, y: struct.pack('!3sBBbb', MAGIC, TYPE_SEND_MOUSE_REQ, MOUSE_MOVE, x, y)
-SEND_MOUSE_REQ_S = lambda flag: struct.pack('!3sBB', MAGIC, TYPE_SEND_MOUSE_REQ, flag) # both wheel and release all buttons
-SEND_ATX_REQ     = lambda sig: struct.pack('!3sBB', MAGIC, TYPE_SEND_ATX_REQ, sig)
-LIST_UART_RES    = lambda devs:( # e.g. devs = [('/dev/ttyUSB0', 0x0483, 0xdf11), ('/dev/ttyUSB1', 0x0483, 0xdf11),]
-        struct.pack('!3sBB', MAGIC, TYPE_LIST_UART_RES, len(devs)) +
-        b''.join([
-            struct.pack(
-                '!B%dsHH' %len(dev[0]), len(dev[0]), dev[0].encode('utf-8'),
-                dev[1], dev[2]
-            ) for dev in devs]
-        ))
-LIST_CAP_RES     = lambda devs:( # e.g. devs = [('/dev/video0', [((1920, 1080), [30, 15,]), ((1280, 960), [30, 15,]),]),]
-        struct.pack('!3sBB', MAGIC, TYPE_LIST_CAP_RES, len(devs)) +
-        b''.join([
-            struct.pack('!B%dsB' %len(dev[0]), len(dev[0]), dev[0].encode('utf-8'), len(dev[1])) + 
-            b''.join([
-                struct.pack('!HHB', attr[0][0], attr[0][1], len(attr[1])) +
-                b''.join([struct.pack('!B', fps) for fps in attr[1]]) for attr in dev[1]]
-            ) for dev in devs]
-        ))
-STATUS_CODE_RES  = lambda TYPE, code, detail:(
-        struct.pack(
-            '!3sBBB%ds' %len(detail), MAGIC, TYPE,
-            code, len(detail), detail.encode('utf-8')))
+class ProtocolError(Exception):
+    """ Received message content against the protocol, str(e) is the error detail
+    """
+
+class _Incomplete(Exception): # message not received completely yet
+    pass
+
+## Message headers, keyboard/mouse/atx commands are packed with a header directly as the most frequent
+_HEAD      = struct.Struct('!3sB') # magic, type
+_HEAD_B    = struct.Struct('!3sBB') # magic, type, 1B flag
+_HEAD_BB   = struct.Struct('!3sBBB') # magic, type, 1B flag, 1B key/button
+_HEAD_BH   = struct.Struct('!3sBBH') # magic, type, 1B flag, 2B length
+_HEAD_Bbb  = struct.Struct('!3sBBbb') # magic, type, 1B flag, 1B x-move, 1B y-move
+
+_U8_BYTES  = [bytes((n,)) for n in range(0x100)] # packed 1B lengths
+
+## Declarative schema of message contents
+# each field is compiled once into encode(value) returning bytes,
+# and decode(view, pos, end) returning (value, position after the field) from a buffer view ending at end,
+# decode raises _Incomplete if the field is not received completely yet
+class _Field:
+    fmt = None # struct format of a fixed-size scalar, None if not scalar
+
+    def compile(self): # compile scalar field
+        st = struct.Struct('!'+self.fmt)
+        size, unpack_from = st.size, st.unpack_from
+        def decode(view, pos, end):
+            if pos+size > end:
+                raise _Incomplete
+            return unpack_from(view, pos)[0], pos+size
+        return st.pack, decode
+
+class _U8(_Field): # 1B unsigned integer
+    fmt = 'B'
+
+class _U16(_Field): # 2B unsigned integer
+    fmt = 'H'
+
+class _Str(_Field):
+    def __init__(self, name):
+        """ 1B {len}+[{len}B UTF-8 string]
+            name: required, <str>
+                  name of the string used in error detail, e.g. 'Serial device name'
+        """
+        self.name = name
+
+    def compile(self):
+        error = 'Protocol Error: %s is not valid UTF-8 encoding' %self.name
+        def encode(value):
+            value = value.encode('utf-8')
+            return _U8_BYTES[len(value)] + value
+        def decode(view, pos, end):
+            if pos >= end or pos+1+view[pos] > end:
+                raise _Incomplete
+            start, pos = pos+1, pos+1+view[pos]
+            try:
+                return str(view[start:pos], 'utf-8'), pos
+            except UnicodeDecodeError:
+                raise ProtocolError(error) from None
+        return encode, decode
+
+class _Tuple(_Field):
+    def __init__(self, *fields):
+        """ Fields in order, value is a tuple, e.g. _Tuple(_U16, _U16) for (width, height)
+            consecutive scalar fields are packed and unpacked by a single struct
+        """
+        self.fields = [field() if isinstance(field, type) else field for field in fields]
+
+    def compile(self):
+        ## Group consecutive scalar fields into a struct format, other fields stand alone
+        groups = []
+        for field in self.fields:
+            if field.fmt and groups and isinstance(groups[-1], str):
+                groups[-1] += field.fmt
+            else:
+                groups.append(field.fmt if field.fmt else field)
+        codecs = [] # (encode, decode, number of scalars or None if a single field)
+        for group in groups:
+            if not isinstance(group, str):
+                codecs.append((*group.compile(), None))
+                continue
+            st = struct.Struct('!'+group)
+            def decode(view, pos, end, size=st.size, unpack_from=st.unpack_from):
+                if pos+size > end:
+                    raise _Incomplete
+                return unpack_from(view, pos), pos+size
+            codecs.append((st.pack, decode, len(group)))
+
+        if len(codecs) == 1 and codecs[0][2]: # all scalars
+            pack, decode, _ = codecs[0]
+            return lambda value: pack(*value), decode
+
+        ## Generate straight-line functions, e.g. e0(value[0]) + e1(value[1], value[2])
+        names, terms, lines, values, i = {}, [], [], [], 0
+        for n, (enc, dec, num) in enumerate(codecs):
+            names['e%d' %n], names['d%d' %n] = enc, dec
+            if num is None:
+                terms.append('e%d(value[%d])' %(n, i))
+                values.append('v%d' %n)
+                i += 1
+            else:
+                terms.append('e%d(%s)' %(n, ', '.join(['value[%d]' %(i+k) for k in range(num)])))
+                values.append('*v%d' %n)
+                i += num
+            lines.append('    v%d, pos = d%d(view, pos, end)' %(n, n))
+        exec(
+            'def encode(value):\n    return %s\n' %' + '.join(terms) +
+            'def decode(view, pos, end):\n%s\n    return (%s,), pos\n' %('\n'.join(lines), ', '.join(values)),
+            names)
+        return names['encode'], names['decode']
+
+class _List(_Field):
+    def __init__(self, item):
+        """ 1B {num}+[{num} items], value is a list, e.g. _List(_U8) for frame rates
+        """
+        self.item = item() if isinstance(item, type) else item
+
+    def compile(self):
+        if self.item.fmt == 'B': # bytes as list
+            def decode(view, pos, end):
+                if pos >= end or pos+1+view[pos] > end:
+                    raise _Incomplete
+                return list(view[pos+1:pos+1+view[pos]]), pos+1+view[pos]
+            return lambda value: _U8_BYTES[len(value)] + bytes(value), decode
+        enc, dec = self.item.compile()
+        def encode(value):
+            return _U8_BYTES[len(value)] + b''.join([enc(item) for item in value])
+        def decode(view, pos, end):
+            if pos >= end:
+                raise _Incomplete
+            value, num, pos = [], view[pos], pos+1
+            for i in range(num):
+                item, pos = dec(view, pos, end)
+                value.append(item)
+            return value, pos
+        return encode, decode
+
+_STATUS = _Tuple(_U8, _Str('Detail message')) # status code and detail
+SCHEMA = { # contents of messages, messages not listed have no content except keyboard/mouse/atx commands
+    TYPE_RUN_MJPG_REQ: _Tuple(_Str('Video capture name'), _Tuple(_U16, _U16), _U8, _U16), # cap, (width, height), fps, port
+    TYPE_OPEN_UART_REQ: _Str('Serial device name'),
+    TYPE_LIST_UART_RES: _List(_Tuple(_Str('Serial device name'), _U16, _U16)), # [(dev, vid, pid),]
+    TYPE_LIST_CAP_RES: _List(_Tuple( # [(cap, [((width, height), [fps,]),]),]
+        _Str('Video capture name'),
+        _List(_Tuple(_Tuple(_U16, _U16), _List(_U8))))),
+    TYPE_RUN_MJPG_RES: _STATUS,
+    TYPE_OPEN_UART_RES: _STATUS,
+    TYPE_SEND_KEY_RES: _STATUS,
+    TYPE_SEND_MOUSE_RES: _STATUS,
+    TYPE_SEND_ATX_RES: _STATUS,}
+_CODECS = {msg_type: schema.compile() for msg_type, schema in SCHEMA.items()}
+
+def _encoder(msg_type): # message encoder of a type in SCHEMA
+    head, encode = _HEAD.pack(MAGIC, msg_type), _CODECS[msg_type][0]
+    return lambda value: head + encode(value)
+
+## Encoders
+# all key press/release messages, e.g. _KEY_TABLE[KEY_PRESS][key]
+_KEY_TABLE = tuple(
+        tuple(_HEAD_BB.pack(MAGIC, TYPE_SEND_KEY_REQ, act, key) for key in range(0x100))
+        for act in (KEY_RELEASE, KEY_PRESS))
+_STATUS_CODE_RES = {msg_type: _encoder(msg_type) for msg_type, schema in SCHEMA.items() if schema is _STATUS}
+
+HANDSHAKE_MSG    = _HEAD.pack(MAGIC, TYPE_HANDSHAKE)
+GOODBYE_MSG      = _HEAD.pack(MAGIC, TYPE_GOODBYE)
+ASK_ALIVE_MSG    = _HEAD.pack(MAGIC, TYPE_ASK_ALIVE)
+REPLY_ALIVE_MSG  = _HEAD.pack(MAGIC, TYPE_REPLY_ALIVE)
+LIST_UART_REQ    = _HEAD.pack(MAGIC, TYPE_LIST_UART_REQ)
+LIST_CAP_REQ     = _HEAD.pack(MAGIC, TYPE_LIST_CAP_REQ)
+RUN_MJPG_REQ     = lambda cap, res, fps, port, _encode=_encoder(TYPE_RUN_MJPG_REQ): _encode((cap, res, fps, port))
+OPEN_UART_REQ    = _encoder(TYPE_OPEN_UART_REQ)
+SEND_KEY_REQ_K   = lambda act, key: _KEY_TABLE[act][key]
+SEND_KEY_REQ_C   = lambda txt: _HEAD_BH.pack(MAGIC, TYPE_SEND_KEY_REQ, KEY_TEXT_SEND, len(txt)) + txt.encode('ascii')
+SEND_KEY_REQ_R   = _HEAD_B.pack(MAGIC, TYPE_SEND_KEY_REQ, KEY_CLEAR)
+SEND_MOUSE_REQ_K = lambda act, btn: _HEAD_BB.pack(MAGIC, TYPE_SEND_MOUSE_REQ, act, btn)
+SEND_MOUSE_REQ_M = lambda x, y: _HEAD_Bbb.pack(MAGIC, TYPE_SEND_MOUSE_REQ, MOUSE_MOVE, x, y)
+SEND_MOUSE_REQ_S = lambda flag: _HEAD_B.pack(MAGIC, TYPE_SEND_MOUSE_REQ, flag) # both wheel and release all buttons
+SEND_ATX_REQ     = lambda sig: _HEAD_B.pack(MAGIC, TYPE_SEND_ATX_REQ, sig)
+LIST_UART_RES    = _encoder(TYPE_LIST_UART_RES) # e.g. devs = [('/dev/ttyUSB0', 0x0483, 0xdf11), ('/dev/ttyUSB1', 0x0483, 0xdf11),]
+LIST_CAP_RES     = _encoder(TYPE_LIST_CAP_RES) # e.g. devs = [('/dev/video0', [((1920, 1080), [30, 15,]), ((1280, 960), [30, 15,]),]),]
+STATUS_CODE_RES  = lambda TYPE, code, detail: _STATUS_CODE_RES[TYPE]((code, detail))
+
+## Results of responses made from decoded contents, raise ProtocolError if content invalid
+def _list_uarts_result(uarts):
+    for uart_name, vid, pid in uarts:
+        if not uart_name:
+            raise ProtocolError('Server Error: Serial device name length is 0')
+    return {'result': 'success', 'detail': uarts}
+
+def _list_captures_result(caps):
+    for cap_name, attr in caps:
+        if not cap_name:
+            raise ProtocolError('Server Error: Video capture name length is 0')
+        elif not attr:
+            raise ProtocolError('Server Error: Video capture "%s" no resolution' %cap_name)
+        elif not all([fps for _, fps in attr]):
+            raise ProtocolError('Server Error: Video capture "%s" no frame rate' %cap_name)
+    return {'result': 'success', 'detail': caps}
+
+def _status_code_result(res):
+    status, detail = res
+    if status not in STATUS_CODE:
+        raise ProtocolError('Protocol Error: Invalid status code <{:02X}>'.format(status))
+    return {'result': STATUS_CODE[status], 'detail': detail}
+
+class StreamDecoder:
+    """ Incremental decoder of messages received from iKVM server
+
+        received bytes are written into a preallocated bytearray by recv_into() or feed(),
+        decode() parses them in place from a read cursor, the unread bytes are compacted to the front
+        only when free space runs short, and the buffer grows if a message is larger than it
+    """
+    def __init__(self, size=0x1000):
+        """ size: optional, <int>, default 4096
+                  initial buffer size in bytes
+        """
+        self.__buf = bytearray(size)
+        self.__start = 0 # read cursor, start of unparsed bytes
+        self.__end = 0 # end of received bytes
+
+    def __len__(self): # number of unparsed bytes
+        return self.__end-self.__start
+
+    def recv_into(self, sock):
+        """ Receive from socket sock directly into the buffer, return number of bytes received, 0 if peer closed
+            exceptions of sock.recv_into() are raised as is
+        """
+        self.__reserve(len(self.__buf)//4)
+        with memoryview(self.__buf) as view:
+            size = sock.recv_into(view[self.__end:])
+        self.__end += size
+        return size
+
+    def feed(self, data): # append received bytes data
+        self.__reserve(len(data))
+        self.__buf[self.__end:self.__end+len(data)] = data
+        self.__end += len(data)
+
+    def decode(self):
+        """ Generator of messages (type, result) parsed in order, result is None for messages without content
+            bytes before magic and messages in unknown type are skipped,
+            an incomplete message is kept, including a magic split across receiving, until the rest received
+        """
+        while True:
+            with memoryview(self.__buf) as view:
+                msg = self.__next(view)
+            if msg is None:
+                break
+            yield msg
+        if self.__start == self.__end: # all parsed, reuse the buffer from beginning without copying
+            self.__start = self.__end = 0
+
+    def __reserve(self, size): # make room for size bytes after received bytes
+        if len(self.__buf)-self.__end >= size:
+            return
+        if self.__start: # compact, move unparsed bytes to front
+            unread = self.__end-self.__start
+            self.__buf[:unread] = self.__buf[self.__start:self.__end]
+            self.__start, self.__end = 0, unread
+        if len(self.__buf)-self.__end < size:
+            self.__buf.extend(bytes(max(size, len(self.__buf))))
+
+    def __next(self, view): # parse the next message from read cursor, return None if no complete message
+        buf, end = self.__buf, self.__end
+        while True:
+            loc = buf.find(MAGIC, self.__start, end)
+            if loc == -1:
+                self.__start = max(self.__start, end-len(MAGIC)+1) # keep tail of a partial magic
+                return None
+            if loc+_HEAD.size > end:
+                self.__start = loc # wait for the rest of header
+                return None
+            msg_type, pos = buf[loc+3], loc+_HEAD.size
+            if msg_type in StreamDecoder.__NO_CONTENT:
+                self.__start = pos
+                return msg_type, None
+            result = StreamDecoder.__RESULTS.get(msg_type)
+            if result is None: # unknown message type
+                self.__start = pos
+                continue
+            try:
+                res, pos = _CODECS[msg_type][1](view, pos, end)
+                res = result(res)
+            except _Incomplete:
+                self.__start = loc # parse again from header as more bytes received
+                return None
+            except ProtocolError as e: # skip to next magic as the content is broken
+                res = {'result': 'error', 'detail': str(e)}
+            self.__start = pos
+            return msg_type, res
+
+    __NO_CONTENT = (TYPE_HANDSHAKE, TYPE_GOODBYE, TYPE_ASK_ALIVE, TYPE_REPLY_ALIVE,)
+
+    __RESULTS = {
+        TYPE_LIST_UART_RES: _list_uarts_result,
+        TYPE_LIST_CAP_RES: _list_captures_result,
+        TYPE_RUN_MJPG_RES: _status_code_result,
+        TYPE_OPEN_UART_RES: _status_code_result,
+        TYPE_SEND_KEY_RES: _status_code_result,
+        TYPE_SEND_MOUSE_RES: _status_code_result,
+        TYPE_SEND_ATX_RES: _status_code_result,}
 
 __all__ = [
         'MAGIC',
@@ -184,4 +442,7 @@ __all__ = [
         'LIST_UART_RES',
         'LIST_CAP_RES',
         'STATUS_CODE_RES',
+        'ProtocolError',
+        'SCHEMA',
+        'StreamDecoder',
 ]
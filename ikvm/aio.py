@@ -0,0 +1,452 @@
+# coding: utf-8
+if __name__ != 'ikvm.aio':
+    exit()
+from . import *
+from .kvm import Kvm, _key_act, _mouse_act, _atx_sig, _capture_args, _choose_capture, _choose_uart
+from .mjpg import MjpgParser, TIMEOUT, CHUNK, BOUNDARY
+import asyncio, email.message
+from collections import deque
+from urllib.parse import urlsplit
+from time import perf_counter
+from math import ceil
+
+class AsyncKvm:
+    """ Kvm on asyncio, one event loop drives many sessions without threads
+
+        the same protocol and settings as Kvm, every command is a coroutine returning the result dict
+        of its response, e.g. res = await kvm.send_key('press', 0x04)
+    """
+    __setattr__ = Kvm.__setattr__ # settings validated as Kvm
+
+    def __init__(self, ip, port,
+            mjpg_port, cap_name=None, cap_scale=None, cap_quality='best',
+            uart_port=None, usbid=None,
+            heartbeat=HEARTBEAT_INTERVAL, heartbeat_misses=HEARTBEAT_MISSES):
+        """ arguments are the same as Kvm, see Kvm.__init__()
+        """
+        self.ip = ip
+        self.port = port
+        self.mjpg_port = mjpg_port
+        self.cap_name = cap_name
+        self.cap_scale = cap_scale
+        self.cap_quality = cap_quality
+        self.uart_port = uart_port
+        self.usbid = usbid
+        self.heartbeat = heartbeat
+        self.heartbeat_misses = heartbeat_misses
+        self.rtt = None # second(s), the last heartbeat round-trip time
+        self.lost = False # True if disconnected as heartbeat not replied
+        self.__run = False
+        self.__seq = 0
+        self.__writer = None
+        self.__tasks = []
+
+    async def start(self):
+        ## Do handshake with server
+        res = await self.__hello()
+        if res['result'] == 'error':
+            self.__writer.close() if self.__writer else None
+            res['detail'] = ('Handshake with server failed', res['detail'])
+            return res
+
+        ## Successfully established a connection with server
+        self.__run = True
+        ## requests and commands waiting for response, a FIFO of asyncio.Future per response type
+        #  responses come in the order of requests, each response resolves the oldest Future of its type
+        self.__futures = {res_type: deque() for res_type in AsyncKvm.__RESPONSE}
+        self.__seq = 0
+        self.__pings = deque() # sent time of asking not replied yet
+        self.lost = False
+        self.__tasks = [asyncio.ensure_future(self.__recv_handler())]
+        if self.heartbeat:
+            self.__tasks.append(asyncio.ensure_future(self.__heartbeat()))
+
+        ## Open serial device
+        res = await self.open_serial_device()
+        if res['result'] in ('error', 'failure'):
+            await self.end()
+            res['detail'] = (
+                'Open serial device {}failed'.format(f'"{self.uart_port}" ' if self.uart_port else ''),
+                res['detail']
+            )
+            return res
+
+        ## Start MJPG-Streamer
+        res = await self.alt_capture()
+        if res['result'] in ('error', 'failure'):
+            await self.end()
+            res['detail'] = ('Start MJPG-Streamer service failed', res['detail'])
+            return res
+
+        return {'result': 'success'}
+
+    async def end(self):
+        if not self.__run:
+            return {'result': 'success'}
+        ## Say goodbye to server w/o receiving response
+        res = {'result': 'success'}
+        try:
+            self.__writer.write(GOODBYE_MSG)
+            await asyncio.wait_for(self.__writer.drain(), TIMEOUT_RT)
+        except (OSError, asyncio.TimeoutError) as e:
+            res = {'result': 'error', 'detail': 'socket.send failed: %s' %(str(e) or 'timeout')}
+        self.__goodbye()
+        for task in self.__tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        return res
+
+    async def __hello(self):
+        try:
+            self.__reader, self.__writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.ip, self.port), TIMEOUT_LAG) # Nagle disabled by asyncio
+        except asyncio.TimeoutError:
+            return {'result': 'error', 'detail': 'Send message timeout'}
+        except ConnectionRefusedError:
+            return {'result': 'error', 'detail': 'Connection Refused'}
+        except OSError as e:
+            return {'result': 'error', 'detail': str(e)}
+        self.__decoder = StreamDecoder(BUF) # received bytes parsed in place
+
+        ## Send handshake message and wait until handshake message received from server
+        self.__writer.write(HANDSHAKE_MSG)
+        try:
+            await asyncio.wait_for(self.__handshake(), TIMEOUT_LAG)
+        except asyncio.TimeoutError:
+            return {'result': 'error', 'detail': 'Received response timeout'}
+        except (OSError, EOFError):
+            return {'result': 'error', 'detail': 'Connection Reset: Exist client connected'}
+        return {'result': 'success'}
+
+    async def __handshake(self):
+        await self.__writer.drain()
+        while True:
+            data = await self.__reader.read(BUF)
+            if not data:
+                raise EOFError
+            self.__decoder.feed(data)
+            for msg_type, _ in self.__decoder.decode(): # messages after handshake kept in decoder
+                if msg_type == TYPE_HANDSHAKE:
+                    return
+
+    async def __recv_handler(self):
+        try:
+            while self.__run:
+                # Handle messages individually (see __RECV_HANDLE_SWITCH for a specific function)
+                for msg_type, res in self.__decoder.decode():
+                    case = AsyncKvm.__RECV_HANDLE_SWITCH.get(msg_type) # get function by protocol type
+                    case(self, msg_type, res) if case else None
+                    if not self.__run: # goodbye received
+                        return
+                data = await self.__reader.read(0x10000)
+                if not data:
+                    # Disconnected from server sent by FIN
+                    break
+                self.__decoder.feed(data)
+        except OSError: # Disconnected from server sent by RST/aborted
+            pass
+        self.__goodbye()
+
+    def __goodbye(self):
+        if not self.__run:
+            return
+        self.__run = False
+        self.__writer.close()
+        ## Fail requests waiting for response
+        for futures in self.__futures.values():
+            while futures:
+                future = futures.popleft()
+                future.done() or future.set_result({'result': 'error', 'detail': 'Disconnected from server'})
+
+    async def __heartbeat(self):
+        """ Ask server alive every self.heartbeat second(s), disconnect if asking not replied reaches self.heartbeat_misses
+        """
+        while self.__run:
+            if len(self.__pings) >= self.heartbeat_misses:
+                self.lost = True
+                self.__goodbye()
+                return
+            self.__pings.append(perf_counter())
+            self.__write(ASK_ALIVE_MSG)
+            await asyncio.sleep(self.heartbeat)
+
+    def __write(self, msg):
+        try:
+            self.__writer.write(msg)
+        except OSError: # connection lost, found by receiving task
+            pass
+
+    def __resolve(self, res_type, res): # resolve the oldest request waiting for the response
+        futures = self.__futures[res_type]
+        if futures:
+            future = futures.popleft()
+            future.done() or future.set_result(res) # response of request given up by timeout discarded
+
+    def __handle_goodbye(self, msg_type, res):
+        self.__goodbye()
+
+    def __handle_ask_alive(self, msg_type, res):
+        self.__write(REPLY_ALIVE_MSG)
+
+    def __handle_reply_alive(self, msg_type, res): # the oldest asking replied
+        if self.__pings:
+            self.rtt = perf_counter()-self.__pings.popleft()
+
+    __RECV_HANDLE_SWITCH = {
+        TYPE_GOODBYE: __handle_goodbye,
+        TYPE_ASK_ALIVE: __handle_ask_alive,
+        TYPE_REPLY_ALIVE: __handle_reply_alive,
+        TYPE_LIST_UART_RES: __resolve,
+        TYPE_LIST_CAP_RES: __resolve,
+        TYPE_RUN_MJPG_RES: __resolve,
+        TYPE_OPEN_UART_RES: __resolve,
+        TYPE_SEND_KEY_RES: __resolve,
+        TYPE_SEND_MOUSE_RES: __resolve,
+        TYPE_SEND_ATX_RES: __resolve,}
+
+    __RESPONSE = ( # response types of requests and commands waiting for response in __request()
+        TYPE_LIST_UART_RES,
+        TYPE_LIST_CAP_RES,
+        TYPE_RUN_MJPG_RES,
+        TYPE_OPEN_UART_RES,
+        TYPE_SEND_KEY_RES,
+        TYPE_SEND_MOUSE_RES,
+        TYPE_SEND_ATX_RES,)
+
+    async def __request(self, msg, res_types, timeout_detail):
+        """ Send msg and wait for the responses with types res_types in TIMEOUT_LAG second(s)
+            msg may join several requests, one response is waited for each of res_types
+            return the list of response results
+        """
+        if not self.__run:
+            return [{'result': 'error', 'detail': 'Kvm instance not started'} for _ in res_types]
+        ## Register before sending, a fast response never comes earlier than its request
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in res_types]
+        for res_type, future in zip(res_types, futures):
+            self.__futures[res_type].append(future)
+        self.__writer.write(msg)
+        try:
+            await asyncio.wait_for(self.__writer.drain(), TIMEOUT_RT)
+            return await asyncio.wait_for(asyncio.gather(*futures), TIMEOUT_LAG)
+        except asyncio.TimeoutError: # futures cancelled, their late responses discarded
+            return [future.result() if future.done() and not future.cancelled() else
+                    {'result': 'error', 'detail': timeout_detail} for future in futures]
+        except OSError as e:
+            self.__goodbye()
+            return [{'result': 'error', 'detail': 'socket.send failed: %s' %e} for _ in res_types]
+
+    async def __send_ack(self, res_type, request, msg):
+        """ Send command msg acknowledged by response with type res_type
+            return the ack, see Kvm.read_acks()
+        """
+        self.__seq += 1
+        seq = self.__seq
+        res, = await self.__request(msg, (res_type,), 'Command %s timeout' %request[0])
+        return {'seq': seq, 'request': request, **res}
+
+    async def list_serial_devices(self):
+        """ Return result dict with a list of serial devices (name, vid, pid) on iKVM
+        """
+        res, = await self.__request(LIST_UART_REQ, (TYPE_LIST_UART_RES,), 'List serial devies timeout')
+        return res
+
+    async def open_serial_device(self, port=None):
+        """ Open serial device according to self.uart_port or self.usbid if port is None
+        """
+        uart_port = port if port else self.uart_port
+        ## List available serial devices if port is not specified
+        if not uart_port:
+            res = await self.list_serial_devices()
+            if res['result'] == 'error':
+                return res
+            res = _choose_uart(res['detail'], self.usbid)
+            if res['result'] == 'error':
+                return res
+            self.uart_port = uart_port = res['detail']
+
+        ## Open ikvm serial device with port
+        res, = await self.__request(
+                OPEN_UART_REQ(uart_port), (TYPE_OPEN_UART_RES,), 'Open serial devies "%s" timeout' %uart_port)
+        return res
+
+    async def list_captures(self):
+        """ Return result dict with a list of video captures (name, [((w, h), [fps,]),]) on iKVM
+        """
+        res, = await self.__request(LIST_CAP_REQ, (TYPE_LIST_CAP_RES,), 'List video captures timeout')
+        return res
+
+    async def alt_capture(self, device=None, resolution=None, fps=None):
+        """ Choose capture, resolution and frame rate as Kvm.alt_capture(), then start mjpg-streamer
+        """
+        ## Accept valid arguments
+        resolution = _capture_args(device, resolution, fps)
+
+        ## List available video captures
+        res = await self.list_captures()
+        if res['result'] == 'error':
+            return res
+        res = _choose_capture(
+                res['detail'], device if device else self.cap_name, self.cap_scale, self.cap_quality, resolution, fps)
+        if res['result'] == 'error':
+            return res
+        self.cap_name, resolution, fps = res['detail']
+
+        ## Start ikvm mjpg-streamer
+        res, = await self.__request(
+                RUN_MJPG_REQ(self.cap_name, resolution, fps, self.mjpg_port), (TYPE_RUN_MJPG_RES,),
+                'Start mjpg-streamer with video capture "%s" on port "%s" timeout' %(self.cap_name, self.mjpg_port,))
+        return res
+
+    async def send_key(self, act, key): # send a single key with press or release
+        ## Arguments Validity Check
+        act = _key_act(act)
+        assert key in range(ARDUINO_MAX_KEY+1)
+
+        return await self.__send_ack(TYPE_SEND_KEY_RES, ('send_key', act, key), SEND_KEY_REQ_K(act, key))
+
+    async def send_text(self, text): # send text as keyboard input
+        ## Arguments Validity Check
+        assert text.isascii() # ASCII only
+
+        return await self.__send_ack(TYPE_SEND_KEY_RES, ('send_text', text), SEND_KEY_REQ_C(text))
+
+    async def release_keys(self): # send release all keys command to iKVM
+        return await self.__send_ack(TYPE_SEND_KEY_RES, ('release_keys',), SEND_KEY_REQ_R)
+
+    async def click_mouse(self, act, button):
+        ## Arguments Validity Check
+        act = _mouse_act(act)
+        assert button in ARDUINO_MOUSE_BUTTONS
+
+        return await self.__send_ack(TYPE_SEND_MOUSE_RES, ('click_mouse', act, button), SEND_MOUSE_REQ_K(act, button))
+
+    async def move_mouse(self, x, y):
+        """ Move mouse cursor by (x, y) in any distance, sent at once as steps within -127~127
+            return the ack of the last step, or of the first failed step
+        """
+        if not self.__run:
+            return {'result': 'error', 'detail': 'Kvm instance not started'}
+
+        ## Arguments Validity Check
+        assert isinstance(x, int) and isinstance(y, int)
+
+        steps, msgs = [], []
+        while (x, y) != (0, 0):
+            # split evenly into the least steps
+            n = max(ceil(abs(x)/MOUSE_STEP), ceil(abs(y)/MOUSE_STEP))
+            dx, dy = int(x/n), int(y/n)
+            x, y = x-dx, y-dy
+            self.__seq += 1
+            steps.append((self.__seq, ('move_mouse', dx, dy)))
+            msgs.append(SEND_MOUSE_REQ_M(dx, dy))
+        if not steps:
+            return {'result': 'success'}
+        acks = [{'seq': seq, 'request': request, **res} for (seq, request), res in zip(steps, await self.__request(
+                b''.join(msgs), [TYPE_SEND_MOUSE_RES]*len(steps), 'Command move_mouse timeout'))]
+        return next((ack for ack in acks if ack['result'] != 'success'), acks[-1])
+
+    async def scroll_mouse_wheel_up(self):
+        return await self.__send_ack(TYPE_SEND_MOUSE_RES, ('scroll_mouse_wheel_up',), SEND_MOUSE_REQ_S(MOUSE_WHEEL_UP))
+
+    async def scroll_mouse_wheel_down(self):
+        return await self.__send_ack(
+                TYPE_SEND_MOUSE_RES, ('scroll_mouse_wheel_down',), SEND_MOUSE_REQ_S(MOUSE_WHEEL_DOWN))
+
+    async def release_mouse_buttons(self):
+        return await self.__send_ack(TYPE_SEND_MOUSE_RES, ('release_mouse_buttons',), SEND_MOUSE_REQ_S(MOUSE_CLEAR))
+
+    async def send_atx(self, sig):
+        ## Arguments Validity Check
+        sig = _atx_sig(sig)
+
+        return await self.__send_ack(TYPE_SEND_ATX_RES, ('send_atx', sig), SEND_ATX_REQ(sig))
+
+    def is_run(self):
+        return self.__run
+
+class AsyncMjpgClient:
+    """ MjpgClient on asyncio, frames of mjpg-streamer read by asyncio streams and parsed by MjpgParser
+
+        async for jpeg in client.frames(): ...
+    """
+    def __init__(self):
+        self.__reader = self.__writer = None
+        self.__parser = MjpgParser()
+
+    async def open(self, url, timeout=TIMEOUT):
+        """ GET url of mjpg-streamer, timeout second(s) is also used in reading frames
+        """
+        self.url = url
+        self.__timeout = timeout
+        await self.close()
+        parts = urlsplit(url)
+        path = (parts.path or '/')+('?'+parts.query if parts.query else '')
+        try:
+            self.__reader, self.__writer = await asyncio.wait_for(
+                    asyncio.open_connection(parts.hostname, parts.port or 80), timeout)
+            self.__writer.write('GET {} HTTP/1.0\r\nHost: {}\r\n\r\n'.format(path, parts.netloc).encode('latin-1'))
+            head = await asyncio.wait_for(self.__reader.readuntil(b'\r\n\r\n'), timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            return {'result': 'error', 'detail': 'TimeoutError'}
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            await self.close()
+            return {'result': 'error', 'detail': 'URLError: {}'.format(e)}
+
+        ## Check status line, take boundary from "Content-Type: multipart/x-mixed-replace; boundary=..." header
+        status, *lines = head.decode('latin-1').split('\r\n')
+        _, code, reason = (status.split(' ', 2)+['', ''])[:3]
+        if code != '200':
+            await self.close()
+            return {'result': 'error', 'detail': 'HTTPError: {} {}'.format(code, reason)}
+        headers = email.message.Message()
+        for line in lines:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip()] = value.strip()
+        boundary = headers.get_param('boundary')
+        if not isinstance(boundary, str) or not boundary:
+            boundary = BOUNDARY
+        else:
+            boundary = boundary.encode('latin-1')
+            boundary = boundary if boundary.startswith(b'--') else b'--'+boundary
+        self.__parser = MjpgParser(boundary)
+        return {'result': 'success'}
+
+    async def close(self):
+        if self.__writer:
+            self.__writer.close()
+            self.__writer = None
+
+    async def next_frame(self):
+        """ Return the same result dicts as MjpgClient.next_frame(), raise TimeoutError if no data in timeout
+        """
+        if self.__writer is None:
+            return {'result': 'error', 'detail': 'URL not opened'}
+        try:
+            while True:
+                part = self.__parser.next_part()
+                if part is not None:
+                    return part
+                ## Read the rest of body at once if its length is known, else read what arrived
+                missing = self.__parser.missing()
+                res = await asyncio.wait_for(self.__reader.read(missing if missing else CHUNK), self.__timeout)
+                if res == b'':
+                    return {'result': 'lost'}
+                self.__parser.feed(res)
+        except asyncio.TimeoutError:
+            raise TimeoutError('AsyncMjpgClient Read Timeout.')
+        except OSError:
+            return {'result': 'lost'}
+
+    async def frames(self):
+        """ Async iterator of jpeg frames until the stream lost, frames failed parsing are skipped
+        """
+        while True:
+            res = await self.next_frame()
+            if res['result'] == 'success':
+                yield res['detail']
+            elif res['result'] == 'lost' or self.__writer is None:
+                return
@@ -0,0 +1,133 @@
+# coding: utf-8
+if __name__ != 'ikvm.fleet':
+    exit()
+from . import *
+from .aio import AsyncKvm
+from .kvm import _atx_sig
+import asyncio, threading
+from time import perf_counter
+
+class KvmFleet:
+    """ Many iKVM sessions driven by one asyncio event loop on a single thread
+
+        hosts are added by name, bulk operations work on all hosts (or the given names) in parallel
+        with at most `concurrency` hosts at the same time, and return a result dict whose detail maps
+        each host name to its own result dict with 'time', the second(s) taken by the host, e.g.
+            fleet = KvmFleet()
+            fleet.add('rack1', '10.0.0.1', 7130, 8080)
+            fleet.start()
+            res = fleet.send_atx('reset')
+            # {'result': 'success', 'time': 0.012,
+            #  'detail': {'rack1': {'seq': 1, 'request': ('send_atx', 0xFE), 'result': 'success', 'time': 0.011}}}
+    """
+    def __init__(self, concurrency=FLEET_CONCURRENCY):
+        """ concurrency: optional, <int>, default FLEET_CONCURRENCY
+                default number of hosts a bulk operation works on at the same time
+        """
+        assert isinstance(concurrency, int) and concurrency > 0
+        self.concurrency = concurrency
+        self.__kvms = {} # host name: AsyncKvm
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__loop.run_forever, daemon=True)
+        self.__thread.start()
+
+    def add(self, name, ip, port, mjpg_port, **kwargs):
+        """ Add host name with the arguments of AsyncKvm, see Kvm.__init__(), the session not started
+        """
+        assert isinstance(name, str)
+        if name in self.__kvms:
+            raise KeyError(f'host "{name}" already in fleet')
+        self.__kvms[name] = AsyncKvm(ip, port, mjpg_port, **kwargs)
+
+    def remove(self, name):
+        """ End the session of host name if started and remove it from fleet
+        """
+        kvm = self.__kvms.pop(name)
+        return self.__call(kvm.end())
+
+    def hosts(self):
+        return list(self.__kvms)
+
+    def __getitem__(self, name): # AsyncKvm of host name, its coroutines run by run()
+        return self.__kvms[name]
+
+    def run(self, coro, timeout=None):
+        """ Run coroutine coro on the event loop of fleet and return its result, e.g. fleet.run(fleet['rack1'].send_key(1, 4))
+        """
+        return self.__call(coro, timeout)
+
+    def close(self):
+        """ End all sessions and stop the event loop, fleet not usable after closed
+        """
+        if not self.__thread.is_alive():
+            return {'result': 'success'}
+        res = self.end()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop.close()
+        return res
+
+    def start(self, names=None, concurrency=None):
+        return self.__bulk(names, concurrency, lambda kvm: kvm.start())
+
+    def end(self, names=None, concurrency=None):
+        return self.__bulk(names, concurrency, lambda kvm: kvm.end())
+
+    def list_captures(self, names=None, concurrency=None):
+        return self.__bulk(names, concurrency, lambda kvm: kvm.list_captures())
+
+    def send_text(self, text, names=None, concurrency=None):
+        ## Arguments Validity Check
+        assert text.isascii() # ASCII only
+
+        return self.__bulk(names, concurrency, lambda kvm: kvm.send_text(text))
+
+    def send_atx(self, sig, names=None, concurrency=None):
+        ## Arguments Validity Check
+        sig = _atx_sig(sig)
+
+        return self.__bulk(names, concurrency, lambda kvm: kvm.send_atx(sig))
+
+    def rtt(self): # the last heartbeat round-trip time of each host, None if not measured
+        return {name: kvm.rtt for name, kvm in self.__kvms.items()}
+
+    def is_run(self): # whether the session of each host is running
+        return {name: kvm.is_run() for name, kvm in self.__kvms.items()}
+
+    def __call(self, coro, timeout=None):
+        if threading.current_thread() is self.__thread:
+            coro.close()
+            raise RuntimeError('KvmFleet called from its own event loop, await the AsyncKvm coroutine instead')
+        return asyncio.run_coroutine_threadsafe(coro, self.__loop).result(timeout)
+
+    def __bulk(self, names, concurrency, op):
+        """ Run op(kvm) on hosts names (all hosts if None), at most concurrency hosts at the same time
+            return result dict 'success' if all hosts succeeded else 'failure', detail maps host name to its result
+        """
+        names = list(self.__kvms) if names is None else [names] if isinstance(names, str) else list(names)
+        concurrency = self.concurrency if concurrency is None else concurrency
+        assert isinstance(concurrency, int) and concurrency > 0
+        kvms = {name: self.__kvms.get(name) for name in names}
+        begin = perf_counter()
+        detail = self.__call(self.__gather(kvms, concurrency, op))
+        return {
+            'result': 'success' if all(res['result'] == 'success' for res in detail.values()) else 'failure',
+            'detail': detail,
+            'time': perf_counter()-begin,}
+
+    async def __gather(self, kvms, concurrency, op):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(kvm):
+            if kvm is None:
+                return {'result': 'error', 'detail': 'No such host in fleet', 'time': 0}
+            async with semaphore:
+                begin = perf_counter()
+                try:
+                    res = await op(kvm)
+                except (OSError, asyncio.TimeoutError) as e: # one host never fails the others
+                    res = {'result': 'error', 'detail': str(e) or type(e).__name__}
+                return {**res, 'time': perf_counter()-begin}
+
+        results = await asyncio.gather(*[one(kvm) for kvm in kvms.values()])
+        return dict(zip(kvms, results))
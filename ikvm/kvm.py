@@ -2,18 +2,119 @@
 if __name__ != 'ikvm.kvm':
     exit()
 from . import *
-import socket, struct, errno, threading, re
-from copy import deepcopy as copy
-from time import sleep, time
+import socket, errno, threading, re, select, selectors, os, random
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from time import time, perf_counter
 from functools import partial
-from math import gcd
+from math import gcd, ceil
 
 res_scale = lambda w, h: (int(w/gcd(w, h)), int(h/gcd(w, h)))
 
+def _resolved(res): # Future already resolved with res
+    future = Future()
+    future.set_result(res)
+    return future
+
+## Arguments shared by Kvm and AsyncKvm
+def _key_act(act):
+    if act in ('press', 'release'):
+        return KEY_PRESS if act == 'press' else KEY_RELEASE
+    elif act not in (KEY_PRESS, KEY_RELEASE):
+        raise TypeError('Argument act should be "press", "release", %d or %d' %(KEY_PRESS, KEY_RELEASE))
+    return act
+
+def _mouse_act(act):
+    if act in ('press', 'release'):
+        return MOUSE_PRESS if act == 'press' else MOUSE_RELEASE
+    elif act not in (MOUSE_PRESS, MOUSE_RELEASE):
+        raise TypeError('Argument act should be "press", "release", %d or %d' %(MOUSE_PRESS, MOUSE_RELEASE))
+    return act
+
+def _atx_sig(sig):
+    if sig in ATX_SIGNAL:
+        return ATX_SIGNAL[sig]
+    elif sig not in ATX_SIGNAL.values():
+        raise TypeError('Argument sig should be "short power", "reset", "long power", 0xFD, 0xFE or 0xFF')
+    return sig
+
+def _capture_args(device, resolution, fps): # return resolution as (w, h) or None
+    assert isinstance(device, (str, type(None)))
+    if isinstance(resolution, tuple):
+        assert len(resolution) == 2
+        assert all([x in range(1, 0x10000) for x in resolution])
+    elif isinstance(resolution, str):
+        if re.match(r'^\d+x\d+$', resolution):
+            resolution = tuple(map(int, resolution.split('x')))
+            assert all([x in range(1, 0x10000) for x in resolution])
+        else:
+            raise TypeError("resolution string should be like '1920x1080'")
+    elif resolution is not None:
+        raise TypeError('resolution not valid')
+    if isinstance(fps, int):
+        if fps not in range(1, 0x100):
+            raise TypeError('fps value should between 0 and 255')
+    elif fps is not None:
+        raise TypeError('fps not valid')
+    return resolution
+
+def _choose_capture(caps, cap_name, cap_scale, cap_quality, resolution=None, fps=None):
+    """ Choose video capture from caps listed by iKVM, the first one if cap_name is None
+        choose resolution and frame rate by cap_scale and cap_quality if they are None
+        return result dict with (device, resolution, fps)
+    """
+    if not caps:
+        return {'result': 'error', 'detail': 'No available video capture'}
+
+    ## Determine what video capture for using
+    if cap_name:
+        cap = list(filter(lambda cap: cap_name in cap[0], caps))
+        if not cap:
+            return {'result': 'error',
+                    'detail': 'No available video capture "%s"' %cap_name}
+        cap_no = caps.index(cap[0])
+    else:
+        cap_no = 0
+
+    ## Determine what resolution for using
+    all_resolution = list(map(lambda attr: attr[0], caps[cap_no][1]))
+    fun = max if cap_quality == 'best' else min
+    if resolution is None:
+        # find resolution that the scale is satisfied with cap_scale
+        target = list(filter(lambda res: res_scale(*res)==cap_scale, all_resolution))
+        target = target if target else all_resolution
+        area = tuple(map(lambda res: res[0]*res[1], target))
+        i = area.index(fun(area)) # find index satisfy policy
+        resolution = target[i]
+
+    ## Determine what frame rate for using
+    if fps is None:
+        # find the fps satisfied with cap_quality
+        i = all_resolution.index(resolution) if resolution in all_resolution else 0 # find index satisfy policy
+        fps = fun(caps[cap_no][1][i][1])
+
+    return {'result': 'success', 'detail': (caps[cap_no][0], resolution, fps)}
+
+def _choose_uart(uarts, usbid):
+    """ Choose serial device from uarts listed by iKVM, the first one if usbid is None
+        return result dict with the port
+    """
+    if not uarts:
+        return {'result': 'error', 'detail': 'No serial device on iKVM'}
+    if usbid:
+        target = list(filter(lambda usb: usbid==(usb[1], usb[2]), uarts))
+        if not target:
+            return {'result': 'error',
+                    'detail': 'No such serial device with USB-ID "{:04X}:{:04X}" on iKVM'.format(*usbid)}
+        return {'result': 'success', 'detail': target[0][0]}
+    return {'result': 'success', 'detail': uarts[0][0]}
+
 class Kvm:
     def __init__(self, ip, port,
             mjpg_port, cap_name=None, cap_scale=None, cap_quality='best',
-            uart_port=None, usbid=None):
+            uart_port=None, usbid=None, mouse_interval=MOUSE_INTERVAL,
+            heartbeat=HEARTBEAT_INTERVAL, heartbeat_misses=HEARTBEAT_MISSES,
+            reconnect=RECONNECT_TRIES, input_policy='drop'):
         """ ip, port: required, <str> and <int>
 
             mjpg_port: required, <int>
@@ -37,6 +138,23 @@ class Kvm:
 
             usbid: optional, <str>/<>
                 specific serial device vid:pid, ignore when uart_port specified
+
+            mouse_interval: optional, <int>/<float>, default MOUSE_INTERVAL
+                second(s) that mouse motions are accumulated before sending, 0 sends every motion at once
+
+            heartbeat: optional, <int>/<float>, default HEARTBEAT_INTERVAL
+                second(s) between asking server alive for round-trip time, 0 disables heartbeat
+
+            heartbeat_misses: optional, <int>, default HEARTBEAT_MISSES
+                disconnect as the session is dead if the number of asking not replied reaches it
+
+            reconnect: optional, <int>, default RECONNECT_TRIES
+                tries of reconnecting with exponential backoff after connection lost, 0 ends the session at once
+                the opened serial device and mjpg-streamer are restored after reconnected
+
+            input_policy: optional, <str>, default 'drop'
+                keyboard/mouse/atx commands while reconnecting, 'drop' refuses them,
+                'buffer' queues at most RECONNECT_BUFFER messages sent after reconnected
         """
         self.ip = ip
         self.port = port
@@ -46,8 +164,28 @@ class Kvm:
         self.cap_quality = cap_quality
         self.uart_port = uart_port
         self.usbid = usbid
+        self.mouse_interval = mouse_interval
+        self.heartbeat = heartbeat
+        self.heartbeat_misses = heartbeat_misses
+        self.reconnect = reconnect
+        self.input_policy = input_policy
+        self.reconnects = 0 # number of successful reconnecting
         self.__run = False
         self.__sock = None
+        ## acks of key/mouse/atx commands not read yet, the oldest acks dropped when full
+        #  e.g. {'seq': 12, 'request': ('send_key', 1, 0x04), 'result': 'success', 'detail': ''}
+        self.__acks = deque(maxlen=ACK_RING_SIZE)
+        self.__ack_cond = threading.Condition()
+        self.__ack_callback = None
+        self.acks_dropped = 0 # number of acks dropped before read
+        ## heartbeat round-trip times, kept after session ended
+        self.__rtt_lock = threading.Lock()
+        self.__reset_heartbeat()
+        ## reconnecting state
+        self.__stop = threading.Event() # set by end(), interrupts reconnecting
+        self.__connected = False
+        self.__reconnecting = False # True from connection lost until session restored
+        self.__reconnect_callback = None
 
     def __setattr__(self, key, value):
         if key in ('ip',):
@@ -70,6 +208,18 @@ class Kvm:
             else:
                 raise TypeError("Type of cap_scale should be None, <str> or <tuple> with 2 <int>, "\
                         "and value should between 0 and 65535, e.g. '16:9' or (16, 9)")
+        elif key in ('mouse_interval', 'heartbeat',):
+            assert isinstance(value, (int, float)) and value >= 0
+            self.__dict__[key] = value
+        elif key == 'heartbeat_misses':
+            assert isinstance(value, int) and value >= 1
+            self.__dict__[key] = value
+        elif key == 'reconnect':
+            assert isinstance(value, int) and value >= 0
+            self.__dict__[key] = value
+        elif key == 'input_policy':
+            assert value in INPUT_POLICIES
+            self.__dict__[key] = value
         elif key == 'cap_quality':
             assert value in ('best', 'worst')
             self.__dict__[key] = value
@@ -90,23 +240,48 @@ class Kvm:
 
     def start(self):
         ## Do handshake with server
+        self.__stop.clear()
         res = self.__hello()
         if res['result'] == 'error':
+            self.__sock.close()
+            self.__close_waker()
             res['detail'] = ('Handshake with server failed', res['detail'])
             return res
 
         ## Successfully established a connection with server
         self.__run = True
+        self.__connected = True # False while reconnecting, writer thread holds messages
+        self.__reconnecting = False
+        self.__restore = {'uart': None, 'mjpg': None} # arguments of opened serial device and mjpg-streamer
+        self.__restoring = None # restoring requests {'uart': Future, 'mjpg': Future} after reconnected
         ## registers of response messages resolved from ikvm server
         #  e.g. received msg FF31D5 80 01 0C b'/dev/ttyUSB0' 0483 df11 saved to ->
         #       __resolv_msg[TYPE_LIST_UART_RES] = {
         #           'result': 'success',
         #           'detail': [('/dev/ttyUSB0', 0x0483, 0xdf11),]}
         self.__resolv_msg = dict(zip(Kvm.__RECV_HANDLE_SWITCH, [None for i in range(len(Kvm.__RECV_HANDLE_SWITCH))]))
+        ## requests waiting for response, a FIFO of Future per response type
+        #  responses come in the order of requests, each response resolves the oldest Future of its type
+        self.__futures = {res_type: deque() for res_type in Kvm.__REQUEST_RESPONSE}
         self.__lock = threading.Lock()
-        self.__condition = threading.Condition()
-
-        threading.Thread(target=self.__recv_handler).start()
+        ## commands waiting for ack, a FIFO of (seq, request) per ack type
+        self.__ack_pending = {res_type: deque(maxlen=ACK_PENDING_MAX) for res_type in Kvm.__ACK_RESPONSE}
+        self.__seq = 0
+        self.__motion = [0, 0] # mouse motion (x, y) accumulated but not queued yet
+        self.__motion_due = None # time queuing the accumulated motion, None if no motion
+        ## outbound messages (msg, on_error) written by the writer thread only
+        self.__outbox = deque()
+        self.__out_cond = threading.Condition()
+        self.__out_closed = False
+        self.__out_res = {'result': 'success'} # result of the last write
+        self.writes = 0 # number of writes, each write sends all messages queued at the time
+        self.messages = 0 # number of messages written
+        self.__reset_heartbeat()
+
+        self.__recv_thread = threading.Thread(target=self.__recv_handler)
+        self.__recv_thread.start()
+        self.__writer_thread = threading.Thread(target=self.__write_handler)
+        self.__writer_thread.start()
 
         ## Open serial device
         res = self.__uart_select()
@@ -132,401 +307,448 @@ class Kvm:
             return {'result': 'success'}
         ## Quit thread secure
         self.__run = False
+        self.__stop.set()
+        self.__wakeup()
         ## Wait thread quit
-        with self.__condition:
-            self.__condition.wait()
-        ## Say goodbye to server w/o receiving response
-        res = self.__send(GOODBYE_MSG)
+        if threading.current_thread() is not self.__recv_thread:
+            self.__recv_thread.join()
+        ## Say goodbye to server w/o receiving response, after all queued messages written
+        res = self.__post(GOODBYE_MSG) # refused while reconnecting or after reconnecting given up
+        self.__close_outbox()
+        if threading.current_thread() is not self.__writer_thread:
+            self.__writer_thread.join()
         self.__sock.close()
-        return res
+        if res['result'] == 'error':
+            self.__out_res = {'result': 'error', 'detail': 'Disconnected from server'}
+        return self.__out_res
+
+    def __wakeup(self): # wake up receiving thread blocked in selector
+        try:
+            self.__waker_w.send(b'\0')
+        except OSError: # a wakeup is already pending or waker closed
+            pass
+
+    def __close_waker(self): # invoked when receiving thread quit or handshake failed
+        self.__selector.close()
+        self.__waker_r.close()
+        self.__waker_w.close()
 
     ## non-blocking socket.recv handling process
-    def __recv(self):
+    def __recv(self, timeout=None):
+        """ Block until data arrived or timeout second(s), then receive it into self.__decoder
+            return number of bytes received, None if no data yet,
+            Quit if disconnected or woken up by __wakeup()
+        """
+        for key, _ in self.__selector.select(timeout):
+            if key.fileobj is self.__waker_r:
+                return Quit
         try:
-            recv = self.__sock.recv(BUF)
-            if recv == b'':
+            size = self.__decoder.recv_into(self.__sock)
+            if size == 0:
                 # Disconnected from server sent by FIN
-                self.__goodbye()
+                self.__goodbye(self.__sock)
                 return Quit
-            return recv
+            return size
         except socket.error as e:
             if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK,):
                 # No data yet
-                sleep(0.01)
                 return None
             elif e.args[0] in (errno.ECONNRESET, errno.ECONNABORTED,):
                 # Disconnected from server sent by RST/aborted or connection not established
-                self.__goodbye()
+                self.__goodbye(self.__sock)
                 return Quit
             else:
                 raise e
 
     def __recv_handler(self):
-        self.__buf = b''
         while self.__run:
-            if self.__buf == b'':
-                res = self.__recv()
-                if res in (None, Quit):
-                    continue
-                self.__buf += res
-            loc = self.__buf.find(MAGIC)
-            if loc == -1:
-                self.__buf = b''
+            if not self.__connected:
+                self.__reconnect()
                 continue
-            head = self.__buf[loc:][:4] # protocol magic and type
-            if len(head) < 4:
+            timeout = self.__heartbeat()
+            if not self.__connected: # session dead
                 continue
-            # Handle response individually (see __RECV_HANDLE_SWITCH for a specific function)
-            case = Kvm.__RECV_HANDLE_SWITCH.get(head[-1]) # get function by protocol type
-            self.__buf = self.__buf[loc+4:] # trim magic and type
-            case(self) if case else None
+            if self.__recv(timeout) in (None, Quit):
+                continue
+            # Handle messages individually (see __RECV_HANDLE_SWITCH for a specific function)
+            for msg_type, res in self.__decoder.decode():
+                case = Kvm.__RECV_HANDLE_SWITCH.get(msg_type) # get function by protocol type
+                case(self, msg_type, res) if case else None
+                if not self.__connected: # goodbye received
+                    break
+            self.__restored()
 
         ## Thread quit actions
-        with self.__condition:
-            self.__condition.notify() # Notify main thread thread quit completely
+        self.__close_waker()
+        self.__fail_requests()
 
-    def __goodbye(self):
-        self.__run = False
-        self.__sock.close()
-
-    def __handle_ask_alive(self):
-        self.__send(REPLY_ALIVE_MSG)
-
-    def __handle_list_uarts_response(self):
-        uarts = []
-        ## Read number of available serial devices
-        uarts_num = 0
-        while True:
-            if len(self.__buf) == 0:
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            uarts_num = self.__buf[0]
-            self.__buf = self.__buf[1:]
-            break
-
-        ## Return if no serial devices
-        if uarts_num == 0:
-            with self.__lock:
-                self.__resolv_msg[TYPE_LIST_UART_RES] = {'result': 'success', 'detail': []}
+    def __resolve(self, res_type, res): # invoked in receiving thread when response parsed
+        if res_type in Kvm.__ACK_RESPONSE:
+            self.__ack(res_type, res)
             return
-
-        ## Handle each available serial devices
-        for i in range(uarts_num):
-            ## Read serial device name
-            uart_name = ''
-            while True:
-                if len(self.__buf) == 0: # for get name length
-                    res = self.__recv()
-                    if res is None:
-                        continue
-                    elif res is Quit:
-                        return
-                    self.__buf += res
-                    continue
-                uart_name_len = self.__buf[0]
-                if uart_name_len == 0:
-                    ## Return if no serial device name found
-                    with self.__lock:
-                        self.__resolv_msg[TYPE_LIST_UART_RES] = {
-                                'result': 'error',
-                                'detail': 'Server Error: Serial device name length is 0'}
-                    return
-                elif len(self.__buf)-1 < uart_name_len: # for get name
-                    res = self.__recv()
-                    if res is None:
-                        continue
-                    elif res is Quit:
-                        return
-                    self.__buf += res
-                    continue
-                try:
-                    uart_name = self.__buf[1:][:uart_name_len].decode('utf-8')
-                except UnicodeDecodeError:
-                    ## Return if serial device name is not UTF-8 encoding
-                    with self.__lock:
-                        self.__resolv_msg[TYPE_LIST_UART_RES] = {
-                                'result': 'error',
-                                'detail': 'Protocol Error: Serial device name is not valid UTF-8 encoding'}
+        ## Resolve the oldest request waiting for the response, or save it as the last result
+        with self.__lock:
+            futures = self.__futures.get(res_type)
+            while futures:
+                future = futures.popleft()
+                if future.set_running_or_notify_cancel(): # skip request given up by timeout
+                    future.set_result(res)
                     return
-                self.__buf = self.__buf[1+uart_name_len:]
-                break
+            self.__resolv_msg[res_type] = res
 
-            ## Read serial device vid:pid
-            vid, pid = 0, 0
-            while True:
-                if len(self.__buf) < 4: # for get usb vid:pid
-                    res = self.__recv()
-                    if res is None:
-                        continue
-                    elif res is Quit:
-                        return
-                    self.__buf += res
-                    continue
-                vid, pid = struct.unpack('!HH', self.__buf[:4])
-                self.__buf = self.__buf[4:]
-                break
-
-            uarts.append((uart_name, vid, pid))
+    def __ack(self, res_type, res, command=None):
+        """ Pair the ack with the oldest command of its type, then publish it
+            command is (seq, request) if the ack is made up for the command failed to send
+        """
+        with self.__ack_cond:
+            pending = self.__ack_pending[res_type]
+            if command:
+                if command in pending:
+                    pending.remove(command)
+                seq, request = command
+            else:
+                seq, request = pending.popleft() if pending else (None, None) # None if no command sent
+            ack = {'seq': seq, 'request': request, **res}
+            if len(self.__acks) == self.__acks.maxlen:
+                self.acks_dropped += 1
+            self.__acks.append(ack)
+            self.__ack_cond.notify_all()
+        with self.__lock:
+            self.__resolv_msg[res_type] = res
+        callback = self.__ack_callback
+        if callback:
+            callback(ack)
 
-        ## Success get serial devices information
+    def __fail_request(self, res_type, future, res): # resolve the request failed to send with error result
         with self.__lock:
-            self.__resolv_msg[TYPE_LIST_UART_RES] = {'result': 'success', 'detail': copy(uarts)}
+            if future not in self.__futures[res_type]: # already resolved, e.g. by __fail_requests()
+                return
+            self.__futures[res_type].remove(future)
+        if future.set_running_or_notify_cancel():
+            future.set_result(res)
 
-    def __handle_list_captures_response(self):
-        caps = []
-        ## Read number of available serial devices
-        caps_num = 0
-        while True:
-            if len(self.__buf) == 0:
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            caps_num = self.__buf[0]
-            self.__buf = self.__buf[1:]
-            break
-
-        ## Return if no video captures
-        if caps_num == 0:
-            with self.__lock:
-                self.__resolv_msg[TYPE_LIST_CAP_RES] = {'result': 'success', 'detail': []}
+    def __take_requests(self): # take all requests waiting for response
+        with self.__lock:
+            futures = [future for res_type in self.__futures for future in self.__futures[res_type]]
+            for res_type in self.__futures:
+                self.__futures[res_type].clear()
+        return futures
+
+    def __fail_requests(self, futures=None): # invoked when receiving thread quit or connection lost
+        with self.__ack_cond:
+            self.__ack_cond.notify_all() # wake up read_acks() waiting
+        if futures is None:
+            futures = self.__take_requests()
+        for future in futures:
+            if future.set_running_or_notify_cancel():
+                future.set_result({'result': 'error', 'detail': 'Disconnected from server'})
+
+    def __goodbye(self, sock=None):
+        """ Connection closed by server or lost, ignored if sock is not the current connection
+            receiving thread reconnects if self.reconnect, else the session ends
+            commands and requests sent or queued in the lost connection fail
+        """
+        if not self.__connected: # closed while handshaking, nothing sent or queued yet
             return
-
-        ## Handle each available video captures
-        for i in range(caps_num):
-            ## Read video capture name
-            cap_name = ''
-            while True:
-                if len(self.__buf) == 0: # for get length of name
-                    res = self.__recv()
-                    if res is None:
-                        continue
-                    elif res is Quit:
-                        return
-                    self.__buf += res
-                    continue
-                cap_name_len = self.__buf[0]
-                if cap_name_len == 0:
-                    ## Return if no video capture name found
-                    with self.__lock:
-                        self.__resolv_msg[TYPE_LIST_CAP_RES] = {
-                                'result': 'error',
-                                'detail': 'Server Error: Video capture name length is 0'}
-                    return
-                elif len(self.__buf)-1 < cap_name_len: # for get name
-                    res = self.__recv()
-                    if res is None:
-                        continue
-                    elif res is Quit:
-                        return
-                    self.__buf += res
-                    continue
-                try:
-                    cap_name = self.__buf[1:][:cap_name_len].decode('utf-8')
-                except UnicodeDecodeError:
-                    ## Return if video capture name is not UTF-8 encoding
-                    with self.__lock:
-                        self.__resolv_msg[TYPE_LIST_CAP_RES] = {
-                                'result': 'error',
-                                'detail': 'Protocol Error: Video capture name is not valid UTF-8 encoding'}
+        with self.__ack_cond:
+            with self.__out_cond:
+                if not self.__connected or sock not in (None, self.__sock):
                     return
-                self.__buf = self.__buf[1+cap_name_len:]
-                break
+                self.__connected = False
+                stale = list(self.__outbox)
+                self.__outbox.clear()
+            # commands issued after it are buffered for the next connection
+            lost = [(res_type, command) for res_type in self.__ack_pending
+                for command in self.__ack_pending[res_type] if command[0] <= self.__seq]
+            for res_type, command in lost:
+                self.__ack_pending[res_type].remove(command)
+            if self.input_policy == 'drop':
+                self.__motion, self.__motion_due = [0, 0], None
+            reconnect = self.reconnect and self.__run
+            if reconnect:
+                self.__reconnecting = True
+            else:
+                self.__run = False
+            futures = self.__take_requests()
+        if not reconnect:
+            self.__close_outbox()
+        self.__wakeup()
+        self.__sock.close()
 
-            ## Read number of resolution
-            res_num = 0
-            while True:
-                if len(self.__buf) == 0:
-                    res = self.__recv()
-                    if res is None:
-                        continue
-                    elif res is Quit:
-                        return
-                    self.__buf += res
-                    continue
-                res_num = self.__buf[0]
-                self.__buf = self.__buf[1:]
+        ## Fail what queued or waiting for response in the lost connection
+        res = {'result': 'error', 'detail': 'Disconnected from server'}
+        for _, on_error in stale:
+            on_error(res) if on_error else None
+        for res_type, command in lost:
+            self.__ack(res_type, res, command)
+        self.__fail_requests(futures)
+        if reconnect:
+            self.__notify_reconnect('lost', 0, res['detail'])
+
+    def __reconnect(self):
+        """ Reconnect to server with exponential backoff and full jitter, invoked in receiving thread
+            the opened serial device and mjpg-streamer are restored ahead of messages buffered while reconnecting,
+            the session ends if all self.reconnect tries failed
+        """
+        self.__close_waker()
+        self.__restoring = None
+        for attempt in range(1, self.reconnect+1):
+            if self.__stop.wait(random.uniform(0, min(RECONNECT_CAP, RECONNECT_BASE*2**(attempt-1)))):
+                return # end() called
+            try:
+                res = self.__hello()
+            except OSError as e:
+                res = {'result': 'error', 'detail': str(e)}
+            if res['result'] == 'success':
                 break
+            self.__sock.close()
+            self.__close_waker()
+            self.__notify_reconnect('retry', attempt, res['detail'])
+        else:
+            self.__run = False
+            self.__reconnecting = False
+            self.__close_outbox()
+            self.__notify_reconnect('failed', self.reconnect, 'Reconnecting reached the max tries')
+            return
+        if self.__stop.is_set(): # end() called while handshaking
+            return
 
-            ## Return if no resolution
-            if res_num == 0:
-                with self.__lock:
-                    self.__resolv_msg[TYPE_LIST_CAP_RES] = {
-                            'result': 'error',
-                            'detail': 'Server Error: Video capture "%s" no resolution' %cap_name}
-                return
-
-            attr = []
-            for j in range(res_num):
-                ## Read resolution
-                width, height = 0, 0
-                while True:
-                    if len(self.__buf) < 4: # for get width and height
-                        res = self.__recv()
-                        if res is None:
-                            continue
-                        elif res is Quit:
-                            return
-                        self.__buf += res
-                        continue
-                    width, height = struct.unpack('!HH', self.__buf[:4])
-                    self.__buf = self.__buf[4:]
-                    break
+        ## Restore serial device and mjpg-streamer, then resume writing
+        with self.__rtt_lock:
+            self.__pings.clear()
+            self.__ping_due = perf_counter()+self.heartbeat
+            self.__lost = False
+        self.reconnects += 1
+        self.__notify_reconnect('connected', attempt, None)
+        self.__restoring = {}
+        if self.__restore['mjpg']:
+            self.__restoring['mjpg'] = self.__request(
+                    RUN_MJPG_REQ(*self.__restore['mjpg']), TYPE_RUN_MJPG_RES, None, False, True)
+        if self.__restore['uart']: # queued in front of mjpg, the order of start()
+            self.__restoring['uart'] = self.__request(
+                    OPEN_UART_REQ(self.__restore['uart']), TYPE_OPEN_UART_RES, None, False, True)
+        with self.__out_cond:
+            self.__connected = True
+            self.__out_cond.notify()
+        self.__restored()
+
+    def __restored(self): # notify once all restoring requests resolved, invoked in receiving thread
+        if self.__restoring is None or not all([future.done() for future in self.__restoring.values()]):
+            return
+        res = {name: future.result() for name, future in self.__restoring.items()}
+        self.__restoring = None
+        self.__reconnecting = False
+        self.__notify_reconnect('restored', self.reconnects, res)
+
+    def __notify_reconnect(self, event, attempt, detail):
+        callback = self.__reconnect_callback
+        if callback:
+            callback({'event': event, 'attempt': attempt, 'detail': detail})
+
+    def __reset_heartbeat(self):
+        with self.__rtt_lock:
+            self.__pings = deque() # sent time of asking not replied yet
+            self.__ping_due = perf_counter()+self.heartbeat # time of next asking
+            self.__rtts = deque(maxlen=RTT_WINDOW)
+            self.__replies = 0
+            self.__lost = False
+
+    def __heartbeat(self):
+        """ Ask server alive every self.heartbeat second(s), invoked in receiving thread
+            disconnect if asking not replied reaches self.heartbeat_misses
+            return second(s) until next asking, None if heartbeat disabled
+        """
+        if not self.heartbeat:
+            return None
+        now = perf_counter()
+        if now >= self.__ping_due:
+            with self.__rtt_lock:
+                if len(self.__pings) >= self.heartbeat_misses:
+                    self.__lost = True
+            if self.__lost:
+                self.__goodbye()
+                return None
+            with self.__rtt_lock:
+                self.__pings.append(now)
+            self.__post(ASK_ALIVE_MSG)
+            self.__ping_due = now+self.heartbeat
+        return self.__ping_due-now
 
-                ## Read number of frame rates
-                fps_num = 0
-                while True:
-                    if len(self.__buf) == 0:
-                        res = self.__recv()
-                        if res is None:
-                            continue
-                        elif res is Quit:
-                            return
-                        self.__buf += res
-                        continue
-                    fps_num = self.__buf[0]
-                    self.__buf = self.__buf[1:]
-                    break
+    def __handle_reply_alive(self, msg_type, res): # the oldest asking replied
+        with self.__rtt_lock:
+            if self.__pings:
+                self.__rtts.append(perf_counter()-self.__pings.popleft())
+                self.__replies += 1
 
-                ## Return if no frame rate
-                if fps_num == 0:
-                    with self.__lock:
-                        self.__resolv_msg[TYPE_LIST_CAP_RES] = {
-                                'result': 'error',
-                                'detail': 'Server Error: Video capture "%s" no frame rate' %cap_name}
-                    return
+    def __handle_goodbye(self, msg_type, res):
+        self.__goodbye()
 
-                fps = []
-                for k in range(fps_num):
-                    ## Read frame rate
-                    rate = 0
-                    while True:
-                        if len(self.__buf) == 0: # for get frame rate
-                            res = self.__recv()
-                            if res is None:
-                                continue
-                            elif res is Quit:
-                                return
-                            self.__buf += res
-                            continue
-                        rate  = self.__buf[0]
-                        self.__buf = self.__buf[1:]
-                        break
-                    fps.append(rate)
+    def __handle_ask_alive(self, msg_type, res):
+        self.__post(REPLY_ALIVE_MSG)
 
-                attr.append(((width, height), fps))
+    __RECV_HANDLE_SWITCH = {
+        TYPE_GOODBYE: __handle_goodbye,
+        TYPE_ASK_ALIVE: __handle_ask_alive,
+        TYPE_REPLY_ALIVE: __handle_reply_alive,
+        TYPE_LIST_UART_RES: __resolve,
+        TYPE_LIST_CAP_RES: __resolve,
+        TYPE_RUN_MJPG_RES: __resolve,
+        TYPE_OPEN_UART_RES: __resolve,
+        TYPE_SEND_KEY_RES: __resolve,
+        TYPE_SEND_MOUSE_RES: __resolve,
+        TYPE_SEND_ATX_RES: __resolve,}
+
+    __REQUEST_RESPONSE = ( # response types of requests waiting for response in __request()
+        TYPE_LIST_UART_RES,
+        TYPE_LIST_CAP_RES,
+        TYPE_RUN_MJPG_RES,
+        TYPE_OPEN_UART_RES,)
+
+    __ACK_RESPONSE = ( # response types of commands acknowledged in ack stream, see read_acks()
+        TYPE_SEND_KEY_RES,
+        TYPE_SEND_MOUSE_RES,
+        TYPE_SEND_ATX_RES,)
+
+    def __send_ack(self, res_type, request, msg):
+        """ Queue command msg acknowledged by response with type res_type
+            request is the descriptor of command, e.g. ('send_key', act, key), paired with its ack
+            return result dict with 'seq', the sequence number of command found in its ack,
+            an error ack with the same 'seq' is published if the command failed to send
+        """
+        with self.__ack_cond: # keep sequence numbers in the order commands queued
+            self.__flush_motion(None) # all motions before the command come first
+            self.__seq += 1
+            command = (self.__seq, request)
+            self.__ack_pending[res_type].append(command)
+            res = self.__post(msg, lambda res: self.__ack(res_type, res, command), buffered=True)
+        if res['result'] == 'error':
+            with self.__ack_cond:
+                self.__ack_pending[res_type].remove(command)
+        res['seq'] = command[0]
+        return res
 
-            caps.append((cap_name, attr))
+    def __flush_motion(self, max_steps=MOUSE_MAX_STEPS):
+        """ Queue accumulated mouse motion as steps within -127~127 in one message, hold self.__ack_cond
+            at most max_steps steps are queued (no limit if None), the remainder is carried to next interval
+        """
+        x, y = self.__motion
+        commands, msgs = [], []
+        while (x, y) != (0, 0) and (max_steps is None or len(commands) < max_steps):
+            # split evenly into the least steps
+            steps = max(ceil(abs(x)/MOUSE_STEP), ceil(abs(y)/MOUSE_STEP))
+            dx, dy = int(x/steps), int(y/steps)
+            x, y = x-dx, y-dy
+            self.__seq += 1
+            commands.append((self.__seq, ('move_mouse', dx, dy)))
+            msgs.append(SEND_MOUSE_REQ_M(dx, dy))
+        self.__motion = [x, y]
+        self.__motion_due = None if (x, y) == (0, 0) else time()+self.mouse_interval
+        if not commands:
+            return
+        pending = self.__ack_pending[TYPE_SEND_MOUSE_RES]
+        pending.extend(commands)
+        res = self.__post(b''.join(msgs),
+                lambda res: [self.__ack(TYPE_SEND_MOUSE_RES, res, command) for command in commands], buffered=True)
+        if res['result'] == 'error':
+            for command in commands:
+                pending.remove(command)
+
+    def __post(self, msg, on_error=None, buffered=False, front=False):
+        """ Queue msg for writer thread, return error if the writer quit
+            on_error is called with the error result in writer thread if msg failed to send
+            while reconnecting, msg is refused unless buffered (input commands) under 'buffer' input policy,
+            or queued in front (restoring requests)
+        """
+        with self.__out_cond:
+            if self.__out_closed:
+                return {'result': 'error', 'detail': 'Kvm instance not started'}
+            if front:
+                self.__outbox.appendleft((msg, on_error))
+            elif self.__connected:
+                self.__outbox.append((msg, on_error))
+            elif not buffered:
+                return {'result': 'error', 'detail': 'Reconnecting to server'}
+            elif self.input_policy == 'drop':
+                return {'result': 'error', 'detail': 'Reconnecting to server, input dropped'}
+            elif len(self.__outbox) >= RECONNECT_BUFFER:
+                return {'result': 'error', 'detail': 'Reconnecting to server, input buffer full'}
+            else:
+                self.__outbox.append((msg, on_error))
+            self.__out_cond.notify()
+        return {'result': 'success'}
 
-        ## Success get video captures information
-        with self.__lock:
-            self.__resolv_msg[TYPE_LIST_CAP_RES] = {'result': 'success', 'detail': copy(caps)}
+    def __close_outbox(self): # writer thread quits after all queued messages written
+        with self.__out_cond:
+            self.__out_closed = True
+            self.__out_cond.notify()
 
-    def __handle_status_code_response(self, res_type):
-        ## Read status code
-        status = 0xFF
+    def __write_handler(self):
         while True:
-            if len(self.__buf) == 0: # for get status code
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return
-                self.__buf += res
-                continue
-            status = self.__buf[0]
-            self.__buf = self.__buf[1:]
-            break
-
-        if status in STATUS_CODE:
-            ## Read detail
-            detail = ''
-            while True:
-                if len(self.__buf) == 0: # for get detail length
-                    res = self.__recv()
-                    if res is None:
-                        continue
-                    elif res is Quit:
-                        return
-                    self.__buf += res
-                    continue
-                detail_len = self.__buf[0]
-                if len(self.__buf)-1 < detail_len: # for get detail
-                    res = self.__recv()
-                    if res is None:
-                        continue
-                    elif res is Quit:
-                        return
-                    self.__buf += res
+            ## Queue mouse motion accumulated for an interval
+            if self.__motion_due is not None and time() >= self.__motion_due:
+                with self.__ack_cond:
+                    if self.__motion_due is not None and time() >= self.__motion_due:
+                        self.__flush_motion()
+            ## Take all queued messages, e.g. a burst of key presses, and write them at once
+            #  messages are held while reconnecting
+            with self.__out_cond:
+                if not (self.__outbox and self.__connected or self.__out_closed):
+                    due = self.__motion_due
+                    self.__out_cond.wait(None if due is None else max(due-time(), 0))
+                if not (self.__outbox and self.__connected):
+                    if self.__out_closed:
+                        batch = list(self.__outbox) # never sent as reconnecting given up
+                        self.__outbox.clear()
+                        if batch: # e.g. GOODBYE_MSG of end() while reconnecting
+                            self.__out_res = {'result': 'error', 'detail': 'Disconnected from server'}
+                        break
                     continue
-                try:
-                    detail = self.__buf[1:][:detail_len].decode('utf-8')
-                except UnicodeDecodeError:
-                    ## Return if detail is not UTF-8 encoding
-                    with self.__lock:
-                        self.__resolv_msg[res_type] = {
-                                'result': 'error',
-                                'detail': 'Protocol Error: %s detail message is not valid UTF-8 encoding' %(
-                                    STATUS_CODE[status].capitalize(),)}
-                    return
-                self.__buf = self.__buf[1+detail_len:]
-                break
-
-            ## Success get detail
-            with self.__lock:
-                self.__resolv_msg[res_type] = {'result': STATUS_CODE[status], 'detail': detail}
-        else:
-            ## Return failure if unknown status code occured
-            with self.__lock:
-                self.__resolv_msg[res_type] = {
-                        'result': 'error',
-                        'detail': 'Protocol Error: Invalid status code <{:02X}>'.format(status)}
-
-    __RECV_HANDLE_SWITCH = {
-        TYPE_GOODBYE: __goodbye,
-        TYPE_ASK_ALIVE: __handle_ask_alive,
-        #TYPE_REPLY_ALIVE: __handle_reply_alive,
-        TYPE_LIST_UART_RES: __handle_list_uarts_response,
-        TYPE_LIST_CAP_RES: __handle_list_captures_response,
-        TYPE_RUN_MJPG_RES: partial(__handle_status_code_response, res_type=TYPE_RUN_MJPG_RES),
-        TYPE_OPEN_UART_RES: partial(__handle_status_code_response, res_type=TYPE_OPEN_UART_RES),
-        TYPE_SEND_KEY_RES: partial(__handle_status_code_response, res_type=TYPE_SEND_KEY_RES),
-        TYPE_SEND_MOUSE_RES: partial(__handle_status_code_response, res_type=TYPE_SEND_MOUSE_RES),
-        TYPE_SEND_ATX_RES: partial(__handle_status_code_response, res_type=TYPE_SEND_ATX_RES),}
+                batch = list(self.__outbox)
+                self.__outbox.clear()
+                sock = self.__sock # messages of a lost connection never sent in the next one
+            try:
+                res = self.__send(b''.join([msg for msg, _ in batch]), sock)
+            except (OSError, ValueError) as e: # socket closed by __goodbye()
+                res = {'result': 'error', 'detail': 'socket.send failed: %s' %e}
+            self.__out_res = res
+            self.writes += 1
+            self.messages += len(batch)
+            if res['result'] == 'error':
+                for _, on_error in batch:
+                    on_error(res) if on_error else None
+        res = {'result': 'error', 'detail': 'Disconnected from server'}
+        for _, on_error in batch:
+            on_error(res) if on_error else None
 
     ## secure socket.send
-    def __send(self, msg):
-        sent, timer = 0, 0
+    def __send(self, msg, sock=None):
+        # write immediately, wait for the socket writable only if kernel buffer is full
+        sock = sock or self.__sock
+        deadline = time()+TIMEOUT_RT
+        msg = memoryview(msg)
         while True:
-            sleep(0.01)
-            if timer > TIMEOUT_RT:
-                return {'result': 'error', 'detail': 'socket.send timeout'}
             try:
-                sent = self.__sock.send(msg)
+                sent = sock.send(msg)
             except socket.error as e:
-                if e.args[0] == errno.ECONNRESET:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK,):
+                    sent = 0
+                elif e.args[0] == errno.ECONNRESET:
                     # Disconnected from client sent by RST
-                    self.__goodbye()
+                    self.__goodbye(sock)
                     return {'result': 'error', 'detail': 'client got RST'}
                 elif e.args[0] == errno.ECONNABORTED:
                     # Disconnected since server aborted
-                    self.__goodbye()
+                    self.__goodbye(sock)
                     return {'result': 'error', 'detail': 'connection aborted'}
                 else:
                     raise e
             msg = msg[sent:]
-            if len(msg) > 0:
-                timer += 1
-                continue
-            return {'result': 'success'}
+            if len(msg) == 0:
+                return {'result': 'success'}
+            remain = deadline-time()
+            if remain <= 0:
+                return {'result': 'error', 'detail': 'socket.send timeout'}
+            select.select([], [sock], [], remain)
 
     def __hello(self):
         ## Init ikvm client socket
@@ -534,150 +756,118 @@ class Kvm:
         self.__sock = socket.socket(AF_INET, socket.SOCK_STREAM) # connection with iKVM's ip using ipv4/ipv6
         self.__sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # disable Nagle Delay
         self.__sock.setblocking(False)
+        self.__decoder = StreamDecoder(BUF) # received bytes parsed in place
+        ## Init selector waking up on received data, or on wakeup message sent by end() for quitting
+        self.__waker_r, self.__waker_w = socket.socketpair()
+        self.__waker_w.setblocking(False)
+        self.__selector = selectors.DefaultSelector()
+        self.__selector.register(self.__sock, selectors.EVENT_READ)
+        self.__selector.register(self.__waker_r, selectors.EVENT_READ)
         try:
             self.__sock.connect((self.ip, self.port))
         except socket.error as e:
-            if e.args[0] != errno.EWOULDBLOCK: # skipped non-blocking error
+            if e.args[0] not in (errno.EWOULDBLOCK, errno.EINPROGRESS,): # skipped non-blocking error
                 raise e
 
+        ## Wait until TCP connection established, failure is reported in exceptional fds on Windows
+        #  interrupted by __wakeup() if end() called while reconnecting
+        woken, writable, failed = select.select([self.__waker_r], [self.__sock], [self.__sock], TIMEOUT_LAG)
+        if woken:
+            return {'result': 'error', 'detail': 'Connecting interrupted'}
+        if not (writable or failed):
+            return {'result': 'error', 'detail': 'Send message timeout'}
+        err = self.__sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err in (errno.ECONNREFUSED, getattr(errno, 'WSAECONNREFUSED', None),):
+            ## Connection refused by server
+            return {'result': 'error', 'detail': 'Connection Refused'}
+        elif err != 0:
+            raise socket.error(err, os.strerror(err))
+
         ## Send handshake message to server
-        timer = time()
-        while True:
-            sleep(0.01)
-            if time()-timer > TIMEOUT_LAG:
-                return {'result': 'error', 'detail': 'Send message timeout'}
-            try:
-                res = self.__send(HANDSHAKE_MSG)
-            except socket.error as e:
-                ## TCP connection is still not established, re-send handshake message
-                if e.args[0] == errno.ENOTCONN:
-                    continue
-                ## Connection refused by server
-                elif e.args[0] == errno.ECONNREFUSED:
-                    return {'result': 'error', 'detail': 'Connection Refused'}
-                raise e
-            if res['result'] == 'error':
-                return res
-            break
+        res = self.__send(HANDSHAKE_MSG)
+        if res['result'] == 'error':
+            return res
 
         ## Wait until handshake message received from server
-        buf, timer = b'', time()
+        deadline = time()+TIMEOUT_LAG
         while True:
-            sleep(0.01)
-            if time()-timer > TIMEOUT_LAG:
+            remain = deadline-time()
+            if remain <= 0:
                 return {'result': 'error', 'detail': 'Received response timeout'}
-            if buf == b'':
-                res = self.__recv()
-                if res is None:
-                    continue
-                elif res is Quit:
-                    return {'result': 'error', 'detail': 'Connection Reset: Exist client connected'}
-                buf += res
-            loc = buf.find(MAGIC)
-            if loc == -1:
-                buf = b''
+            res = self.__recv(remain)
+            if res is None:
                 continue
-            head = buf[loc:][:4] # protocol magic and type
-            if len(head) < 4 or head[-1] != TYPE_HANDSHAKE:
-                continue
-            return {'result': 'success'}
-
-    def __list_uarts(self):
-        res = self.__send(LIST_UART_REQ)
+            elif res is Quit:
+                return {'result': 'error', 'detail': 'Connection Reset: Exist client connected'}
+            for msg_type, _ in self.__decoder.decode(): # messages after handshake kept in decoder
+                if msg_type == TYPE_HANDSHAKE:
+                    return {'result': 'success'}
+
+    def __request(self, msg, res_type, timeout_detail, wait=True, restore=False):
+        """ Send request msg and wait for the response with type res_type in TIMEOUT_LAG second(s)
+            return the response result, or a Future resolved with the result if wait is False
+            restore is True for restoring requests sent ahead of messages buffered while reconnecting
+        """
+        ## Register before sending, a fast response never comes earlier than its request
+        future = Future()
+        with self.__lock:
+            self.__futures[res_type].append(future)
+        res = self.__post(msg, partial(self.__fail_request, res_type, future), front=restore)
         if res['result'] == 'error':
-            return res
-        self.__resolv_msg[TYPE_LIST_UART_RES] = None
-        timer = time()
-        while self.__resolv_msg[TYPE_LIST_UART_RES] is None:
-            sleep(0.01)
-            if time()-timer > TIMEOUT_LAG:
-                return {'result': 'error', 'detail': 'List serial devies timeout'}
-        return self.__resolv_msg[TYPE_LIST_UART_RES]
+            self.__fail_request(res_type, future, res)
+        if not wait:
+            return future
+        try:
+            return future.result(TIMEOUT_LAG)
+        except FutureTimeoutError:
+            if not future.cancel(): # resolved just now
+                return future.result()
+            return {'result': 'error', 'detail': timeout_detail}
+
+    def __list_uarts(self, wait=True):
+        return self.__request(LIST_UART_REQ, TYPE_LIST_UART_RES, 'List serial devies timeout', wait)
 
     def __open_uart(self, port):
-        res = self.__send(OPEN_UART_REQ(port))
-        if res['result'] == 'error':
-            return res
-        self.__resolv_msg[TYPE_OPEN_UART_RES] = None
-        timer = time()
-        while self.__resolv_msg[TYPE_OPEN_UART_RES] is None:
-            sleep(0.01)
-            if time()-timer > TIMEOUT_LAG:
-                return {'result': 'error', 'detail': 'Open serial devies "%s" timeout' %port}
-        return self.__resolv_msg[TYPE_OPEN_UART_RES]
-
-    def __list_captures(self):
-        res = self.__send(LIST_CAP_REQ)
-        if res['result'] == 'error':
-            return res
-        self.__resolv_msg[TYPE_LIST_CAP_RES] = None
-        timer = time()
-        while self.__resolv_msg[TYPE_LIST_CAP_RES] is None:
-            sleep(0.01)
-            if time()-timer > TIMEOUT_LAG:
-                return {'result': 'error', 'detail': 'List video captures timeout'}
-        return self.__resolv_msg[TYPE_LIST_CAP_RES]
+        res = self.__request(OPEN_UART_REQ(port), TYPE_OPEN_UART_RES, 'Open serial devies "%s" timeout' %port)
+        if res['result'] == 'success':
+            self.__restore['uart'] = port # reopened after reconnected
+        return res
+
+    def __list_captures(self, wait=True):
+        return self.__request(LIST_CAP_REQ, TYPE_LIST_CAP_RES, 'List video captures timeout', wait)
 
     def __start_mjpg(self, device, resolution, fps, port):
-        res = self.__send(RUN_MJPG_REQ(device, resolution, fps, port))
-        if res['result'] == 'error':
-            return res
-        self.__resolv_msg[TYPE_RUN_MJPG_RES] = None
-        timer = time()
-        while self.__resolv_msg[TYPE_RUN_MJPG_RES] is None:
-            sleep(0.01)
-            if time()-timer > TIMEOUT_LAG:
-                return {'result': 'error',
-                        'detail': 'Start mjpg-streamer with video capture "%s" on port "%s" timeout' %(device, port,)}
-        return self.__resolv_msg[TYPE_RUN_MJPG_RES]
+        res = self.__request(
+                RUN_MJPG_REQ(device, resolution, fps, port), TYPE_RUN_MJPG_RES,
+                'Start mjpg-streamer with video capture "%s" on port "%s" timeout' %(device, port,))
+        if res['result'] == 'success':
+            self.__restore['mjpg'] = (device, resolution, fps, port) # restarted after reconnected
+        return res
 
     def __capture_select(self, device=None, resolution=None, fps=None):
         ## List available video captures
         res = self.__list_captures()
         if res['result'] == 'error':
             return res
-        caps = res['detail']
-        if not caps:
-            return {'result': 'error', 'detail': 'No available video capture'}
-
-        ## Determine what video capture for using
-        cap_name = device if device else self.cap_name
-        if cap_name:
-            cap = list(filter(lambda cap: cap_name in cap[0], caps))
-            if not cap:
-                return {'result': 'error',
-                        'detail': 'No available video capture "%s"' %cap_name}
-            cap_no = caps.index(cap[0])
-            self.cap_name = caps[cap_no][0]
-        else:
-            self.cap_name = cap_name = caps[0][0]
-            cap_no = 0
-
-        ## Determine what resolution for using
-        all_resolution = list(map(lambda attr: attr[0], caps[cap_no][1]))
-        fun = max if self.cap_quality == 'best' else min
-        if resolution is None:
-            # find resolution that the scale is satisfied with cap_scale
-            target = list(filter(lambda res: res_scale(*res)==self.cap_scale, all_resolution))
-            target = target if target else all_resolution
-            area = tuple(map(lambda res: res[0]*res[1], target))
-            i = area.index(fun(area)) # find index satisfy policy
-            resolution = target[i]
-
-        ## Determine what frame rate for using
-        if fps is None:
-            # find the fps satisfied with cap_quality
-            i = all_resolution.index(resolution) if resolution in all_resolution else 0 # find index satisfy policy
-            fps = fun(caps[cap_no][1][i][1])
+        res = _choose_capture(
+                res['detail'], device if device else self.cap_name, self.cap_scale, self.cap_quality, resolution, fps)
+        if res['result'] == 'error':
+            return res
+        self.cap_name, resolution, fps = res['detail']
 
         ## Start ikvm mjpg-streamer
-        return self.__start_mjpg(cap_name, resolution, fps, self.mjpg_port)
+        return self.__start_mjpg(self.cap_name, resolution, fps, self.mjpg_port)
 
-    def list_serial_devices(self):
+    def list_serial_devices(self, wait=True):
+        """ Return result dict with a list of serial devices (name, vid, pid) on iKVM
+            return a Future resolved with the result dict instead if wait is False,
+            e.g. send several requests at once then wait for all their results
+        """
         if not self.__run:
-            return {'result': 'error', 'detail': 'Kvm instance not started'}
+            res = {'result': 'error', 'detail': 'Kvm instance not started'}
+            return _resolved(res) if not wait else res
 
-        return self.__list_uarts()
+        return self.__list_uarts(wait)
 
     def __uart_select(self, port=None):
         uart_port = port if port else self.uart_port
@@ -686,18 +876,10 @@ class Kvm:
             res = self.__list_uarts()
             if res['result'] == 'error':
                 return res
-            uarts = res['detail']
-            if not uarts:
-                return {'result': 'error', 'detail': 'No serial device on iKVM'}
-            if self.usbid:
-                target = list(filter(lambda usb: self.usbid==(usb[1], usb[2]), uarts))
-                uart_port = target[0][0] if target else None
-            else:
-                uart_port = uarts[0][0]
-            if uart_port is None:
-                return {'result': 'error',
-                        'detail': 'No such serial device with USB-ID "{:04X}:{:04X}" on iKVM'.format(*self.usbid)}
-            self.uart_port = uart_port
+            res = _choose_uart(res['detail'], self.usbid)
+            if res['result'] == 'error':
+                return res
+            self.uart_port = uart_port = res['detail']
 
         ## Open ikvm serial device with port
         return self.__open_uart(uart_port)
@@ -709,11 +891,15 @@ class Kvm:
             return {'result': 'error', 'detail': 'Kvm instance not started'}
         return self.__uart_select(port)
 
-    def list_captures(self):
+    def list_captures(self, wait=True):
+        """ Return result dict with a list of video captures (name, [((w, h), [fps,]),]) on iKVM
+            return a Future resolved with the result dict instead if wait is False
+        """
         if not self.__run:
-            return {'result': 'error', 'detail': 'Kvm instance not started'}
+            res = {'result': 'error', 'detail': 'Kvm instance not started'}
+            return _resolved(res) if not wait else res
 
-        return self.__list_captures()
+        return self.__list_captures(wait)
 
     def alt_capture(self, device=None, resolution=None, fps=None):
         """ Choose capture with name self.cap_name or first found capture if device is None
@@ -722,23 +908,7 @@ class Kvm:
             Choose frame rate according to self.cap_scale and self.cap_quality if fps is None
         """
         ## Accept valid arguments
-        assert isinstance(device, (str, type(None)))
-        if isinstance(resolution, tuple):
-            assert len(resolution) == 2
-            assert all([x in range(1, 0x10000) for x in resolution])
-        elif isinstance(resolution, str):
-            if re.match(r'^\d+x\d+$', resolution):
-                resolution = tuple(map(int, resolution.split('x')))
-                assert all([x in range(1, 0x10000) for x in resolution])
-            else:
-                raise TypeError("resolution string should be like '1920x1080'")
-        elif resolution is not None:
-            raise TypeError('resolution not valid')
-        if isinstance(fps, int):
-            if fps not in range(1, 0x100):
-                raise TypeError('fps value should between 0 and 255')
-        elif fps is not None:
-            raise TypeError('fps not valid')
+        resolution = _capture_args(device, resolution, fps)
 
         if not self.__run:
             return {'result': 'error', 'detail': 'Kvm instance not started'}
@@ -750,13 +920,10 @@ class Kvm:
             return {'result': 'error', 'detail': 'Kvm instance not started'}
 
         ## Arguments Validity Check
-        if act in ('press', 'release'):
-            act = KEY_PRESS if act == 'press' else KEY_RELEASE
-        elif act not in (KEY_PRESS, KEY_RELEASE):
-            raise TypeError('Argument act should be "press", "release", %d or %d' %(KEY_PRESS, KEY_RELEASE))
+        act = _key_act(act)
         assert key in range(ARDUINO_MAX_KEY+1)
 
-        return self.__send(SEND_KEY_REQ_K(act, key))
+        return self.__send_ack(TYPE_SEND_KEY_RES, ('send_key', act, key), SEND_KEY_REQ_K(act, key))
 
     def send_text(self, text): # send text as keyboard input
         if not self.__run:
@@ -764,65 +931,77 @@ class Kvm:
 
         ## Arguments Validity Check
         #assert isinstance(text, str)
-        assert all([ord(char) in range(0x80) for char in text]) # ASCII only
+        assert text.isascii() # ASCII only
         #assert len(text) < 0x10000
 
-        return self.__send(SEND_KEY_REQ_C(text))
+        return self.__send_ack(TYPE_SEND_KEY_RES, ('send_text', text), SEND_KEY_REQ_C(text))
 
     def release_keys(self): # send release all keys command to iKVM
         if not self.__run:
             return {'result': 'error', 'detail': 'Kvm instance not started'}
 
-        return self.__send(SEND_KEY_REQ_R)
+        return self.__send_ack(TYPE_SEND_KEY_RES, ('release_keys',), SEND_KEY_REQ_R)
 
     def click_mouse(self, act, button):
         if not self.__run:
             return {'result': 'error', 'detail': 'Kvm instance not started'}
 
         ## Arguments Validity Check
-        if act in ('press', 'release'):
-            act = MOUSE_PRESS if act == 'press' else MOUSE_RELEASE
-        elif act not in (MOUSE_PRESS, MOUSE_RELEASE):
-            raise TypeError('Argument act should be "press", "release", %d or %d' %(MOUSE_PRESS, MOUSE_RELEASE))
+        act = _mouse_act(act)
         assert button in ARDUINO_MOUSE_BUTTONS
 
-        return self.__send(SEND_MOUSE_REQ_K(act, button))
+        return self.__send_ack(TYPE_SEND_MOUSE_RES, ('click_mouse', act, button), SEND_MOUSE_REQ_K(act, button))
 
     def move_mouse(self, x, y):
+        """ Move mouse cursor by (x, y) in any distance
+            motions are accumulated and queued every self.mouse_interval second(s) as steps within -127~127,
+            acks of the steps have their own sequence numbers
+        """
         if not self.__run:
             return {'result': 'error', 'detail': 'Kvm instance not started'}
 
-        return self.__send(SEND_MOUSE_REQ_M(x, y))
+        ## Arguments Validity Check
+        assert isinstance(x, int) and isinstance(y, int)
+
+        with self.__ack_cond:
+            if not self.__connected and self.input_policy == 'drop':
+                return {'result': 'error', 'detail': 'Reconnecting to server, input dropped'}
+            self.__motion[0] += x
+            self.__motion[1] += y
+            if self.mouse_interval == 0:
+                self.__flush_motion()
+            elif self.__motion_due is None:
+                self.__motion_due = time()+self.mouse_interval
+                with self.__out_cond:
+                    self.__out_cond.notify() # writer thread waits until the motion due
+        return {'result': 'success'}
 
     def scroll_mouse_wheel_up(self):
         if not self.__run:
             return {'result': 'error', 'detail': 'Kvm instance not started'}
 
-        return self.__send(SEND_MOUSE_REQ_S(MOUSE_WHEEL_UP))
+        return self.__send_ack(TYPE_SEND_MOUSE_RES, ('scroll_mouse_wheel_up',), SEND_MOUSE_REQ_S(MOUSE_WHEEL_UP))
 
     def scroll_mouse_wheel_down(self):
         if not self.__run:
             return {'result': 'error', 'detail': 'Kvm instance not started'}
 
-        return self.__send(SEND_MOUSE_REQ_S(MOUSE_WHEEL_DOWN))
+        return self.__send_ack(TYPE_SEND_MOUSE_RES, ('scroll_mouse_wheel_down',), SEND_MOUSE_REQ_S(MOUSE_WHEEL_DOWN))
 
     def release_mouse_buttons(self):
         if not self.__run:
             return {'result': 'error', 'detail': 'Kvm instance not started'}
 
-        return self.__send(SEND_MOUSE_REQ_S(MOUSE_CLEAR))
+        return self.__send_ack(TYPE_SEND_MOUSE_RES, ('release_mouse_buttons',), SEND_MOUSE_REQ_S(MOUSE_CLEAR))
 
     def send_atx(self, sig):
         if not self.__run:
             return {'result': 'error', 'detail': 'Kvm instance not started'}
 
         ## Arguments Validity Check
-        if sig in ATX_SIGNAL:
-            sig = ATX_SIGNAL[sig]
-        elif sig not in ATX_SIGNAL.values():
-            raise TypeError('Argument sig should be "short power", "reset", "long power", 0xFD, 0xFE or 0xFF')
+        sig = _atx_sig(sig)
 
-        return self.__send(SEND_ATX_REQ(sig))
+        return self.__send_ack(TYPE_SEND_ATX_RES, ('send_atx', sig), SEND_ATX_REQ(sig))
 
     def read_last_send_key_result(self):
         if not self.__run:
@@ -851,5 +1030,77 @@ class Kvm:
             self.__resolv_msg[TYPE_SEND_ATX_RES] = None
         return res
 
+    def read_acks(self, timeout=0):
+        """ Return the list of acks not read yet in the order received, each ack is a result dict with
+                'seq': sequence number returned by the command, None if no command is waiting for the ack
+                'request': descriptor of the command, e.g. ('send_key', 1, 0x04) or ('send_atx', 0xFE)
+            wait up to timeout second(s) if no ack yet, timeout=None waits until an ack received or Kvm ended
+            acks overflowing ACK_RING_SIZE before read are dropped and counted in self.acks_dropped
+        """
+        with self.__ack_cond:
+            if not self.__acks and timeout != 0:
+                self.__ack_cond.wait_for(lambda: self.__acks or not self.__run, timeout)
+            acks = list(self.__acks)
+            self.__acks.clear()
+        return acks
+
+    def iter_acks(self, timeout=None):
+        """ Yield acks as they received, stop when Kvm ended or no ack received in timeout second(s)
+        """
+        while True:
+            acks = self.read_acks(timeout)
+            if not acks:
+                return
+            yield from acks
+
+    def rtt_stats(self):
+        """ Statistics of heartbeat round-trip time over the latest RTT_WINDOW replies, in second(s)
+            return {
+                'last', 'min', 'avg', 'max': <float>, None if no reply yet
+                'histogram': [(upper bound in millisecond(s), count),], the last bound is inf
+                'replies': <int>, total replies in session
+                'missed': <int>, asking not replied yet
+                'lost': <bool>, True if disconnected as heartbeat lost
+            }
+        """
+        with self.__rtt_lock:
+            rtts = list(self.__rtts)
+            stats = {'replies': self.__replies, 'missed': len(self.__pings), 'lost': self.__lost}
+        bounds = (*RTT_BUCKETS, float('inf'))
+        histogram = [0 for bound in bounds]
+        for rtt in rtts:
+            histogram[next(i for i, bound in enumerate(bounds) if rtt*1000 <= bound)] += 1
+        stats.update({
+            'last': rtts[-1] if rtts else None,
+            'min': min(rtts) if rtts else None,
+            'avg': sum(rtts)/len(rtts) if rtts else None,
+            'max': max(rtts) if rtts else None,
+            'histogram': list(zip(bounds, histogram)),
+        })
+        return stats
+
+    def set_ack_callback(self, callback):
+        """ callback: <callable> or None
+                    called with every ack as soon as it received, see read_acks() for the ack
+                    invoked in receiving thread, it should return quickly
+        """
+        self.__ack_callback = callback
+
+    def set_reconnect_callback(self, callback):
+        """ callback: <callable> or None
+                    called with {'event': <str>, 'attempt': <int>, 'detail': ...} as reconnecting progresses
+                    'lost': connection lost, detail is the reason
+                    'retry': the attempt failed, detail is the reason
+                    'connected': handshaked again in the attempt
+                    'restored': serial device and mjpg-streamer restored, detail is {'uart': result, 'mjpg': result},
+                                attempt is the number of successful reconnecting
+                    'failed': all tries failed, the session ends
+                    invoked in receiving or writer thread, it should return quickly
+        """
+        self.__reconnect_callback = callback
+
     def is_run(self):
         return self.__run
+
+    def is_reconnecting(self): # True from connection lost until serial device and mjpg-streamer restored
+        return self.__reconnecting
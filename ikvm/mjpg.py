@@ -6,10 +6,158 @@ import urllib.error
 
 TIMEOUT = 0.4 # second(s), used in open()
 MAX_READABLE = 1048576 # Read data 1MiB timeout
+MAX_FRAME = 16777216 # 16MiB, give up a jpeg without Content-Length exceeding this size
+CHUNK = 65536 # bytes read from stream at once while looking for part boundary and headers
+BOUNDARY = b'--boundarydonotcross' # mjpg-streamer default, used when server sends no boundary
+SOI, EOI = b'\xff\xd8', b'\xff\xd9' # jpeg start/end of image markers
+
+class MjpgParser:
+    """ Incremental parser of multipart/x-mixed-replace stream
+
+        feed() the received bytes, then call next_part() until it returns None (more data needed)
+        next_part() returns the same result dicts as MjpgClient.next_frame()
+    """
+    def __init__(self, boundary=BOUNDARY):
+        self.__buf = bytearray() # received data not parsed yet, consumed data deleted from the front
+        self.__delim = boundary
+        self.__scan = 0 # position where boundary searching continues
+        self.__length = None # length of the body when part headers have been parsed, -1 if no Content-Length
+        self.__marker = 0 # position where jpeg marker walking continues when no Content-Length
+        self.__entropy = False # marker walking reached entropy-coded data, scan EOI directly
+
+    def feed(self, data):
+        self.__buf += data
+
+    def missing(self):
+        """ Number of bytes still missing for the current body, 0 if unknown
+        """
+        if self.__length in (None, -1):
+            return 0
+        return max(self.__length-len(self.__buf), 0)
+
+    def __parse_headers(self, block):
+        headers = {}
+        for line in block.decode('latin-1').split('\r\n')[1:]: # first line is the rest of boundary line
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return headers
+
+    def __find_eoi(self):
+        """ Walk jpeg markers at buffer head, return the length of jpeg or -1 if more data needed
+
+            segments before SOS are skipped by their length, so EOI of an embedded thumbnail is not taken
+            as the end, then entropy-coded data are scanned for EOI (0xFF in the data is always stuffed)
+        """
+        buf = self.__buf
+        if len(buf) > MAX_FRAME:
+            del buf[:]
+            raise ValueError('Received jpeg exceeds %d bytes' %MAX_FRAME)
+        pos = self.__marker
+        if pos == 0:
+            ## Skip to SOI
+            loc = buf.find(SOI)
+            if loc == -1:
+                del buf[:-1]
+                return -1
+            del buf[:loc]
+            pos = 2
+        while not self.__entropy:
+            if len(buf) < pos+2:
+                self.__marker = pos
+                return -1
+            if buf[pos] != 0xFF:
+                raise ValueError('Received non-Jpeg file')
+            marker = buf[pos+1]
+            if marker == 0xFF: # fill byte
+                pos += 1
+            elif marker == EOI[1]:
+                return pos+2
+            elif marker == 0x01 or 0xD0 <= marker <= 0xD7: # standalone markers
+                pos += 2
+            elif len(buf) < pos+4:
+                self.__marker = pos
+                return -1
+            else:
+                pos += 2+(buf[pos+2]<<8|buf[pos+3])
+                self.__entropy = marker == 0xDA # SOS
+        loc = buf.find(EOI, pos)
+        if loc == -1:
+            self.__marker = max(len(buf)-1, pos)
+            return -1
+        return loc+2
+
+    def next_part(self):
+        buf = self.__buf
+        if self.__length is None:
+            ## Skip to part header
+            loc = buf.find(self.__delim, self.__scan)
+            if loc == -1:
+                if len(buf) > MAX_READABLE:
+                    del buf[:]
+                    self.__scan = 0
+                    raise TimeoutError('MjpgParser boundary Timeout')
+                self.__scan = max(len(buf)-len(self.__delim)+1, 0)
+                return None
+            end = buf.find(b'\r\n\r\n', loc)
+            if end == -1:
+                self.__scan = loc
+                if len(buf)-loc > MAX_READABLE:
+                    del buf[:]
+                    self.__scan = 0
+                    raise TimeoutError('MjpgParser header Timeout')
+                return None
+            ## Read Content-Type and Content-Length
+            headers = self.__parse_headers(buf[loc+len(self.__delim):end])
+            del buf[:end+4]
+            self.__scan = 0
+            cnt_type = headers.get('content-type', '').split(';')[0].strip().lower()
+            if cnt_type != 'image/jpeg':
+                return {'result': 'error', 'detail': 'Protocol Error: Content-Type is not image/jpeg'}
+            if 'content-length' not in headers:
+                ## Delimit the body by jpeg markers
+                self.__length = -1
+                self.__marker = 0
+                self.__entropy = False
+            else:
+                try:
+                    self.__length = int(headers['content-length'])
+                except ValueError:
+                    return {'result': 'error', 'detail': 'Protocol Error: Content-Length invalid'}
+
+        ## Get Jpeg Body
+        if self.__length == -1:
+            try:
+                length = self.__find_eoi()
+            except ValueError as e:
+                self.__length = None
+                return {'result': 'error', 'detail': 'Format Error: %s' %e}
+            if length == -1:
+                return None
+        else:
+            length = self.__length
+            if len(buf) < length:
+                return None
+        self.__length = None
+        with memoryview(buf) as view:
+            body = bytes(view[:length])
+        del buf[:length]
+        if body[:2] != SOI or body[-2:] != EOI:
+            return {'result': 'error', 'detail': 'Format Error: Received non-Jpeg file'}
+        return {'result': 'success', 'detail': body}
 
 class MjpgClient:
     def __init__(self):
         self.__streamer = None
+        self.__parser = MjpgParser()
+
+    def __boundary(self):
+        ## Take boundary from "Content-Type: multipart/x-mixed-replace; boundary=..." response header
+        boundary = self.__streamer.headers.get_param('boundary')
+        if not isinstance(boundary, str) or not boundary:
+            return BOUNDARY
+        boundary = boundary.encode('latin-1')
+        return boundary if boundary.startswith(b'--') else b'--'+boundary
 
     def open(self, url, timeout=TIMEOUT):
         self.url = url
@@ -24,136 +172,26 @@ class MjpgClient:
         except TimeoutError:
             return {'result': 'error', 'detail': 'TimeoutError'}
         else:
+            self.__parser = MjpgParser(self.__boundary())
             return {'result': 'success'}
 
     def close(self):
         if self.__streamer and not self.__streamer.closed:
             self.__streamer.close()
 
-    def __check_boundarydonotcross(self):
-        counter = 0
-        reg = b''
-        while True:
-            res = self.__streamer.read(1)
-            if res == b'':
-                return
-            elif counter > MAX_READABLE:
-                raise TimeoutError('MjpgClient __check_boundarydonotcross Timeout')
-            elif res == b'-' and reg == b'':
-                reg += res
-            elif res == b'-' and reg == b'-':
-                reg += res
-            elif res == b'b' and reg == b'--':
-                reg += res + self.__streamer.read(17)
-            elif res == b'\r' and reg == b'--boundarydonotcross':
-                return
-            else:
-                reg = b''
-                counter += 1
-
-    def __read_content_type(self):
-        counter = 0
-        reg = b''
-        content_type = b''
-        while True:
-            res = self.__streamer.read(1)
-            if res == b'':
-                return res
-            elif counter > MAX_READABLE:
-                raise TimeoutError('MjpgClient __read_content_type Timeout')
-            elif res == b'C' and reg == b'':
-                reg += res
-            elif res == b'o' and reg == b'C':
-                reg += res
-            elif res == b'n' and reg == b'Co':
-                reg += res + self.__streamer.read(11)
-            elif res == b'\r' and reg == b'Content-Type: ':
-                try:
-                    return content_type.decode('utf-8')
-                except UnicodeDecodeError:
-                    return None
-            elif reg == b'Content-Type: ':
-                content_type += res
-            else:
-                reg = b''
-                counter += 1
-
-    def __read_content_length(self):
-        counter = 0
-        reg = b''
-        content_length = b''
-        while True:
-            res = self.__streamer.read(1)
-            if res == b'':
-                return res
-            elif counter > MAX_READABLE:
-                raise TimeoutError('MjpgClient __read_content_length Timeout')
-            elif res == b'C' and reg == b'':
-                reg += res
-            elif res == b'o' and reg == b'C':
-                reg += res
-            elif res == b'n' and reg == b'Co':
-                reg += res + self.__streamer.read(13)
-            elif res == b'\r' and reg == b'Content-Length: ':
-                try:
-                    return int(content_length)
-                except ValueError:
-                    return None
-            elif reg == b'Content-Length: ':
-                content_length += res
-            else:
-                reg = b''
-                counter += 1
-
-    def __skip_header(self):
-        counter = 0
-        reg = b''
-        while True:
-            res = self.__streamer.read(1)
-            if res == b'':
-                return res
-            elif counter > MAX_READABLE:
-                raise TimeoutError('MjpgClient __skip_header Timeout.')
-            elif res == b'\r' and reg == b'':
-                reg += res
-            elif res == b'\n' and reg == b'\r':
-                reg += res
-            elif res == b'\r' and reg == b'\r\n':
-                reg += res
-            elif res == b'\n' and reg == b'\r\n\r':
-                return
-            else:
-                reg = b''
-                counter += 1
-
     def next_frame(self):
         if self.__streamer is None or self.__streamer.closed:
             return {'result': 'error', 'detail': 'URL not opened'}
-        ## Skip to HTTP Header
         try:
-            self.__check_boundarydonotcross()
-            ## Read Content-Type
-            cnt_type = self.__read_content_type()
-            if cnt_type == b'':
-                return {'result': 'lost'}
-            elif cnt_type != 'image/jpeg':
-                return {'result': 'error', 'detail': 'Protocol Error: Content-Type is not image/jpeg'}
-            ## Read Content-Length
-            cnt_len = self.__read_content_length()
-            if cnt_len is None:
-                return {'result': 'error', 'detail': 'Protocol Error: Content-Length invalid'}
-            elif cnt_len == b'':
-                return {'result': 'lost'}
-            ## Skip to HTTP Body
-            self.__skip_header()
-            ## Get Jpeg Body
-            body = self.__streamer.read(cnt_len)
+            while True:
+                part = self.__parser.next_part()
+                if part is not None:
+                    return part
+                ## Read the rest of body at once if its length is known, else read what arrived
+                missing = self.__parser.missing()
+                res = self.__streamer.read(missing) if missing else self.__streamer.read1(CHUNK)
+                if res == b'':
+                    return {'result': 'lost'}
+                self.__parser.feed(res)
         except socket_timeout:
             raise TimeoutError('MjpgClient Read Timeout.')
-        else:
-            if body == b'':
-                return {'result': 'lost'}
-            elif body[:2] != b'\xff\xd8' or body[-2:] != b'\xff\xd9':
-                return {'result': 'error', 'detail': 'Format Error: Received non-Jpeg file'}
-            else:
-                return {'result': 'success', 'detail': body}
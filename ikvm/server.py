@@ -0,0 +1,416 @@
+# coding: utf-8
+if __name__ != 'ikvm.server':
+    exit()
+from ._globals import *
+from ._protocol import *
+from ._protocol import _CODECS, _Incomplete
+import socket, selectors, threading, struct, heapq
+from time import perf_counter
+
+UARTS = [('/dev/ttyUSB0', 0x1231, 0x1F66),] # default serial devices of MockKvmServer
+CAPS = [('/dev/video0', [((1920, 1080), [30, 15,]), ((1280, 720), [60, 30,]), ((640, 480), [30,]),]),] # default captures
+FAULTS = ('failure', 'ignore', 'close', 'reset') # modes of failure injection, see MockKvmServer.inject()
+
+_BB = struct.Struct('!BB') # 1B flag, 1B key/button
+_BH = struct.Struct('!BH') # 1B flag, 2B length
+_Bbb = struct.Struct('!Bbb') # 1B flag, 1B x-move, 1B y-move
+_HEAD_SIZE = len(MAGIC)+1
+
+def _decode_key(view, pos, end): # (flag, key), (KEY_TEXT_SEND, text) or (flag,)
+    if pos >= end:
+        raise _Incomplete
+    flag = view[pos]
+    if flag == KEY_TEXT_SEND:
+        if pos+_BH.size > end:
+            raise _Incomplete
+        _, length = _BH.unpack_from(view, pos)
+        start, pos = pos+_BH.size, pos+_BH.size+length
+        if pos > end:
+            raise _Incomplete
+        return (flag, str(view[start:pos], 'latin-1')), pos
+    elif flag in (KEY_PRESS, KEY_RELEASE):
+        if pos+_BB.size > end:
+            raise _Incomplete
+        return _BB.unpack_from(view, pos), pos+_BB.size
+    return (flag,), pos+1
+
+def _decode_mouse(view, pos, end): # (MOUSE_MOVE, x, y), (flag, button) or (flag,)
+    if pos >= end:
+        raise _Incomplete
+    flag = view[pos]
+    if flag == MOUSE_MOVE:
+        if pos+_Bbb.size > end:
+            raise _Incomplete
+        return _Bbb.unpack_from(view, pos), pos+_Bbb.size
+    elif flag in (MOUSE_PRESS, MOUSE_RELEASE):
+        if pos+_BB.size > end:
+            raise _Incomplete
+        return _BB.unpack_from(view, pos), pos+_BB.size
+    return (flag,), pos+1
+
+def _decode_atx(view, pos, end): # sig
+    if pos >= end:
+        raise _Incomplete
+    return view[pos], pos+1
+
+def _decode_none(view, pos, end):
+    return None, pos
+
+_REQUESTS = { # decoders of messages sent by client, decode(view, pos, end) returns (content, position after content)
+    TYPE_HANDSHAKE: _decode_none,
+    TYPE_GOODBYE: _decode_none,
+    TYPE_ASK_ALIVE: _decode_none,
+    TYPE_REPLY_ALIVE: _decode_none,
+    TYPE_LIST_UART_REQ: _decode_none,
+    TYPE_LIST_CAP_REQ: _decode_none,
+    TYPE_RUN_MJPG_REQ: _CODECS[TYPE_RUN_MJPG_REQ][1],
+    TYPE_OPEN_UART_REQ: _CODECS[TYPE_OPEN_UART_REQ][1],
+    TYPE_SEND_KEY_REQ: _decode_key,
+    TYPE_SEND_MOUSE_REQ: _decode_mouse,
+    TYPE_SEND_ATX_REQ: _decode_atx,}
+
+def decode_requests(buf):
+    """ Parse messages sent by client from the front of bytearray buf, parsed bytes deleted from buf
+        return the list of (type, content), an incomplete message is kept in buf until the rest received
+        content is None for messages without content, see _REQUESTS for others, e.g. (KEY_PRESS, 0x04)
+    """
+    msgs, pos = [], 0
+    with memoryview(buf) as view:
+        while True:
+            loc = buf.find(MAGIC, pos)
+            if loc == -1:
+                pos = max(pos, len(buf)-len(MAGIC)+1) # keep tail of a partial magic
+                break
+            if loc+_HEAD_SIZE > len(buf):
+                pos = loc
+                break
+            msg_type, pos = buf[loc+3], loc+_HEAD_SIZE
+            decode = _REQUESTS.get(msg_type)
+            if decode is None: # unknown message type
+                continue
+            try:
+                content, pos = decode(view, pos, len(buf))
+            except _Incomplete:
+                pos = loc
+                break
+            except ProtocolError as e: # recorded as is, answered as failure
+                content = e
+            msgs.append((msg_type, content))
+    del buf[:pos]
+    return msgs
+
+class _Client:
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.inbox = bytearray() # received bytes not parsed yet
+        self.outbox = bytearray() # responses not sent yet
+        self.due = 0 # perf_counter() time of the last scheduled response, responses sent in order
+        self.writing = False # registered for writable as responses remain
+        self.rejected = False # connected over max_clients, closed without handshake
+        self.closed = False
+
+class MockKvmServer:
+    """ Loopback iKVM server speaking the protocol of _protocol, for tests and benchmarks without hardware
+
+        all clients are served by a single thread with a selector, every input message is recorded,
+        responses can be delayed and failures injected, e.g.
+            server = MockKvmServer(delay=0.005)
+            server.start()
+            kvm = Kvm('127.0.0.1', server.port, 8080)
+            server.inject(TYPE_SEND_ATX_REQ, 'failure')
+    """
+    def __init__(self, ip='127.0.0.1', port=0, uarts=UARTS, caps=CAPS, delay=0, max_clients=1,
+            on_mjpg=None, record=True):
+        """ ip, port: optional, <str> and <int>, default '127.0.0.1' and 0
+                listening address, port 0 picks a free port found in self.port after started
+
+            uarts: optional, <list>, default UARTS
+                serial devices listed by server, e.g. [('/dev/ttyUSB0', 0x0483, 0xdf11),]
+
+            caps: optional, <list>, default CAPS
+                video captures listed by server, e.g. [('/dev/video0', [((1920, 1080), [30, 15,]),]),]
+
+            delay: optional, <int>/<float>/<dict>, default 0
+                second(s) before a response is sent, or {message type: second(s)} for each request type,
+                responses to a client are still sent in the order of requests
+
+            max_clients: optional, <int>, default 1
+                clients served at the same time, a client connecting more is closed without handshake
+
+            on_mjpg: optional, <callable>, default None
+                called as on_mjpg(cap, resolution, fps, port) in server thread when mjpg-streamer started
+
+            record: optional, <bool>, default True
+                record every input message, see messages()
+        """
+        self.ip = ip
+        self.port = port
+        self.uarts = uarts
+        self.caps = caps
+        self.delay = delay
+        self.max_clients = max_clients
+        self.on_mjpg = on_mjpg
+        self.record = record
+        self.uart = None # serial device opened
+        self.mjpg = None # (cap, (width, height), fps, port) of mjpg-streamer started
+        self.__lock = threading.Lock()
+        self.__received = [] # (perf_counter() time, message type, content) of input messages
+        self.__faults = {} # message type: [mode, remaining times or None, detail]
+        self.__clients = {} # socket: _Client
+        self.__run = False
+
+    def start(self):
+        family = socket.AF_INET6 if address_family(self.ip) == 'ipv6' else socket.AF_INET
+        self.__listener = socket.socket(family, socket.SOCK_STREAM)
+        self.__listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self.__listener.bind((self.ip, self.port))
+        except OSError as e:
+            self.__listener.close()
+            return {'result': 'error', 'detail': str(e)}
+        self.__listener.listen()
+        self.__listener.setblocking(False)
+        self.port = self.__listener.getsockname()[1]
+
+        self.__waker_r, self.__waker_w = socket.socketpair()
+        self.__waker_r.setblocking(False)
+        self.__selector = selectors.DefaultSelector()
+        self.__selector.register(self.__listener, selectors.EVENT_READ)
+        self.__selector.register(self.__waker_r, selectors.EVENT_READ)
+        self.__schedule = [] # heap of (due time, order, client, response bytes or fault mode)
+        self.__order = 0
+        self.__run = True
+        self.__thread = threading.Thread(target=self.__serve, daemon=True)
+        self.__thread.start()
+        return {'result': 'success'}
+
+    def end(self):
+        if not self.__run:
+            return {'result': 'success'}
+        self.__run = False
+        self.__wakeup()
+        self.__thread.join()
+        for client in list(self.__clients.values()):
+            self.__close(client)
+        self.__selector.close()
+        self.__listener.close()
+        self.__waker_r.close()
+        self.__waker_w.close()
+        return {'result': 'success'}
+
+    def inject(self, msg_type, mode='failure', times=1, detail='Injected failure'):
+        """ Answer the next times requests of msg_type (every request if times is None) in mode
+                'failure': respond with STATUS_FAILURE and detail, an empty list for listing requests
+                'ignore': no response
+                'close': close the connection without response
+                'reset': reset the connection by RST without response
+            a fault on TYPE_HANDSHAKE fails connecting, on TYPE_ASK_ALIVE tests heartbeat loss
+        """
+        assert mode in FAULTS
+        assert times is None or (isinstance(times, int) and times > 0)
+        with self.__lock:
+            self.__faults[msg_type] = [mode, times, detail]
+
+    def clear_faults(self):
+        with self.__lock:
+            self.__faults.clear()
+
+    def messages(self, msg_type=None):
+        """ Return recorded input messages (time, type, content) in the order received, only msg_type if not None
+            time is perf_counter() when received, see decode_requests() for content
+        """
+        with self.__lock:
+            return [msg for msg in self.__received if msg_type is None or msg[1] == msg_type]
+
+    def clear(self): # forget recorded input messages
+        with self.__lock:
+            self.__received.clear()
+
+    def clients(self): # number of clients served
+        return len([client for client in self.__clients.values() if not client.rejected])
+
+    def is_run(self):
+        return self.__run
+
+    def __wakeup(self):
+        try:
+            self.__waker_w.send(b'\0')
+        except OSError: # waker full, the thread is woken up anyway
+            pass
+
+    def __serve(self):
+        while self.__run:
+            timeout = max(self.__schedule[0][0]-perf_counter(), 0) if self.__schedule else None
+            for key, events in self.__selector.select(timeout):
+                if key.fileobj is self.__listener:
+                    self.__accept()
+                elif key.fileobj is self.__waker_r:
+                    try:
+                        self.__waker_r.recv(BUF)
+                    except OSError:
+                        pass
+                elif events & selectors.EVENT_READ:
+                    self.__receive(key.data)
+                if events & selectors.EVENT_WRITE and key.data is not None:
+                    self.__flush(key.data)
+            ## Send responses whose time reached
+            now = perf_counter()
+            while self.__schedule and self.__schedule[0][0] <= now:
+                _, _, client, out = heapq.heappop(self.__schedule)
+                if client.closed:
+                    continue
+                if out in ('close', 'reset'):
+                    self.__close(client, reset=out == 'reset')
+                    continue
+                client.outbox += out
+                self.__flush(client)
+
+    def __accept(self):
+        try:
+            sock, addr = self.__listener.accept()
+        except OSError:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(sock, addr)
+        client.rejected = sum([not c.rejected for c in self.__clients.values()]) >= self.max_clients
+        self.__clients[sock] = client
+        self.__selector.register(sock, selectors.EVENT_READ, client)
+
+    def __close(self, client, reset=False):
+        if client.closed:
+            return
+        client.closed = True
+        self.__selector.unregister(client.sock)
+        del self.__clients[client.sock]
+        if reset:
+            client.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        client.sock.close()
+
+    def __flush(self, client):
+        if client.closed:
+            return
+        try:
+            if client.outbox:
+                size = client.sock.send(client.outbox)
+                del client.outbox[:size]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.__close(client)
+            return
+        # wait for writable only while responses remain
+        if client.writing != bool(client.outbox):
+            client.writing = bool(client.outbox)
+            self.__selector.modify(client.sock,
+                    selectors.EVENT_READ|(selectors.EVENT_WRITE if client.writing else 0), client)
+
+    def __receive(self, client):
+        try:
+            data = client.sock.recv(0x10000)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data: # client disconnected
+            self.__close(client)
+            return
+        if client.rejected: # exist client connected, closed once the client says something
+            self.__close(client)
+            return
+        client.inbox += data
+        now = perf_counter()
+        for msg_type, content in decode_requests(client.inbox):
+            if self.record:
+                with self.__lock:
+                    self.__received.append((now, msg_type, content))
+            if msg_type == TYPE_GOODBYE:
+                self.__close(client)
+                return
+            out, detail = self.__fault(msg_type)
+            if out in (None, 'failure'):
+                out = self.__respond(msg_type, content, detail)
+            if out in (None, 'ignore'):
+                continue
+            ## Schedule response after delay, never earlier than responses before
+            delay = self.delay.get(msg_type, 0) if isinstance(self.delay, dict) else self.delay
+            client.due = max(now+delay, client.due)
+            self.__order += 1
+            heapq.heappush(self.__schedule, (client.due, self.__order, client, out))
+
+    def __fault(self, msg_type): # (mode, detail) of injected fault for the request, (None, None) if not injected
+        with self.__lock:
+            fault = self.__faults.get(msg_type)
+            if fault is None:
+                return None, None
+            mode, times, detail = fault
+            if times is not None:
+                if times <= 1:
+                    del self.__faults[msg_type]
+                else:
+                    fault[1] -= 1
+        return mode, detail
+
+    def __respond(self, msg_type, content, failed=None):
+        """ Return the response bytes of request msg_type with content, None if no response
+            failed is the detail of injected failure, None if not injected
+        """
+        if msg_type == TYPE_HANDSHAKE:
+            return HANDSHAKE_MSG
+        elif msg_type == TYPE_ASK_ALIVE:
+            return REPLY_ALIVE_MSG
+        elif msg_type == TYPE_LIST_UART_REQ:
+            return LIST_UART_RES([] if failed is not None else self.uarts)
+        elif msg_type == TYPE_LIST_CAP_REQ:
+            return LIST_CAP_RES([] if failed is not None else self.caps)
+        res_type = msg_type|0x80
+        if res_type not in (TYPE_RUN_MJPG_RES, TYPE_OPEN_UART_RES, TYPE_SEND_KEY_RES, TYPE_SEND_MOUSE_RES,
+                TYPE_SEND_ATX_RES,):
+            return None
+        if failed is not None:
+            return STATUS_CODE_RES(res_type, STATUS_FAILURE, failed)
+        if isinstance(content, ProtocolError):
+            return STATUS_CODE_RES(res_type, STATUS_FAILURE, str(content))
+        detail = MockKvmServer.__CHECKS[msg_type](self, content)
+        if detail is not None:
+            return STATUS_CODE_RES(res_type, STATUS_FAILURE, detail)
+        return STATUS_CODE_RES(res_type, STATUS_SUCCESS, '')
+
+    ## Checks of requests, return failure detail or None if succeeded
+    def __check_mjpg(self, content):
+        cap, resolution, fps, port = content
+        attr = next((attr for name, attr in self.caps if name == cap), None)
+        if attr is None:
+            return 'No such video capture "%s"' %cap
+        fps_list = next((fps_list for res, fps_list in attr if res == resolution), None)
+        if fps_list is None:
+            return 'Resolution {}x{} not supported by "{}"'.format(*resolution, cap)
+        if fps not in fps_list:
+            return 'Frame rate %d not supported in %dx%d' %(fps, *resolution)
+        self.mjpg = content
+        if self.on_mjpg:
+            self.on_mjpg(*content)
+
+    def __check_uart(self, port):
+        uart = next((name for name, vid, pid in self.uarts if port in name), None)
+        if uart is None:
+            return 'No such serial device "%s"' %port
+        self.uart = uart
+
+    def __check_input(self, content):
+        if self.uart is None:
+            return 'Serial device not opened'
+
+    def __check_atx(self, sig):
+        if self.uart is None:
+            return 'Serial device not opened'
+        if sig not in ATX_SIGNAL.values():
+            return 'Invalid ATX signal <{:02X}>'.format(sig)
+
+    __CHECKS = {
+        TYPE_RUN_MJPG_REQ: __check_mjpg,
+        TYPE_OPEN_UART_REQ: __check_uart,
+        TYPE_SEND_KEY_REQ: __check_input,
+        TYPE_SEND_MOUSE_REQ: __check_input,
+        TYPE_SEND_ATX_REQ: __check_atx,}
@@ -0,0 +1,268 @@
+# coding: utf-8
+if __name__ != 'ikvm.streamer':
+    exit()
+from .mjpg import BOUNDARY, SOI, MAX_FRAME
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import cv2
+import numpy as np
+import os, struct, threading
+from time import time, perf_counter, sleep
+
+_COM = b'\xFF\xFE' # jpeg comment marker, used for padding
+
+def pad_jpeg(jpeg, size):
+    """ Return jpeg enlarged to size bytes by comment segments after SOI, still decodable
+    """
+    pads, pos = [], len(jpeg)+4 # at least one segment
+    while pos < size:
+        n = min(size-pos, 0xFFFF-2)
+        pads.append(_COM+struct.pack('!H', n+2)+bytes(n))
+        pos += n+4 # the next segment header counted ahead
+    if not pads:
+        pads.append(_COM+struct.pack('!H', 2))
+    return SOI+b''.join(pads)+jpeg[len(SOI):]
+
+class PatternSource:
+    """ Generated test pattern, color bars with a moving box and the frame number
+
+        source(n) returns the nth frame as jpeg bytes, the same n returns identical bytes
+    """
+    def __init__(self, resolution=(1280, 720), quality=80, box=0.1, static=False):
+        """ resolution: optional, <tuple> with 2 <int>, default (1280, 720)
+
+            quality: optional, <int>, default 80
+                jpeg quality between 1 and 100
+
+            box: optional, <float>, default 0.1
+                side length of the moving box relative to the frame height, 0 leaves only the frame number changing
+
+            static: optional, <bool>, default False
+                every frame is the first one, e.g. a console with nothing happened
+        """
+        assert isinstance(resolution, tuple) and len(resolution) == 2
+        assert quality in range(1, 101)
+        self.resolution = resolution
+        self.quality = quality
+        self.box = box
+        self.static = static
+        w, h = resolution
+        ## Bars of 8 colors in BGR, drawn once
+        colors = [(255, 255, 255), (0, 255, 255), (255, 255, 0), (0, 255, 0),
+                (255, 0, 255), (0, 0, 255), (255, 0, 0), (0, 0, 0)]
+        self.__bars = np.empty((h, w, 3), np.uint8)
+        for i, color in enumerate(colors):
+            self.__bars[:, i*w//len(colors):(i+1)*w//len(colors)] = color
+
+    def __call__(self, n):
+        n = 0 if self.static else n
+        w, h = self.resolution
+        frame = self.__bars.copy()
+        side = int(h*self.box)
+        if side:
+            span = max(w-side, 1)
+            x = n*8%(span*2)
+            x = x if x < span else span*2-x # bounce between left and right
+            y = (h-side)//2
+            frame[y:y+side, x:x+side] = (40, 40, 40)
+        cv2.putText(frame, '%06d' %n, (16, h-16), cv2.FONT_HERSHEY_SIMPLEX, max(h/720, 0.4), (128, 128, 128), 2)
+        return cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])[1].tobytes()
+
+class DirectorySource:
+    """ JPEG files in a directory replayed in the order of file names, from the first one again after the last
+    """
+    def __init__(self, path):
+        names = sorted(name for name in os.listdir(path) if name.lower().endswith(('.jpg', '.jpeg')))
+        if not names:
+            raise FileNotFoundError(f'No jpeg in "{path}"')
+        self.__frames = []
+        for name in names:
+            with open(os.path.join(path, name), 'rb') as f:
+                self.__frames.append(f.read())
+
+    def __call__(self, n):
+        return self.__frames[n%len(self.__frames)]
+
+class FakeMjpgStreamer:
+    """ Local HTTP server emitting multipart/x-mixed-replace streams as mjpg-streamer does
+
+        GET /?action=stream streams frames, GET /?action=snapshot returns the current frame,
+        each client is served by its own thread and sees the same frame numbers at the same time, e.g.
+            streamer = FakeMjpgStreamer(PatternSource((1920, 1080)), fps=30, rate=2_000_000)
+            streamer.start()
+            mjpg.open(f'http://127.0.0.1:{streamer.port}/?action=stream')
+    """
+    def __init__(self, source, ip='127.0.0.1', port=0, fps=30, boundary=BOUNDARY, content_length=True,
+            rate=0, burst=1, oversize_every=0, oversize_bytes=MAX_FRAME+1, disconnect_after=0):
+        """ source: required, <callable>
+                source(n) returns the nth frame as jpeg bytes, e.g. PatternSource or DirectorySource
+
+            ip, port: optional, <str> and <int>, default '127.0.0.1' and 0
+                listening address, port 0 picks a free port found in self.port after started
+
+            fps: optional, <int>/<float>, default 30
+                frames per second, 0 sends frames as fast as the client reads
+
+            boundary: optional, <bytes>, default BOUNDARY
+                part delimiter starting with '--', announced in Content-Type without '--'
+
+            content_length: optional, <bool>, default True
+                send Content-Length header of every part, the client finds the jpeg end by markers if False
+
+            rate: optional, <int>, default 0
+                bytes per second of each client as a slow link, 0 is unlimited
+
+            burst: optional, <int>, default 1
+                frames sent back to back every burst/fps second(s), e.g. a stalled link catching up
+
+            oversize_every: optional, <int>, default 0
+                every nth frame is padded to oversize_bytes, 0 disables
+
+            oversize_bytes: optional, <int>, default MAX_FRAME+1
+                size of oversized frames, more than MjpgClient accepts without Content-Length by default
+
+            disconnect_after: optional, <int>, default 0
+                close the connection in the middle of the nth frame, 0 never disconnects
+        """
+        assert fps >= 0
+        assert isinstance(burst, int) and burst > 0
+        assert boundary.startswith(b'--')
+        self.source = source
+        self.ip = ip
+        self.port = port
+        self.fps = fps
+        self.boundary = boundary
+        self.content_length = content_length
+        self.rate = rate
+        self.burst = burst
+        self.oversize_every = oversize_every
+        self.oversize_bytes = oversize_bytes
+        self.disconnect_after = disconnect_after
+        self.frames_sent = 0 # frames sent to all clients
+        self.bytes_sent = 0 # bytes of frames sent to all clients
+        self.__lock = threading.Lock()
+        self.__cache = (None, None) # (n, jpeg) generated last, shared by clients
+        self.__server = None
+
+    def start(self):
+        Handler = type('Handler', (_StreamHandler,), {'streamer': self}) # handler class bound to this streamer
+        try:
+            self.__server = ThreadingHTTPServer((self.ip, self.port), Handler)
+        except OSError as e:
+            return {'result': 'error', 'detail': str(e)}
+        self.__server.daemon_threads = True
+        self.port = self.__server.server_address[1]
+        self.__epoch = perf_counter() # time of frame 0
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+        return {'result': 'success'}
+
+    def end(self):
+        if self.__server is None:
+            return {'result': 'success'}
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__server = None
+        return {'result': 'success'}
+
+    def url(self, action='stream'):
+        return f'http://{self.ip}:{self.port}/?action={action}'
+
+    def current(self): # number of the frame shown now
+        return int((perf_counter()-self.__epoch)*self.fps) if self.fps else 0
+
+    def until(self, n): # second(s) until the nth frame shown
+        return self.__epoch+n/self.fps-perf_counter()
+
+    def frame(self, n):
+        """ Return the nth frame, padded if oversized, generated once for all clients
+        """
+        with self.__lock:
+            if self.__cache[0] == n:
+                return self.__cache[1]
+            jpeg = self.source(n)
+            if self.oversize_every and (n+1)%self.oversize_every == 0:
+                jpeg = pad_jpeg(jpeg, self.oversize_bytes)
+            self.__cache = (n, jpeg)
+            return jpeg
+
+    def part(self, jpeg):
+        """ Return the head and tail bytes of a part carrying jpeg
+        """
+        now = time()
+        head = [self.boundary, b'Content-Type: image/jpeg']
+        if self.content_length:
+            head.append(b'Content-Length: %d' %len(jpeg))
+        head.append(b'X-Timestamp: %d.%06d' %(int(now), int(now%1*1e6)))
+        return b'\r\n'.join(head)+b'\r\n\r\n', b'\r\n'
+
+    def sent(self, size):
+        with self.__lock:
+            self.frames_sent += 1
+            self.bytes_sent += size
+
+    def write(self, wfile, data):
+        """ Write data, throttled to self.rate bytes per second if limited
+        """
+        if not self.rate:
+            wfile.write(data)
+            return
+        chunk = max(int(self.rate/100), 1) # about 10 ms per chunk
+        with memoryview(data) as view:
+            for pos in range(0, len(data), chunk):
+                begin = perf_counter()
+                wfile.write(view[pos:pos+chunk])
+                wfile.flush()
+                remain = len(view[pos:pos+chunk])/self.rate-(perf_counter()-begin)
+                if remain > 0:
+                    sleep(remain)
+
+class _StreamHandler(BaseHTTPRequestHandler):
+    streamer = None # FakeMjpgStreamer of the handler class
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, format, *args): # quiet
+        pass
+
+    def do_GET(self):
+        action = parse_qs(urlsplit(self.path).query).get('action', [''])[0]
+        if action == 'stream':
+            self.__stream()
+        elif action == 'snapshot':
+            jpeg = self.streamer.frame(self.streamer.current())
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(jpeg)))
+            self.end_headers()
+            self.wfile.write(jpeg)
+        else:
+            self.send_error(404)
+
+    def __stream(self):
+        streamer = self.streamer
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace;boundary=%s' %streamer.boundary[2:].decode('latin-1'))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        sent, n = 0, streamer.current()
+        try:
+            while True:
+                ## Wait until the last frame of the burst shown, frames skipped if the client reads slower than fps
+                if streamer.fps:
+                    sleep(max(streamer.until(n+streamer.burst-1), 0))
+                    n = max(n, streamer.current()-streamer.burst+1)
+                for i in range(streamer.burst):
+                    jpeg = streamer.frame(n)
+                    head, tail = streamer.part(jpeg)
+                    sent += 1
+                    if sent == streamer.disconnect_after:
+                        streamer.write(self.wfile, head+jpeg[:len(jpeg)//2]) # broken in the middle of jpeg
+                        self.wfile.flush()
+                        self.close_connection = True
+                        return
+                    streamer.write(self.wfile, head+jpeg+tail)
+                    self.wfile.flush()
+                    streamer.sent(len(jpeg))
+                    n += 1
+        except OSError: # client disconnected
+            pass
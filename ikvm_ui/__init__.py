@@ -1,5 +1,6 @@
 # coding: utf-8
 
 from .client import iKvmClient
+from .wall import KvmWall
 
-__all__ = ['iKvmClient',]
+__all__ = ['iKvmClient', 'KvmWall',]
@@ -9,8 +9,21 @@ LOG_LEVEL = ('FATAL', 'ERROR', 'WARN', 'INFO', 'DEBUG', 'TRACE')
 LOG_BUFSIZE = 1
 LOG_SEND_TXT_MAX_SHOW = 50 # the max length of send text can be written into logfile
 RETRY = 3 # Retry whenever start service failed
+FETCH_RETRY_WAIT = 0.05 # second(s), frame fetcher waits before next fetch whenever no frame fetched
+DECODE_WORKERS = 2 # default number of threads decoding and resizing frames
+TILE_SIZE = 32 # pixels, decoded frames are compared by square tiles with this side length
+TILE_DIFF_THRESHOLD = 6 # a tile changed only if any pixel differs more than this value, ignore jpeg noise
+TILE_FULL_RATIO = 0.5 # resize the whole frame instead of tiles if more than this ratio of tiles changed
+TILE_MAX_RECTS = 256 # update the whole capture area instead of changed areas if more areas are pending
+EVENT_WAIT_TIMEOUT = 200 # millisecond(s), main loop wakes up at least once in this period without any event
+WALL_DECODE_PROCESSES = 4 # default number of processes decoding frames of wall tiles
+WALL_REFRESH_MIN = 0.05 # second(s), a tile changing a lot is refreshed at most once in this period
+WALL_REFRESH_MAX = 1 # second(s), a tile changing nothing waits this period before its next frame decoded
+WALL_CHANGE_FULL = 0.25 # ratio of changed TILE_SIZE squares at which a tile is refreshed every WALL_REFRESH_MIN
 
 # Pygame global variables
+FRAME_EVENT     = pygame.USEREVENT+1 # posted whenever a new frame is decoded
+WALL_EVENT      = pygame.USEREVENT+2 # posted whenever a wall tile fetched or decoded a frame
 BG_COLOR        = (40, 40, 40)
 SIDE_W, SIDE_H  = 240, 135
 TXT_COLOR       = (51, 255, 51)
@@ -30,6 +43,7 @@ LOCK_W_SCALE    = 0.5
 LOCK_H_SCALE    = 0.35
 LOCK_TXT_SIZE   = 25
 LOCK_SCALE      = 0.8
+RECONNECT_TXT_SIZE = 28
 INPUT_W_SCALE   = 0.75
 INPUT_H_SCALE   = 0.65
 INPUT_TXT_SIZE  = 16
@@ -37,6 +51,9 @@ INPUT_BG_COLOR  = (63, 63, 63)
 INPUTBOX_PAD    = 7
 INPUTBOX_SCALE  = 0.85
 TAB_SCALE       = 0.066
+WALL_PAD        = 8
+WALL_LABEL_H    = 24
+WALL_TXT_SIZE   = 18
 
 SMALL_BTN_TXT_SCALE  = 0.3
 MIDDLE_BTN_TXT_SCALE = 0.36
@@ -455,6 +472,19 @@ __all__ = [
         'LOG_BUFSIZE',
         'LOG_SEND_TXT_MAX_SHOW',
         'RETRY',
+        'FETCH_RETRY_WAIT',
+        'DECODE_WORKERS',
+        'TILE_SIZE',
+        'TILE_DIFF_THRESHOLD',
+        'TILE_FULL_RATIO',
+        'TILE_MAX_RECTS',
+        'EVENT_WAIT_TIMEOUT',
+        'WALL_DECODE_PROCESSES',
+        'WALL_REFRESH_MIN',
+        'WALL_REFRESH_MAX',
+        'WALL_CHANGE_FULL',
+        'FRAME_EVENT',
+        'WALL_EVENT',
         'BG_COLOR',
         'SIDE_W',
         'SIDE_H',
@@ -475,6 +505,7 @@ __all__ = [
         'LOCK_H_SCALE',
         'LOCK_TXT_SIZE',
         'LOCK_SCALE',
+        'RECONNECT_TXT_SIZE',
         'INPUT_W_SCALE',
         'INPUT_H_SCALE',
         'INPUT_TXT_SIZE',
@@ -482,6 +513,9 @@ __all__ = [
         'INPUTBOX_PAD',
         'INPUTBOX_SCALE',
         'TAB_SCALE',
+        'WALL_PAD',
+        'WALL_LABEL_H',
+        'WALL_TXT_SIZE',
         'SMALL_BTN_TXT_SCALE',
         'MIDDLE_BTN_TXT_SCALE',
         'BIG_BTN_TXT_SCALE',
@@ -3,14 +3,15 @@ if __name__ != 'ikvm_ui.client':
     exit()
 from ikvm import *
 from ._globals import *
+from .frames import LatestFrame, FrameFetcher, DecodePipeline
+from .compositor import Compositor, SideMenuLayer
 import pygame
 import cv2, os, re
 import numpy as np
 from sys import stdout, stderr
-from threading import Thread, Lock
-from time import sleep
+from threading import Lock
 from datetime import datetime
-from math import ceil, copysign
+from math import ceil
 from screeninfo import get_monitors
 if OS == 'WINDOWS':
     import keyboard
@@ -32,6 +33,10 @@ class Popup:
         self.__btn_txt_scale = btn_txt_scale
         self._hover_confirm = False
         self._hover_cancel = False
+        # Cached rendering
+        self.__surface = None # whole popup pre-rendered in its current state
+        self.__drawn = None # state of popup when __surface rendered, None if geometry changed
+        self.__shown = False # __surface is blitted onto screen
 
     def generate_components(self, x, y, w, h, scale):
         solid_h = h-BORDER_THICK*2-POPUP_MARGIN*3 # components occupied height
@@ -49,33 +54,48 @@ class Popup:
         btn_y = y+BORDER_THICK+POPUP_MARGIN*2+content_h
         self._confirm = pygame.Rect(confirm_x, btn_y, btn_w, btn_h)
         self._cancel = pygame.Rect(cancel_x, btn_y, btn_w, btn_h)
+        self.__btn_font = pygame.font.SysFont('serif', int(self._confirm.h*self.__btn_txt_scale))
+        self.__drawn = None
         return content_h
 
-    def render(self):
+    def _local(self, rect): # convert rect on screen into rect on popup surface
+        return rect.move(-self._border.x, -self._border.y)
+
+    def _state(self): # values deciding what popup looks like, popup re-rendered whenever changed
+        return (self._hover_confirm, self._hover_cancel)
+
+    def _draw(self, surface):
         # render the border and background
-        pygame.draw.rect(self._screen, BORDER_COLOR, self._border, BORDER_THICK)
-        pygame.display.update(self._border)
-        pygame.draw.rect(self._screen, BG_COLOR, self._bg)
-        pygame.display.update(self._bg)
+        surface.fill(BG_COLOR)
+        pygame.draw.rect(surface, BORDER_COLOR, self._local(self._border), BORDER_THICK)
         # render the bottons
-        pygame.draw.rect(self._screen, BTN_COLOR_LIGHT if self._hover_confirm else BTN_COLOR_DARK, self._confirm)
-        pygame.display.update(self._confirm)
-        pygame.draw.rect(self._screen, BTN_COLOR_LIGHT if self._hover_cancel else BTN_COLOR_DARK, self._cancel)
-        pygame.display.update(self._cancel)
-
-        txt_size = int(self._confirm.h*self.__btn_txt_scale)
-        font = pygame.font.SysFont('serif', txt_size)
-        text = font.render('Confirm', True, TXT_COLOR)
-        x = self._confirm.x + (self._confirm.w-text.get_size()[0])/2
-        y = self._confirm.y + (self._confirm.h-text.get_size()[1])/2
-        txt_rect = self._screen.blit(text, (x, y))
-        pygame.display.update(txt_rect)
-
-        text = font.render('Cancel', True, TXT_COLOR)
-        x = self._cancel.x + (self._cancel.w-text.get_size()[0])/2
-        y = self._cancel.y + (self._cancel.h-text.get_size()[1])/2
-        txt_rect = self._screen.blit(text, (x, y))
-        pygame.display.update(txt_rect)
+        for rect, hover, txt in (
+                (self._local(self._confirm), self._hover_confirm, 'Confirm'),
+                (self._local(self._cancel), self._hover_cancel, 'Cancel'),):
+            pygame.draw.rect(surface, BTN_COLOR_LIGHT if hover else BTN_COLOR_DARK, rect)
+            text = self.__btn_font.render(txt, True, TXT_COLOR)
+            x = rect.x + (rect.w-text.get_size()[0])/2
+            y = rect.y + (rect.h-text.get_size()[1])/2
+            surface.blit(text, (x, y))
+
+    def render(self, cur, dirty):
+        """ Blit popup onto screen when shown, return the list of blitted areas
+
+            popup is drawn onto a cached surface only when its state changed,
+            the surface is blitted again only if changed or the area under popup is in dirty
+        """
+        if not self.show:
+            self.__shown = False
+            return []
+        state = self._state()
+        if state != self.__drawn:
+            self.__surface = pygame.Surface(self._border.size)
+            self._draw(self.__surface)
+            self.__drawn = state
+        elif self.__shown and self._border.collidelist(dirty) == -1:
+            return []
+        self.__shown = True
+        return [self._screen.blit(self.__surface, self._border)]
 
     def _in_confirm(self, cur):
         x, y, w, h = self._confirm.x, self._confirm.y, self._confirm.w, self._confirm.h
@@ -90,9 +110,8 @@ class Popup:
         return not x <= cur[0] <= x+w or not y <= cur[1] <= y+h 
 
     def _canceled(self):
+        # the area under popup is restored by the owner once popup hidden
         self.show = False
-        self._screen.fill(BG_COLOR)
-        pygame.display.flip()
 
     def hover(self, cur):
         if self._in_confirm(cur):
@@ -102,7 +121,7 @@ class Popup:
             self._hover_confirm = False
             self._hover_cancel = True
         else: # clear hover status
-            self.__hover_confirm = False
+            self._hover_confirm = False
             self._hover_cancel = False
 
 class SetLockMousePopup(Popup):
@@ -119,16 +138,17 @@ class SetLockMousePopup(Popup):
         # Set Lock Mouse Text
         self.__lock_txt_h = super().generate_components(x, y, w, h, LOCK_SCALE)
 
-    def render(self):
-        if not self.show:
-            return
-        super().render()
+    def _state(self):
+        return super()._state()+(self.__temp_lock_txt,)
+
+    def _draw(self, surface):
+        super()._draw(surface)
         # render the set lock mouse text
+        bg = self._local(self._bg)
         text = self.__font.render(f'Set key <{self.__temp_lock_txt}> as mouse lock key', True, TXT_COLOR)
-        x = self._bg.x+POPUP_MARGIN+(self._bg.w-text.get_size()[0])/2
-        y = self._bg.y+POPUP_MARGIN+(self.__lock_txt_h-text.get_size()[1])/2
-        txt_rect = self._screen.blit(text, (x, y))
-        pygame.display.update(txt_rect)
+        x = bg.x+POPUP_MARGIN+(bg.w-text.get_size()[0])/2
+        y = bg.y+POPUP_MARGIN+(self.__lock_txt_h-text.get_size()[1])/2
+        surface.blit(text, (x, y))
 
     def __generate_lock_key_text(self, py_key):
         if py_key in PYGAME_KEY_MAP:
@@ -178,16 +198,22 @@ class WarnPopup(Popup):
         # Alarm Text
         self.__alm_txt_h = super().generate_components(x, y, w, h, WARN_SCALE)
 
-    def render(self):
-        if not self.show or self.send_command not in range(TOTAL_SEND_CMD):
-            return
-        super().render()
+    def render(self, cur, dirty):
+        if self.send_command not in range(TOTAL_SEND_CMD):
+            return []
+        return super().render(cur, dirty)
+
+    def _state(self):
+        return super()._state()+(self.send_command,)
+
+    def _draw(self, surface):
+        super()._draw(surface)
         # render the alarm text
+        bg = self._local(self._bg)
         text = self.__font.render(ALARM_TEXT[self.send_command], True, TXT_COLOR)
-        x = self._bg.x+POPUP_MARGIN+(self._bg.w-text.get_size()[0])/2
-        y = self._bg.y+POPUP_MARGIN+(self.__alm_txt_h-text.get_size()[1])/2
-        txt_rect = self._screen.blit(text, (x, y))
-        pygame.display.update(txt_rect)
+        x = bg.x+POPUP_MARGIN+(bg.w-text.get_size()[0])/2
+        y = bg.y+POPUP_MARGIN+(self.__alm_txt_h-text.get_size()[1])/2
+        surface.blit(text, (x, y))
 
     def input_key(self, py_event):
         if self.show and py_event.type == pygame.KEYUP: # click any key to cancel
@@ -226,13 +252,14 @@ class InputPopup(Popup):
         input_h = super().generate_components(x, y, w, h, INPUTBOX_SCALE)
         self.__input_bg = pygame.Rect(input_x, input_y, input_w, input_h)
 
-    def __render_input_text(self):
+    def __render_input_text(self, surface):
+        input_bg = self._local(self.__input_bg)
         lines = self.__input.splitlines()
         chr_h = self.__font.size('^')[1]
-        start_x = self.__input_bg.x + INPUTBOX_PAD
-        max_x, max_y = [x-INPUTBOX_PAD*2 for x in self.__input_bg.bottomright]
-        max_w = self.__input_bg.w-INPUTBOX_PAD*2
-        x, y = cur_x, cur_y = self.__input_bg.x + INPUTBOX_PAD, self.__input_bg.y + INPUTBOX_PAD
+        start_x = input_bg.x + INPUTBOX_PAD
+        max_x, max_y = [x-INPUTBOX_PAD*2 for x in input_bg.bottomright]
+        max_w = input_bg.w-INPUTBOX_PAD*2
+        x, y = cur_x, cur_y = input_bg.x + INPUTBOX_PAD, input_bg.y + INPUTBOX_PAD
         for line in lines:
             if y+chr_h > max_y: # do not display overflowed charactor
                 break
@@ -241,7 +268,7 @@ class InputPopup(Popup):
                     rem = (max_x-x)/max_w # progress percent of x remain in the width of self.__input_bg
                     offset = max_w*TAB_SCALE*ceil((1-rem)/TAB_SCALE) # \t moved actual offset based on start_x
                     if start_x+offset > max_x:
-                        x = start_x+TAB_SCALE*self.__input_bg.w
+                        x = start_x+TAB_SCALE*input_bg.w
                         y += chr_h
                     else:
                         x = start_x+offset
@@ -253,8 +280,7 @@ class InputPopup(Popup):
                     y += chr_h
                 if y+chr_h > max_y: # do not display overflowed charactor
                     break
-                txt_rect = self._screen.blit(text, (x, y))
-                pygame.display.update(txt_rect)
+                surface.blit(text, (x, y))
                 x += chr_w
             cur_x, cur_y = x, y
             x = start_x # start at newline
@@ -264,19 +290,18 @@ class InputPopup(Popup):
             cur_x, cur_y = x, y
         if cur_y+chr_h <= max_y:
             cursor = self.__cursor.move(cur_x, cur_y)
-            pygame.draw.rect(self._screen, BTN_COLOR_LIGHT, cursor)
-            pygame.display.update(cursor)
+            pygame.draw.rect(surface, BTN_COLOR_LIGHT, cursor)
 
-    def render(self):
-        if not self.show:
-            return
-        super().render()
+    def _state(self):
+        return super()._state()+(self.__input,)
+
+    def _draw(self, surface):
+        super()._draw(surface)
         # render the border and background
-        pygame.draw.rect(self._screen, INPUT_BG_COLOR, self.__input_bg)
-        pygame.display.update(self.__input_bg)
+        pygame.draw.rect(surface, INPUT_BG_COLOR, self._local(self.__input_bg))
 
         # render the inputbox text
-        self.__render_input_text()
+        self.__render_input_text(surface)
 
     def input_key(self, py_event):
         if not self.show or py_event.type == pygame.KEYDOWN:
@@ -341,7 +366,8 @@ class InputPopup(Popup):
         return None
 
 class iKvmClient:
-    def __init__(self, ikvm, mjpg, fullscreen=False, cap_res_in_win=(0, 0), logfile=None, log_level=3):
+    def __init__(self, ikvm, mjpg, fullscreen=False, cap_res_in_win=(0, 0), logfile=None, log_level=3,
+            decode_workers=DECODE_WORKERS):
         """ ikvm: required
                     Kvm instance for sending kvm control command
 
@@ -362,6 +388,9 @@ class iKvmClient:
                     check whether program records log information
                     if argument level in __log_write(level, txt) is less than or equal log_level,
                     then the message txt will be written into logfile
+
+            decode_workers: optional, <int>, default DECODE_WORKERS
+                    number of threads decoding and resizing frames from MJPG-Streamer
         """
         assert isinstance(ikvm, Kvm)
         assert isinstance(mjpg, MjpgClient)
@@ -373,6 +402,7 @@ class iKvmClient:
                 all([x == 0 for x in cap_res_in_win]))
         assert isinstance(logfile, (str, type(None)))
         assert log_level in range(6)
+        assert isinstance(decode_workers, int) and decode_workers > 0
         ## Settings of iKVM
         self.__ikvm = ikvm
         self.__caps = [] # a list of video captures get from ikvm
@@ -381,11 +411,24 @@ class iKvmClient:
 
         ## Settings of Video Capture
         self.__capture = mjpg
+        self.__capture_lock = Lock() # MjpgClient is used by frame fetcher thread and menu actions
+        self.__frames = LatestFrame() # the newest fetched jpeg frame
+        self.__fetcher = FrameFetcher(self.__fetch_frame, self.__frames)
+        self.__decoder = DecodePipeline(self.__frames, lambda: self.__cap_res, decode_workers, self.__post_frame_event)
+        self.__frame_posted = False # FRAME_EVENT posted but not handled yet
+        self.__cap_canvas = None # decoder canvas wrapped by __cap_surface
+        self.__cap_surface = None # surface sharing pixels with decoder canvas
+        self.__cap_res = None
+        self.__cap_redraw = True # whole capture area needs rendering, e.g. screen cleared
 
         ## Settings of PyGame
         self.__run = False
         pygame.init()
         pygame.display.set_caption('iKVM')
+        self.__caption = 'iKVM'
+        self.__rtt_replies = 0 # heartbeat replies shown in caption
+        self.__reconnecting = False # reconnecting to iKVM server, a notice shown over capture area
+        self.__reconnect_txt = None # pre-rendered notice
         self.__fullscreen = fullscreen
         self.__win_x, self.__win_y = 0, 0 # window position
         if cap_res_in_win == (0, 0):
@@ -406,6 +449,7 @@ class iKvmClient:
         self.__side_full_txt = [] # saved full menu items for current menu
         self.__side_show_max = 0 # maximal number of the displayed menu items, recompute whenever __render_main() called
         self.__side_page     = 0 # what part of __side_txt shown in side menu
+        self.__side_menu     = SideMenuLayer() # pre-rendered buttons of displayed menu items
 
         self.__mouse_locked = False # is mouse locked in video capture area
         self.__lock_mouse_key = pygame.K_F7 # click the setted lock key, mouse will lock/unlock in video capture area
@@ -416,6 +460,10 @@ class iKvmClient:
         self.__inputpopup = None
         self.__set_lock_mouse_popup = None
 
+        ## Layers of screen from bottom to top, all drawn areas in a frame are updated at once
+        self.__compositor = Compositor([
+            self.__render_cap_area, self.__render_reconnecting, self.__render_side_button, self.__render_popups])
+
         ## Settings of LOG
         self.log_level = log_level
         self.logfile = logfile
@@ -464,33 +512,52 @@ class iKvmClient:
             if not self.__ikvm.is_run(): # check if the failure reason is disconnected from server
                 self.__log_write(3, "MJPG-Streamer is not running since client is disconnected from iKVM server")
                 return False
+            if self.__ikvm.is_reconnecting(): # MJPG-Streamer restarted after reconnected, connect it next fetch
+                self.__log_write(3, "MJPG-Streamer is not running while reconnecting to iKVM server")
+                return False
             self.__log_write(1, 'Connect MJPG-Streamer failed. Detail: %s. Retry %d' %(res['detail'], i))
             if i == RETRY:
                 self.__log_write(1, 'Exit client as reach the max retry times')
                 self.__run = False
                 return False
 
-    def __response_handler(self):
-        while self.__run:
-            res = self.__ikvm.read_last_send_key_result()
-            if res is not None:
-                self.__log_write(4, 'Echo(Key) => {} <= [{}]'.format(res['detail'], res['result']))
-                if res['detail'] == 'Kvm instance not started':
-                    return
-
-            res = self.__ikvm.read_last_send_mouse_result()
-            if res is not None:
-                self.__log_write(4, 'Echo(Mouse) => {} <= [{}]'.format(res['detail'], res['result']))
-                if res['detail'] == 'Kvm instance not started':
-                    return
-
-            res = self.__ikvm.read_last_send_atx_result()
-            if res is not None:
-                self.__log_write(4, 'Echo(ATX) => {} <= [{}]'.format(res['detail'], res['result']))
-                if res['detail'] == 'Kvm instance not started':
-                    return
-
-            sleep(0.01)
+    def __ack_handler(self, ack): # invoked in ikvm receiving thread for every key/mouse/atx ack
+        request = ack['request']
+        self.__log_write(4, 'Echo(#{}) => {} <= [{}]'.format(ack['seq'], ack['detail'], ack['result']))
+        if ack['result'] != 'success' and request:
+            args = ', '.join([raw(arg)[:LOG_SEND_TXT_MAX_SHOW] for arg in request[1:]])
+            self.__log_write(2, 'iKVM rejected #{} {}({}). Detail: {}'.format(ack['seq'], request[0], args, ack['detail']))
+
+    def __reconnect_handler(self, event): # invoked in ikvm receiving/writer thread as reconnecting progresses
+        if event['event'] == 'lost':
+            if self.__ikvm.rtt_stats()['lost']:
+                self.__log_write(1, 'Heartbeat lost, iKVM server not replied in {} asking'.format(
+                    self.__ikvm.heartbeat_misses))
+            self.__log_write(1, 'Disconnected from iKVM server, now reconnect. Detail: %s' %event['detail'])
+        elif event['event'] == 'retry':
+            self.__log_write(2, 'Reconnect iKVM server failed. Detail: %s. Retry %d' %(event['detail'], event['attempt']))
+        elif event['event'] == 'connected':
+            self.__log_write(3, 'Reconnected to iKVM server, now restore serial device and MJPG-Streamer')
+        elif event['event'] == 'restored':
+            for name, res in event['detail'].items():
+                if res['result'] != 'success':
+                    self.__log_write(1, 'Restore {} failed. Detail: {}'.format(
+                        {'uart': 'serial device', 'mjpg': 'MJPG-Streamer'}[name], res['detail']))
+            self.__log_write(3, 'iKVM session restored')
+        elif event['event'] == 'failed':
+            self.__log_write(1, 'Exit client as reach the max reconnect times')
+
+    def __update_rtt(self): # show heartbeat round-trip time in window caption, log it on every reply
+        stats = self.__ikvm.rtt_stats()
+        if stats['replies'] == self.__rtt_replies:
+            return
+        self.__rtt_replies = stats['replies']
+        self.__log_write(4, 'Heartbeat RTT {:.1f} ms, min {:.1f} ms, avg {:.1f} ms, max {:.1f} ms'.format(
+            *[stats[x]*1000 for x in ('last', 'min', 'avg', 'max')]))
+        caption = 'iKVM - RTT {} ms'.format(round(stats['last']*1000))
+        if caption != self.__caption:
+            self.__caption = caption
+            pygame.display.set_caption(caption)
 
     def __log_write(self, level: int, txt):
         if self.log_level < level:
@@ -513,6 +580,7 @@ class iKvmClient:
 
     def __render_main(self):
         ## Settings of Screen
+        cap_res = self.__cap_res
         if self.__fullscreen:
             gui_w, gui_h = self.__get_resolution()
             self.__cap_res = (gui_w-SIDE_W, gui_h)
@@ -526,6 +594,9 @@ class iKvmClient:
             self.__screen = pygame.display.set_mode((gui_w, gui_h))
 
         self.__side_show_max = show = int(gui_h/BTN_AND_PAD_H)
+        self.__cap_redraw = True # screen cleared
+        if cap_res != self.__cap_res:
+            self.__fetcher.refresh() # decode the last frame in new resolution, a static screen may fetch no new frame
 
         total = len(self.__side_txt)
 
@@ -543,24 +614,10 @@ class iKvmClient:
         txt_size = int(self.__btn_h*SMALL_BTN_TXT_SCALE)
 
         font = pygame.font.SysFont('serif', txt_size)
-        self.__text = [font.render(self.__side_txt[i], True, TXT_COLOR) for i in range(total)]
+        self.__side_menu.generate_buttons(self.__side_txt, self.__btn_pos, (self.__btn_w, self.__btn_h), font)
 
-        txt_pad = (self.__btn_h-font.size(self.__side_txt[0])[1])/2
-
-        self.__txt_pos = [(
-                cap_w+w_shift+(self.__btn_w-font.size(self.__side_txt[i])[0])/2,
-                i*gui_h/show+h_pad+txt_pad) for i in range(total)]
-
-        ## Rendering Screen
-        for i in range(total):
-            pygame.draw.rect(
-                    self.__screen, BTN_COLOR_DARK, [
-                        *self.__btn_pos[i],
-                        self.__btn_w,
-                        self.__btn_h])
-            self.__screen.blit(self.__text[i], self.__txt_pos[i])
-
-        pygame.display.flip()
+        ## Rendering Screen in next frame
+        self.__compositor.invalidate()
 
     def __generate_side_args(self, act, side_no, proto_txt):
         total = len(proto_txt)
@@ -605,57 +662,93 @@ class iKvmClient:
         end_page = int(total/avail) # when total is divisible by avail, function will return avail as back button position
         return total%avail if end_page == self.__side_page else avail
 
-    def __render_side_button(self, cur):
-        total = len(self.__side_txt)
-        for i in range(total):
-            in_btn = self.__in_visible_button(cur, i)
-            btn_rect = pygame.draw.rect(
-                        self.__screen,
-                        BTN_COLOR_LIGHT if in_btn else BTN_COLOR_DARK, [
-                            *self.__btn_pos[i],
-                            self.__btn_w,
-                            self.__btn_h])
-            txt_rect = self.__screen.blit(self.__text[i], self.__txt_pos[i])
-            pygame.display.update(btn_rect)
-            pygame.display.update(txt_rect)
-
-    def __fetch_frame(self):
-        try:
-            cap_out = self.__capture.next_frame()
-        except (TimeoutError, OSError,):
-            cap_out = None
-
-        if cap_out is None:
-            self.__log_write(2, "Fetch frame from MJPG-Streamer timeout, now re-connnect")
-            self.__connect_mjpg()
-            return None
-        elif cap_out['result'] == 'lost':
-            self.__log_write(1, "Disconnected from MJPG-Streamer, now re-connnect")
-            self.__connect_mjpg()
-            return None
-        elif cap_out['result'] == 'error':
-            self.__log_write(2, "Fetch frame from MJPG-Streamer failed. Detail: " + cap_out['detail'])
-            return None
+    def __render_side_button(self, cur, dirty):
+        # light the hovered button, no button hovered while a popup shown
+        hover = None
+        if not (self.__warnpopup.show or self.__inputpopup.show or self.__set_lock_mouse_popup.show):
+            hover = next((i for i in range(len(self.__side_txt)) if self.__in_visible_button(cur, i)), None)
+        return self.__side_menu.render(self.__screen, hover)
+
+    def __render_popups(self, cur, dirty):
+        rects = []
+        for popup in (self.__warnpopup, self.__inputpopup, self.__set_lock_mouse_popup):
+            rects.extend(popup.render(cur, dirty+rects))
+        return rects
+
+    def __render_reconnecting(self, cur, dirty):
+        # notice over the center of capture area while reconnecting, drawn again whenever area under it redrawn
+        if not self.__reconnecting:
+            return []
+        if self.__reconnect_txt is None:
+            self.__reconnect_txt = pygame.font.SysFont('serif', RECONNECT_TXT_SIZE).render(
+                    'Reconnecting to iKVM server...', True, TXT_COLOR)
+        w, h = [x+POPUP_MARGIN*2 for x in self.__reconnect_txt.get_size()]
+        rect = pygame.Rect((self.__cap_res[0]-w)/2, (self.__cap_res[1]-h)/2, w, h)
+        if rect.collidelist(dirty) == -1:
+            return []
+        self.__screen.fill(BG_COLOR, rect)
+        pygame.draw.rect(self.__screen, BORDER_COLOR, rect, BORDER_THICK)
+        self.__screen.blit(self.__reconnect_txt, (rect.x+POPUP_MARGIN, rect.y+POPUP_MARGIN))
+        return [rect]
+
+    def __fetch_frame(self): # invoked in frame fetcher thread
+        with self.__capture_lock:
+            try:
+                cap_out = self.__capture.next_frame()
+            except (TimeoutError, OSError,):
+                cap_out = None
+
+            if (cap_out is None or cap_out['result'] == 'lost') and self.__ikvm.is_reconnecting():
+                return None # MJPG-Streamer re-connected after iKVM session restored
+            elif cap_out is None:
+                self.__log_write(2, "Fetch frame from MJPG-Streamer timeout, now re-connnect")
+                self.__connect_mjpg()
+                return None
+            elif cap_out['result'] == 'lost':
+                self.__log_write(1, "Disconnected from MJPG-Streamer, now re-connnect")
+                self.__connect_mjpg()
+                return None
+            elif cap_out['result'] == 'error':
+                self.__log_write(2, "Fetch frame from MJPG-Streamer failed. Detail: " + cap_out['detail'])
+                return None
 
         return cap_out['detail']
 
-    def __render_cap_area(self):
-        cap_img = self.__fetch_frame()
-        if cap_img is None:
+    def frame_stats(self):
+        """ Return the numbers of frames fetched from MJPG-Streamer and frames dropped without rendering
+        """
+        return {
+                'fetched': self.__fetcher.fetched,
+                'dropped': self.__frames.dropped+self.__decoder.output.dropped,
+                'unchanged': self.__fetcher.unchanged+self.__decoder.unchanged,
+                'failed': self.__decoder.failed}
+
+    def __post_frame_event(self): # invoked in decoder threads
+        # wake up main loop, at most one FRAME_EVENT pending in event queue
+        if self.__frame_posted:
             return
-
-        # Logitech C270i webcam will reproduce the "extraneous bytes" error since the incorrect implementation of mjpeg
-        # refer: https://github.com/opencv/opencv/issues/9477#issuecomment-837104940
-        arr = np.frombuffer(cap_img, np.uint8)
-        frame = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-        # Enlarge prefer INTER_LINEAR/INTER_CUBIC
-        # Shrink prefer INTER_AREA
-        enlarge = self.__cap_res[0]*self.__cap_res[1] > frame.shape[0]*frame.shape[1]
-        interpolation = cv2.INTER_LINEAR if enlarge else cv2.INTER_AREA
-        frame = cv2.resize(frame, self.__cap_res, interpolation=interpolation)
-        cap_img = pygame.image.frombuffer(frame.tobytes(), frame.shape[1::-1], 'BGR').convert_alpha()
-        cap_rect = self.__screen.blit(cap_img, (0, 0))
-        pygame.display.update(cap_rect)
+        self.__frame_posted = True
+        pygame.event.post(pygame.event.Event(FRAME_EVENT))
+
+    def __render_cap_area(self, cur, dirty):
+        # render the newest decoded frame only, skip if no new frame decoded since last rendering
+        res = self.__decoder.output.take()
+        if res is None and not self.__cap_redraw:
+            return []
+        with self.__decoder.lock:
+            canvas = self.__decoder.canvas
+            if canvas is None or canvas.shape[1::-1] != self.__cap_res: # decoded before capture area resized
+                return []
+            # wrap canvas pixels once, later frames decoded into the same canvas are shown by the same surface
+            if canvas is not self.__cap_canvas:
+                self.__cap_canvas = canvas
+                self.__cap_surface = pygame.image.frombuffer(canvas, self.__cap_res, 'BGR')
+            # render changed areas only
+            rects = self.__decoder.take_dirty()
+            if self.__cap_redraw:
+                rects = [(0, 0, *self.__cap_res)]
+                self.__cap_redraw = False
+            return [self.__screen.blit(self.__cap_surface, rect[:2], rect) for rect in rects]
 
     def __in_visible_button(self, cur, no): # check if cursor is in visible button by seqno in __side_txt
         x = self.__btn_pos[no][0]
@@ -741,35 +834,44 @@ class iKvmClient:
         self.__inputpopup = InputPopup(self.__screen)
         self.__inputpopup.generate_components(x, y, w, h)
         self.__log_write(4, 'Created InputPopup component')
-        # Setup clock
-        clock = pygame.time.Clock()
 
         self.__run = True # Starting
-        ## Start thread for handing response from key_send/mouse_send/axt_send
-        Thread(target=self.__response_handler).start()
-        self.__log_write(4, 'Response handler thread start')
+        ## Handle acks of key_send/mouse_send/axt_send as they received
+        self.__ikvm.set_ack_callback(self.__ack_handler)
+        self.__ikvm.set_reconnect_callback(self.__reconnect_handler)
+        ## Start threads for fetching and decoding frames from MJPG-Streamer
+        self.__fetcher.start()
+        self.__decoder.start()
+        self.__log_write(4, 'Frame fetcher and decoder threads start')
 
         ## Exit as 1. user close the window, or 2. mjpg-streamer or ikvm server are not running
         while self.__run:
+            ## Sleep until a new frame decoded, an input event or timeout, instead of polling
+            py_events = [pygame.event.wait(EVENT_WAIT_TIMEOUT), *pygame.event.get()]
+            if any(py_event.type == FRAME_EVENT for py_event in py_events):
+                self.__frame_posted = False
+
             cur = pygame.mouse.get_pos()
+            popup_shown = self.__warnpopup.show or self.__inputpopup.show or self.__set_lock_mouse_popup.show
 
-            ## Rendering Buttons
+            ## Hovering Popup Buttons
             if self.__warnpopup.show:
                 self.__warnpopup.hover(cur)
             elif self.__inputpopup.show:
                 self.__inputpopup.hover(cur)
             elif self.__set_lock_mouse_popup.show:
                 self.__set_lock_mouse_popup.hover(cur)
-            else:
-                self.__render_side_button(cur)
 
-            ## Rendering Video Capture Area
-            self.__render_cap_area()
+            ## Reconnecting notice shown or hidden clears screen
+            if self.__ikvm.is_reconnecting() != self.__reconnecting:
+                self.__reconnecting = not self.__reconnecting
+                self.__screen.fill(BG_COLOR)
+                self.__cap_redraw = True
+                self.__side_menu.invalidate()
+                self.__compositor.invalidate()
 
-            ## Rendering All Popups
-            self.__warnpopup.render()
-            self.__inputpopup.render()
-            self.__set_lock_mouse_popup.render()
+            ## Rendering Video Capture Area, Side Menu and Popups, only changed areas updated
+            self.__compositor.compose(cur)
 
             ## Hide Mouse in Video Capture Area when there is no popup
             cur_in_cap = self.__in_cap(cur)
@@ -782,7 +884,7 @@ class iKvmClient:
                     self.__log_write(4, 'Mouse appeared')
 
             ## Event Handling
-            for py_event in pygame.event.get():
+            for py_event in py_events:
                 ## Close Window
                 if py_event.type == pygame.QUIT:
                     self.__ikvm.release_keys()
@@ -813,13 +915,27 @@ class iKvmClient:
                 elif py_event.type == pygame.MOUSEMOTION:
                     self.__mouse_move_event(cur_in_cap)
 
+            ## Popup closing clears screen
+            if popup_shown and not (self.__warnpopup.show or self.__inputpopup.show or self.__set_lock_mouse_popup.show):
+                self.__screen.fill(BG_COLOR)
+                self.__cap_redraw = True
+                self.__side_menu.invalidate()
+                self.__compositor.invalidate()
+
+            self.__update_rtt()
             if not self.__ikvm.is_run():
+                if self.__ikvm.rtt_stats()['lost'] and not self.__ikvm.reconnect: # logged as reconnecting if enabled
+                    self.__log_write(1, 'Heartbeat lost, iKVM server not replied in {} asking'.format(
+                        self.__ikvm.heartbeat_misses))
                 self.__log_write(3, 'Disconnected from iKVM server')
                 self.__run = False
 
-            clock.tick(120)
-
         # Handling Exit
+        self.__decoder.stop()
+        self.__fetcher.stop()
+        self.__log_write(4, 'Frame fetcher and decoder threads quit. '
+                'Fetched {fetched} frames, dropped {dropped} frames, failed decoding {failed} frames'.format(
+                    **self.frame_stats()))
         if OS == 'WINDOWS' and self.__hooked:
             keyboard.unhook_all()
             self.__log_write(4, 'Keyboard unhooked')
@@ -1064,7 +1180,7 @@ class iKvmClient:
         elif self.__in_side_page(SCREENSHOT_NO) and self.__in_button(cur, SCREENSHOT_NO):
             ## Take a screenshot and save to program running folder
             self.__log_write(4, 'Clicked "%s" button' %self.__side_full_txt[SCREENSHOT_NO])
-            cap_img = self.__fetch_frame()
+            cap_img = self.__frames.peek()[1]
             if cap_img is None:
                 self.__log_write(3, 'Take a screenshot failed')
                 return
@@ -1165,14 +1281,15 @@ class iKvmClient:
                 resolution = self.__caps[i][1][j][0]
                 fps = self.__caps[i][1][j][1][k]
 
-                # close mjpg client
-                self.__capture.close()
-                # Restart MJPG-Streamer with specific arguments
-                if not self.__alt_capture(device, resolution, fps):
-                    return
-                # Re-open mjpg client
-                if not self.__connect_mjpg():
-                    return
+                with self.__capture_lock: # hold frame fetcher until mjpg client re-opened
+                    # close mjpg client
+                    self.__capture.close()
+                    # Restart MJPG-Streamer with specific arguments
+                    if not self.__alt_capture(device, resolution, fps):
+                        return
+                    # Re-open mjpg client
+                    if not self.__connect_mjpg():
+                        return
 
                 # Return to main menu
                 self.__to_main_menu()
@@ -1271,8 +1388,8 @@ class iKvmClient:
         if not self.__mouse_locked and not cur_in_cap: # return when mouse locked as cursor not in video capture
             return
 
-        # get the shifted coordinates
-        rel = tuple(map(lambda x: x if abs(x)<128 else int(copysign(127, x)), pygame.mouse.get_rel()))
+        # get the shifted coordinates, Kvm splits large shifts into steps
+        rel = pygame.mouse.get_rel()
         if rel == (0, 0): # cursor not moved, return
             return
         self.__ikvm.move_mouse(*rel)
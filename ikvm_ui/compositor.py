@@ -0,0 +1,82 @@
+# coding: utf-8
+if __name__ != 'ikvm_ui.compositor':
+    exit()
+from ._globals import *
+import pygame
+
+class Compositor:
+    def __init__(self, layers):
+        """ layers: required, <list> of <callable>
+                    layers from bottom to top, each called as layer(cur, dirty) in compose()
+                    cur is the cursor position, dirty is the list of screen areas drawn by lower layers in this frame
+                    a layer draws onto screen only what changed, or what lies under dirty areas if it is an overlay,
+                    and returns the list of its drawn areas
+        """
+        self.__layers = layers
+        self.__full = True # whole screen needs updating, e.g. screen cleared or display mode changed
+
+    def invalidate(self):
+        """ Update the whole screen in next compose(), every layer sees the whole screen as dirty
+        """
+        self.__full = True
+
+    def compose(self, cur):
+        """ Render all layers bottom-up, then update the drawn areas of display at once
+        """
+        screen = pygame.display.get_surface()
+        dirty = [screen.get_rect()] if self.__full else []
+        for layer in self.__layers:
+            dirty.extend(layer(cur, dirty))
+        if self.__full:
+            self.__full = False
+            pygame.display.flip()
+        elif dirty:
+            pygame.display.update(dirty)
+
+class SideMenuLayer:
+    """ Buttons of side menu, each pre-rendered with its text in dark and light (hovered) variants
+
+        only the buttons whose hover state changed are blitted, all buttons after generate_buttons() or invalidate()
+    """
+    def __init__(self):
+        self.__buttons = [] # (rect, dark surface, light surface) of displayed buttons
+        self.__hover = None # number of the button blitted in light variant
+        self.__redraw = True
+
+    def generate_buttons(self, texts, positions, size, font):
+        """ Pre-render buttons with texts centered, the nth button is placed at positions[n] in size (w, h)
+        """
+        self.__buttons = []
+        for text, pos in zip(texts, positions):
+            rect = pygame.Rect(*pos, *size)
+            txt = font.render(text, True, TXT_COLOR)
+            txt_pos = ((rect.w-txt.get_width())/2, (rect.h-txt.get_height())/2)
+            surfaces = []
+            for color in (BTN_COLOR_DARK, BTN_COLOR_LIGHT):
+                surface = pygame.Surface(rect.size)
+                surface.fill(color)
+                surface.blit(txt, txt_pos)
+                surfaces.append(surface)
+            self.__buttons.append((rect, *surfaces))
+        self.invalidate()
+
+    def invalidate(self):
+        self.__redraw = True
+
+    def render(self, screen, hover):
+        """ Blit buttons onto screen with the button numbered hover lighted, hover is None if no button hovered
+            return the list of blitted areas
+        """
+        if self.__redraw:
+            changed = range(len(self.__buttons))
+            self.__redraw = False
+        elif hover != self.__hover:
+            changed = [no for no in (self.__hover, hover) if no is not None and no < len(self.__buttons)]
+        else:
+            return []
+        self.__hover = hover
+        rects = []
+        for no in changed:
+            rect, dark, light = self.__buttons[no]
+            rects.append(screen.blit(light if no == hover else dark, rect))
+        return rects
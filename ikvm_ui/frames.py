@@ -0,0 +1,337 @@
+# coding: utf-8
+if __name__ != 'ikvm_ui.frames':
+    exit()
+from ._globals import *
+import cv2
+import numpy as np
+import struct, zlib
+from math import ceil
+from threading import Thread, Condition, Event, Lock
+
+# jpeg decoded with DCT-domain scaling when the target is at most 1/scale of the source
+REDUCED_DECODE = (
+        (8, cv2.IMREAD_REDUCED_COLOR_8),
+        (4, cv2.IMREAD_REDUCED_COLOR_4),
+        (2, cv2.IMREAD_REDUCED_COLOR_2),)
+
+def jpeg_size(jpeg):
+    """ Return resolution (w, h) read from SOF segment of jpeg bytes, or None if not found
+    """
+    pos, end = 2, len(jpeg)
+    while pos+4 <= end:
+        if jpeg[pos] != 0xFF:
+            return None
+        marker = jpeg[pos+1]
+        if marker == 0xFF: # fill byte
+            pos += 1
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD7: # standalone markers
+            pos += 2
+        elif marker in (0xD9, 0xDA): # EOI or SOS reached without SOF
+            return None
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC): # SOFn
+            if pos+9 > end:
+                return None
+            h, w = struct.unpack_from('!HH', jpeg, pos+5)
+            return (w, h)
+        else:
+            pos += 2+(jpeg[pos+2]<<8|jpeg[pos+3])
+    return None
+
+def decode_frame(jpeg, size):
+    """ Decode jpeg bytes for displaying in size (w, h), return BGR image or None if not decodable
+        the image is reduced in decoding as much as possible but still not smaller than size
+    """
+    # Decode at 1/2, 1/4 or 1/8 size if it is still not smaller than the target, leaving a small resize only
+    flag = cv2.IMREAD_COLOR
+    src = jpeg_size(jpeg)
+    if src:
+        for scale, reduced in REDUCED_DECODE:
+            if src[0] >= size[0]*scale and src[1] >= size[1]*scale:
+                flag = reduced
+                break
+    # Logitech C270i webcam will reproduce the "extraneous bytes" error since the incorrect implementation of mjpeg
+    # refer: https://github.com/opencv/opencv/issues/9477#issuecomment-837104940
+    arr = np.frombuffer(jpeg, np.uint8)
+    return cv2.imdecode(arr, flag)
+
+def interpolation(src_shape, dst_shape):
+    # Enlarge prefer INTER_LINEAR/INTER_CUBIC
+    # Shrink prefer INTER_AREA
+    enlarge = dst_shape[0]*dst_shape[1] > src_shape[0]*src_shape[1]
+    return cv2.INTER_LINEAR if enlarge else cv2.INTER_AREA
+
+def resize_frame(frame, dst):
+    """ Resize BGR image frame into the preallocated BGR image dst
+    """
+    if frame.shape == dst.shape:
+        np.copyto(dst, frame)
+        return
+    cv2.resize(frame, dst.shape[1::-1], dst=dst, interpolation=interpolation(frame.shape, dst.shape))
+
+def changed_tiles(frame, prev):
+    """ Compare two BGR images with the same shape by TILE_SIZE square tiles
+        return a <bool> array with a value per tile, True if any pixel in the tile changed over TILE_DIFF_THRESHOLD
+    """
+    h, w = frame.shape[:2]
+    th, tw = -(-h//TILE_SIZE), -(-w//TILE_SIZE)
+    diff = np.zeros((th*TILE_SIZE, tw*TILE_SIZE), np.uint8)
+    diff[:h, :w] = cv2.absdiff(frame, prev).max(axis=2)
+    return diff.reshape(th, TILE_SIZE, tw, TILE_SIZE).max(axis=(1, 3)) > TILE_DIFF_THRESHOLD
+
+class LatestFrame:
+    """ Single slot buffer keeping the newest frame only
+
+        put() overwrites the frame which is not taken yet, and the overwritten one is counted in dropped
+        take() hands out every frame at most once, peek() returns the newest frame whether taken or not
+    """
+    def __init__(self):
+        self.__cond = Condition()
+        self.__frame = None
+        self.__taken = True
+        self.__closed = False
+        self.seq = 0 # sequence number of the newest frame
+        self.dropped = 0 # number of frames overwritten or rejected before taken
+
+    def put(self, frame, seq=None):
+        """ Save frame with sequence number seq, or the next sequence number if seq is None
+            return False if seq is not newer than the saved one, the frame is rejected
+        """
+        with self.__cond:
+            if seq is None:
+                seq = self.seq+1
+            elif seq <= self.seq:
+                self.dropped += 1
+                return False
+            if not self.__taken:
+                self.dropped += 1
+            self.__frame, self.seq, self.__taken = frame, seq, False
+            self.__cond.notify()
+            return True
+
+    def take(self, timeout=0):
+        """ Return (seq, frame) not taken yet, or None if no new frame in timeout second(s)
+            timeout=None waits until a new frame arrives or the slot is closed
+        """
+        with self.__cond:
+            if self.__taken and timeout != 0:
+                self.__cond.wait_for(lambda: not self.__taken or self.__closed, timeout)
+            if self.__taken:
+                return None
+            self.__taken = True
+            return (self.seq, self.__frame)
+
+    def peek(self):
+        with self.__cond:
+            return (self.seq, self.__frame)
+
+    def close(self):
+        """ Wake up all threads waiting in take()
+        """
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+
+class FrameFetcher:
+    def __init__(self, fetch, slot, notify=None):
+        """ fetch: required, <callable>
+                    return a frame, or None if no frame fetched
+                    called repeatedly in a dedicated thread, which blocks the thread until a frame arrives
+
+            slot: required, LatestFrame instance
+                    fetched frames are put into the slot, the frames not taken in time are dropped
+
+            notify: optional, <callable>, default None
+                    called in fetching thread whenever a new frame is put into the slot
+        """
+        self.__fetch = fetch
+        self.slot = slot
+        self.__notify = notify
+        self.fetched = 0 # number of frames fetched
+        self.unchanged = 0 # number of fetched frames identical to the previous one, not put into slot
+        self.__last = None # (length, crc32) of the last fetched frame
+        self.__frame = None # the last fetched frame
+        self.__stop = Event()
+        self.__thread = None
+
+    def start(self):
+        self.__stop.clear()
+        self.__thread = Thread(target=self.__fetch_handler, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        self.slot.close()
+        if self.__thread:
+            self.__thread.join()
+
+    def refresh(self):
+        """ Put the last fetched frame into slot again, e.g. it should be decoded in another resolution
+        """
+        frame = self.__frame
+        if frame is not None:
+            self.slot.put(frame)
+
+    def __fetch_handler(self):
+        while not self.__stop.is_set():
+            frame = self.__fetch()
+            if frame is None:
+                self.__stop.wait(FETCH_RETRY_WAIT) # avoid spinning while the stream is unavailable
+                continue
+            self.fetched += 1
+            # skip decoding of static screen, whose jpeg bytes are identical to the previous one
+            last = (len(frame), zlib.crc32(frame))
+            if last == self.__last:
+                self.unchanged += 1
+                continue
+            self.__last, self.__frame = last, frame
+            self.slot.put(frame)
+            if self.__notify:
+                self.__notify()
+
+class DecodePipeline:
+    def __init__(self, source, size, workers=DECODE_WORKERS, notify=None):
+        """ source: required, LatestFrame instance
+                    slot of jpeg frames, each frame is taken and decoded by one of the workers
+
+            size: required, <callable>
+                    return the target resolution (w, h) that frames resized to
+
+            workers: optional, <int>, default DECODE_WORKERS
+                    number of decoding threads, cv2 releases GIL when decoding and resizing
+
+            notify: optional, <callable>, default None
+                    called in decoding thread whenever a new frame is put into self.output
+
+            Decoded frames are resized into self.canvas, a persistent BGR image reallocated only when size changed,
+            then (w, h) is put into self.output with the sequence number of the jpeg
+            a frame decoded later than a newer one is dropped, so output frames never go backwards
+            only the tiles changed since the previous frame are copied into canvas, see take_dirty() for the changed areas
+            workers diff and resize frames without lock, self.lock is held only while writing self.canvas
+            hold self.lock while reading self.canvas and calling take_dirty()
+        """
+        self.__source = source
+        self.__size = size
+        self.__workers = workers
+        self.__notify = notify
+        self.output = LatestFrame()
+        self.lock = Lock()
+        self.canvas = None
+        self.__seq = 0 # sequence number of the frame in canvas
+        self.__prev = None # decoded image as rendered into canvas, compared with the next frame by tiles
+        self.__dirty = None # list of changed areas (x, y, w, h) in canvas not taken yet, None if the whole canvas
+        self.failed = 0 # number of frames failed decoding
+        self.unchanged = 0 # number of decoded frames without changed tile
+        self.__stop = Event()
+        self.__threads = []
+
+    def start(self):
+        self.__stop.clear()
+        self.__threads = [Thread(target=self.__decode_handler, daemon=True) for i in range(self.__workers)]
+        for thread in self.__threads:
+            thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        self.__source.close()
+        self.output.close()
+        for thread in self.__threads:
+            thread.join()
+
+    def __decode_handler(self):
+        scaled = None # image of the whole frame resized to size, owned by this worker
+        while not self.__stop.is_set():
+            res = self.__source.take(timeout=None)
+            if res is None:
+                continue
+            seq, jpeg = res
+            size = self.__size()
+            frame = decode_frame(jpeg, size)
+            if frame is None:
+                self.failed += 1
+                continue
+            if scaled is None or scaled.shape[1::-1] != size:
+                scaled = np.empty((size[1], size[0], 3), np.uint8)
+            with self.lock:
+                prev = self.__prev if self.canvas is not None and self.canvas.shape[1::-1] == size else None
+            ## Diff and resize without lock, done again if another worker changed canvas meanwhile
+            while True:
+                if prev is None or prev.shape != frame.shape:
+                    tiles = None
+                else:
+                    tiles = changed_tiles(frame, prev)
+                    if tiles.mean() > TILE_FULL_RATIO:
+                        tiles = None
+                if tiles is None:
+                    image = frame if frame.shape == scaled.shape else scaled
+                    resize_frame(frame, image) if image is scaled else None
+                    shown, areas = frame, None
+                elif tiles.any():
+                    shown, areas = self.__render_tiles(frame, prev, tiles, scaled)
+                ## Only the canvas written with lock held
+                with self.lock:
+                    if seq <= self.__seq: # a newer frame is already in canvas
+                        self.output.dropped += 1
+                        break
+                    if self.canvas is None or self.canvas.shape[1::-1] != size:
+                        self.canvas = np.empty((size[1], size[0], 3), np.uint8)
+                        self.__prev = None
+                    if self.__prev is not prev:
+                        prev = self.__prev
+                        continue
+                    self.__seq = seq
+                    if tiles is not None and not tiles.any():
+                        self.unchanged += 1
+                        break
+                    if areas is None:
+                        np.copyto(self.canvas, image)
+                        self.__dirty = None
+                    else:
+                        for (x, y, w, h), pixels in areas:
+                            self.canvas[y:y+h, x:x+w] = pixels
+                        if self.__dirty is not None:
+                            self.__dirty.extend([rect for rect, _ in areas])
+                    self.__prev = shown
+                if self.output.put(size, seq) and self.__notify:
+                    self.__notify()
+                break
+
+    def __render_tiles(self, frame, prev, tiles, scaled):
+        """ Cut changed tiles of frame for canvas, each run of changed tiles in a row as an area, invoked without lock
+            return prev updated by the changed tiles, and the list of (area (x, y, w, h) in canvas, pixels)
+            a scaled canvas takes areas of the whole frame resized into scaled, grown by the pixels interpolated
+            from the run, so they are identical to resize_frame() and no seam is left along tile borders
+        """
+        h, w = frame.shape[:2]
+        ch, cw = scaled.shape[:2]
+        sy, sx = ch/h, cw/w
+        if frame.shape == scaled.shape:
+            src, margin = frame, 0
+        else:
+            resize_frame(frame, scaled)
+            src, margin = scaled, ceil(max(sx, sy, 1))
+        shown = prev.copy()
+        areas = []
+        for ty, row in enumerate(tiles):
+            if not row.any():
+                continue
+            y0, y1 = ty*TILE_SIZE, min((ty+1)*TILE_SIZE, h)
+            dy0, dy1 = max(round(y0*sy)-margin, 0), min(round(y1*sy)+margin, ch)
+            # boundaries of runs, e.g. row [0 1 1 0 1] -> [1 3 4 5] as runs [1, 3) and [4, 5)
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], row.astype(np.int8), [0]))))
+            for tx0, tx1 in zip(edges[::2], edges[1::2]):
+                x0, x1 = tx0*TILE_SIZE, min(tx1*TILE_SIZE, w)
+                dx0, dx1 = max(round(x0*sx)-margin, 0), min(round(x1*sx)+margin, cw)
+                shown[y0:y1, x0:x1] = frame[y0:y1, x0:x1]
+                if dx1 <= dx0 or dy1 <= dy0:
+                    continue
+                areas.append(((dx0, dy0, dx1-dx0, dy1-dy0), src[dy0:dy1, dx0:dx1]))
+        return shown, areas
+
+    def take_dirty(self):
+        """ Return areas (x, y, w, h) of canvas changed since last call, the whole canvas if many changed
+        """
+        dirty, self.__dirty = self.__dirty, []
+        if dirty is None or len(dirty) > TILE_MAX_RECTS:
+            h, w = self.canvas.shape[:2]
+            return [(0, 0, w, h)]
+        return dirty
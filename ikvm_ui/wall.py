@@ -0,0 +1,322 @@
+# coding: utf-8
+if __name__ != 'ikvm_ui.wall':
+    exit()
+from ikvm import *
+from ._globals import *
+from .frames import LatestFrame, FrameFetcher, decode_frame, resize_frame, changed_tiles
+from .compositor import Compositor
+import pygame
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+from collections import deque
+from functools import partial
+from time import perf_counter
+from math import ceil, sqrt
+from screeninfo import get_monitors
+
+_buffers = {} # tile number: shared memory of the tile attached in decoding process
+
+def _decode_tile(no, name, size, jpeg):
+    """ Invoked in decoding process, decode jpeg into shared memory name as BGR image in size (w, h) for tile no
+        the image is written only if changed, return the ratio of TILE_SIZE squares changed, or None if not decodable
+    """
+    shm = _buffers.get(no)
+    if shm is None or shm.name != name:
+        if shm is not None:
+            shm.close()
+        shm = _buffers[no] = shared_memory.SharedMemory(name)
+    frame = decode_frame(jpeg, size)
+    if frame is None:
+        return None
+    image = np.empty((size[1], size[0], 3), np.uint8)
+    resize_frame(frame, image)
+    shown = np.ndarray(image.shape, np.uint8, shm.buf)
+    ratio = float(changed_tiles(image, shown).mean())
+    if ratio:
+        np.copyto(shown, image)
+    del shown # release buffer of shared memory
+    return ratio
+
+def refresh_interval(ratio):
+    """ Second(s) a tile waits before its next frame decoded, shorter as more of the tile changed by ratio
+    """
+    busy = min(ratio/WALL_CHANGE_FULL, 1)
+    return WALL_REFRESH_MAX-(WALL_REFRESH_MAX-WALL_REFRESH_MIN)*busy
+
+class WallTile:
+    def __init__(self, name, url, notify):
+        self.name = name
+        self.url = url
+        self.mjpg = MjpgClient()
+        self.opened = False # MjpgClient opened, re-opened in next fetch if False
+        self.slot = LatestFrame()
+        self.fetcher = FrameFetcher(self.__fetch, self.slot, notify)
+        self.rect = None # image area on screen
+        self.shm = None # shared memory with BGR image decoded in size of rect
+        self.surface = None # surface sharing pixels with self.shm
+        self.jpeg = None # the newest jpeg waiting for decoding
+        self.busy = False # jpeg being decoded into self.shm, not read until done
+        self.dirty = False # self.shm changed and not rendered yet
+        self.due = 0 # perf_counter() time when the next jpeg can be decoded
+        self.dropped = 0 # number of frames replaced by a newer one before decoded
+        self.decoded = 0 # number of frames decoded
+        self.skipped = 0 # number of decoded frames without changed square, not rendered
+        self.failed = 0 # number of frames failed decoding
+
+    def __fetch(self): # invoked in frame fetcher thread
+        if not self.opened:
+            if self.mjpg.open(self.url)['result'] != 'success':
+                return None
+            self.opened = True
+        try:
+            cap_out = self.mjpg.next_frame()
+        except (TimeoutError, OSError,):
+            cap_out = None
+        if cap_out is None or cap_out['result'] == 'lost':
+            self.opened = False
+            return None
+        elif cap_out['result'] == 'error':
+            return None
+        return cap_out['detail']
+
+class KvmWall:
+    def __init__(self, streams, on_select=None, fullscreen=False, resolution=(0, 0), processes=WALL_DECODE_PROCESSES):
+        """ streams: required, <list> of (<str>, <str>)
+                    name and mjpg-streamer url of each tile, tiles placed row by row
+
+            on_select: optional, <callable>, default None
+                    called as on_select(no) when the tile numbered no clicked, e.g. open the interactive session
+                    the wall window is closed and frames are not fetched until it returns
+
+            fullscreen: optional, <bool>, default False
+                    show the wall in fullscreen mode when value is True
+
+            resolution: optional, <tuple> with 2 <int>, default (0, 0)
+                    window resolution in windowed mode, use (0, 0) as adaptive screen size
+
+            processes: optional, <int>, default WALL_DECODE_PROCESSES
+                    number of processes decoding and resizing frames, images passed back by shared memory
+
+            Each tile is decoded at reduced resolution in its own size, at most one frame of a tile at the same time
+            a tile changing less waits longer before decoding its next frame, see refresh_interval()
+        """
+        assert len(streams) > 0
+        assert all([isinstance(name, str) and isinstance(url, str) for name, url in streams])
+        assert isinstance(fullscreen, bool)
+        assert isinstance(resolution, tuple) and len(resolution) == 2
+        assert all([isinstance(x, int) for x in resolution])
+        assert isinstance(processes, int) and processes > 0
+        self.__tiles = [WallTile(name, url, self.__post_event) for name, url in streams]
+        self.__on_select = on_select
+        self.__fullscreen = fullscreen
+        if resolution == (0, 0):
+            w, h = get_monitors()[0].width, get_monitors()[0].height
+            self.__resolution = (w-160, h-90)
+        else:
+            self.__resolution = resolution
+        self.__processes = processes
+        self.__pool = None
+        self.__done = deque() # (tile number, changed ratio) decoded and not applied yet
+        self.__posted = False # WALL_EVENT posted but not handled yet
+        self.__hover = None # number of the tile with border drawn
+        self.__run = False
+
+        ## Layers of screen from bottom to top, all drawn areas in a frame are updated at once
+        self.__compositor = Compositor([self.__render_tiles, self.__render_labels, self.__render_hover])
+
+    def start(self):
+        ## Decoding processes created before frame fetcher threads started and pygame initialized
+        #  they share the resource tracker of this process, which would unlink shared memory as a process exits
+        if os.name == 'posix':
+            resource_tracker.ensure_running()
+        self.__pool = ProcessPoolExecutor(self.__processes)
+        self.__pool.submit(int).result()
+
+        pygame.init()
+        self.__open_display()
+        self.__layout()
+        for tile in self.__tiles:
+            tile.fetcher.start()
+
+        self.__run = True
+        while self.__run:
+            ## Sleep until a frame fetched or decoded, an input event or the next tile refresh
+            py_events = [pygame.event.wait(self.__wait_timeout()), *pygame.event.get()]
+            if any(py_event.type == WALL_EVENT for py_event in py_events):
+                self.__posted = False
+
+            self.__apply_decoded()
+            self.__schedule()
+            cur = pygame.mouse.get_pos()
+            self.__compositor.compose(cur)
+
+            for py_event in py_events:
+                if py_event.type == pygame.QUIT:
+                    self.__run = False
+                elif py_event.type in (pygame.WINDOWMOVED, pygame.WINDOWRESTORED):
+                    self.__redraw()
+                elif py_event.type == pygame.MOUSEBUTTONUP and py_event.button == MOUSE_LEFT:
+                    no = self.__tile_at(cur)
+                    if no is not None and self.__on_select:
+                        self.__select(no)
+
+        # Handling Exit
+        for tile in self.__tiles:
+            tile.fetcher.stop()
+            tile.mjpg.close()
+        self.__pool.shutdown(cancel_futures=True)
+        pygame.quit()
+        for tile in self.__tiles:
+            tile.surface = None
+            tile.shm.close()
+            tile.shm.unlink()
+
+    def frame_stats(self):
+        """ Return the numbers of frames of each tile by name, see iKvmClient.frame_stats()
+        """
+        return {tile.name: {
+                'fetched': tile.fetcher.fetched,
+                'decoded': tile.decoded,
+                'dropped': tile.slot.dropped+tile.dropped,
+                'unchanged': tile.fetcher.unchanged+tile.skipped,
+                'failed': tile.failed} for tile in self.__tiles}
+
+    def __open_display(self):
+        if self.__fullscreen:
+            self.__screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+        else:
+            self.__screen = pygame.display.set_mode(self.__resolution)
+        pygame.display.set_caption('iKVM Wall')
+        font = pygame.font.SysFont('serif', WALL_TXT_SIZE)
+        self.__labels = [font.render(tile.name, True, TXT_COLOR) for tile in self.__tiles]
+        self.__redraw()
+
+    def __layout(self):
+        """ Place tiles in a grid filling the screen, each with shared memory for its image in the tile size
+        """
+        n = len(self.__tiles)
+        cols = ceil(sqrt(n))
+        rows = ceil(n/cols)
+        gui_w, gui_h = self.__screen.get_size()
+        w = max((gui_w-WALL_PAD*(cols+1))//cols, 1)
+        h = max((gui_h-WALL_PAD*(rows+1))//rows-WALL_LABEL_H, 1)
+        for no, tile in enumerate(self.__tiles):
+            row, col = divmod(no, cols)
+            tile.rect = pygame.Rect(WALL_PAD+col*(w+WALL_PAD), WALL_PAD+row*(h+WALL_LABEL_H+WALL_PAD), w, h)
+            tile.shm = shared_memory.SharedMemory(create=True, size=w*h*3)
+            tile.surface = pygame.image.frombuffer(tile.shm.buf, (w, h), 'BGR')
+
+    def __redraw(self):
+        self.__screen.fill(BG_COLOR)
+        for tile in self.__tiles:
+            tile.dirty = True
+        self.__hover = None
+        self.__compositor.invalidate()
+
+    def __post_event(self): # invoked in fetcher threads and the result thread of decoding processes
+        # wake up main loop, at most one WALL_EVENT pending in event queue
+        if self.__posted:
+            return
+        self.__posted = True
+        pygame.event.post(pygame.event.Event(WALL_EVENT))
+
+    def __decoded(self, no, future): # invoked in the result thread of decoding processes
+        try:
+            ratio = future.result()
+        except Exception: # process pool broken or shut down, the frame given up
+            ratio = None
+        self.__done.append((no, ratio))
+        self.__post_event()
+
+    def __apply_decoded(self):
+        now = perf_counter()
+        while self.__done:
+            no, ratio = self.__done.popleft()
+            tile = self.__tiles[no]
+            tile.busy = False
+            if ratio is None:
+                tile.failed += 1
+                tile.due = now+WALL_REFRESH_MIN
+                continue
+            tile.decoded += 1
+            tile.due = now+refresh_interval(ratio)
+            if ratio:
+                tile.dirty = True
+            else:
+                tile.skipped += 1
+
+    def __schedule(self):
+        """ Decode the newest jpeg of each idle tile whose refresh time reached
+        """
+        now = perf_counter()
+        for no, tile in enumerate(self.__tiles):
+            res = tile.slot.take()
+            if res is not None:
+                if tile.jpeg is not None: # the jpeg waiting before is dropped
+                    tile.dropped += 1
+                tile.jpeg = res[1]
+            if tile.busy or tile.jpeg is None or now < tile.due:
+                continue
+            tile.busy = True
+            future = self.__pool.submit(_decode_tile, no, tile.shm.name, tile.rect.size, tile.jpeg)
+            tile.jpeg = None
+            future.add_done_callback(partial(self.__decoded, no))
+
+    def __wait_timeout(self): # millisecond(s) until a waiting jpeg can be decoded, at most EVENT_WAIT_TIMEOUT
+        due = [tile.due for tile in self.__tiles if tile.jpeg is not None and not tile.busy]
+        if not due:
+            return EVENT_WAIT_TIMEOUT
+        return min(max(ceil((min(due)-perf_counter())*1000), 0), EVENT_WAIT_TIMEOUT)
+
+    def __render_tiles(self, cur, dirty):
+        # render tiles with a new image, a tile being decoded is rendered after done
+        rects = []
+        for tile in self.__tiles:
+            if tile.dirty and not tile.busy:
+                tile.dirty = False
+                rects.append(self.__screen.blit(tile.surface, tile.rect))
+        return rects
+
+    def __render_labels(self, cur, dirty):
+        # names under tiles, drawn with the whole screen only
+        rects = []
+        for tile, label in zip(self.__tiles, self.__labels):
+            rect = pygame.Rect(tile.rect.x, tile.rect.bottom, tile.rect.w, WALL_LABEL_H)
+            if rect.collidelist(dirty) != -1:
+                self.__screen.set_clip(rect)
+                rects.append(self.__screen.blit(label, (rect.x, rect.y+(rect.h-label.get_height())/2)))
+                self.__screen.set_clip(None)
+        return rects
+
+    def __render_hover(self, cur, dirty):
+        # border around the hovered tile in padding, drawn only if hover changed
+        hover = self.__tile_at(cur)
+        if hover == self.__hover:
+            return []
+        rects = []
+        for no, color in ((self.__hover, BG_COLOR), (hover, BORDER_COLOR)):
+            if no is not None:
+                rect = self.__tiles[no].rect.inflate(BORDER_THICK*2, BORDER_THICK*2)
+                rects.append(pygame.draw.rect(self.__screen, color, rect, BORDER_THICK))
+        self.__hover = hover
+        return rects
+
+    def __tile_at(self, cur): # number of the tile under cursor, None if no tile
+        return next((no for no, tile in enumerate(self.__tiles) if tile.rect.collidepoint(cur)), None)
+
+    def __select(self, no):
+        """ Pause the wall and call on_select(no), then show the wall again
+        """
+        for tile in self.__tiles:
+            tile.fetcher.stop()
+            tile.mjpg.close()
+            tile.opened = False
+        pygame.quit()
+        self.__on_select(no)
+        pygame.init()
+        self.__posted = False
+        self.__open_display()
+        for tile in self.__tiles:
+            tile.fetcher.start()